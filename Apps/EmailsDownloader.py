@@ -32,6 +32,8 @@ if __name__ == '__main__':
     argsparser.add_argument("--host", default="imap.exmail.qq.com", help="imap server host.")
     argsparser.add_argument("--sqlite-db", default=None, help="sqlite database for emails summary info.")
     argsparser.add_argument("--threads", default=4, type=int, help="thread number for downloading emails.")
+    argsparser.add_argument("--batch", default=50, type=int, help="emails number fetched by one request.")
+    argsparser.add_argument("--idle", action="store_true", help="wait for new emails by IMAP IDLE instead of polling only.")
     argsparser.add_argument("--save-to-ceph", action="store_true", help="saving email to ceph or not.")
     argsparser.add_argument("--ceph-bucket", type=str, required="--save-to-ceph" in sys.argv, help="s3 bucket name.")
     argsparser.add_argument("--save-to-avenger", action="store_true", help="saving email to avenger or not.")
@@ -63,14 +65,17 @@ if __name__ == '__main__':
     uid_downloader = [
         UIDDownloader(imap_box=box,
                       save_to_ceph=args.save_to_ceph, bucket=args.ceph_bucket,
-                      sqlite_db=args.sqlite_db,)
+                      sqlite_db=args.sqlite_db,
+                      batch=args.batch)
         for box in boxes
     ]
     [ud.start() for ud in uid_downloader]
 
     uid_producer = ProduceUID(
         imap_box=IMAPBox(hostname=args.host, username=args.username, password=args.password),
-        boxes=args.box
+        boxes=args.box,
+        sqlite_db=args.sqlite_db,
+        idle=args.idle
     )
     uid_producer.start()
 
@@ -0,0 +1,79 @@
+# !/usr/bin/python
+# coding=utf8
+"""
+
+在单个进程中监控并下载多个邮箱账户的邮件(asyncio), 账户配置为 JSON 文件:
+
+    [
+        {"username": "fund01@xx.com", "password": "***", "host": "imap.exmail.qq.com", "box": ["INBOX"]},
+        ...
+    ]
+
+host 默认为 imap.exmail.qq.com, box 默认为 INBOX 和 Junk.
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from X2.XMessage.xmail.container import MailEntity, MailContext, Attachment
+from X2.XMessage.xmail.engine import AsyncMailEngine, MailAccount
+from X2.XMessage.xmail.record import RecordsStorage
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    argsparser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter)
+    argsparser.add_argument("-a", "--accounts", required=True, help="json file of email accounts.")
+    argsparser.add_argument("--sqlite-db", default=None, help="sqlite database for emails summary info.")
+    argsparser.add_argument("--max-connections-per-server", default=4, type=int, help="concurrent requests to one server.")
+    argsparser.add_argument("--workers", default=16, type=int, help="coroutine number for downloading emails.")
+    argsparser.add_argument("--storage-workers", default=4, type=int, help="thread number for parsing and saving emails.")
+    argsparser.add_argument("--batch", default=50, type=int, help="emails number fetched by one request.")
+    argsparser.add_argument("--lookup-interval", default=120, type=int, help="seconds between searching new emails.")
+    argsparser.add_argument("--save-to-ceph", action="store_true", help="saving email to ceph or not.")
+    argsparser.add_argument("--ceph-bucket", type=str, required="--save-to-ceph" in sys.argv, help="s3 bucket name.")
+    argsparser.add_argument("--save-to-localhost", action="store_true", help="saving email to localhost or not.")
+    argsparser.add_argument("--localhost-directory", type=str, required="--save-to-localhost" in sys.argv, help="localhost directory path.")
+
+    args = argsparser.parse_args()
+    assert args.save_to_ceph or args.save_to_localhost
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(threadName)10s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    with open(args.accounts, mode='r', encoding='utf8') as accounts_file:
+        accounts = [MailAccount(hostname=account.get("host", "imap.exmail.qq.com"),
+                                username=account["username"],
+                                password=account["password"],
+                                boxes=account.get("box") or ('INBOX', 'Junk'))
+                    for account in json.load(accounts_file)]
+
+    recorder = RecordsStorage(sqlite_path=args.sqlite_db)
+
+    def record(mail_data, *trigger_args, **trigger_kwargs):
+        if isinstance(mail_data, MailEntity):
+            recorder.insert_mail_summary(mail_data, *trigger_args, **trigger_kwargs)
+        elif isinstance(mail_data, (MailContext, Attachment)):
+            recorder.insert_mail_file_info(mail_data, *trigger_args, **trigger_kwargs)
+
+    def store(mail: MailEntity):
+        if args.save_to_ceph:
+            mail.write_to_ceph(bucket=args.ceph_bucket, prefix=mail.attr.user, trigger=[record])
+        if args.save_to_localhost:
+            mail.write_to_unix(directory=args.localhost_directory, trigger=[record])
+
+    engine = AsyncMailEngine(accounts, store=store, on_error=recorder.write_error_download,
+                             max_connections_per_server=args.max_connections_per_server,
+                             workers=args.workers, storage_workers=args.storage_workers,
+                             batch=args.batch, lookup_interval=args.lookup_interval,
+                             sqlite_db=args.sqlite_db)
+    asyncio.run(engine.run())
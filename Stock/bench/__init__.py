@@ -0,0 +1,3 @@
+# coding=utf8
+
+""" 解析性能基准 """
@@ -0,0 +1,71 @@
+# coding=utf8
+
+"""
+解析器分发基准: 对比逐一调用 match 与 ParserRegistry 倒排索引筛选后再 match 的耗时
+
+    python -m Stock.bench.dispatch --counts 10 100 1000
+"""
+
+import json
+import time
+import numpy
+import pandas
+from Stock.exchange.parsers import MainlandParser, HORIZON_TAGS
+from Stock.exchange.parsers.registry import ParserRegistry, scan_tokens
+
+
+def make_parser(n: int):
+    """ 生成第 n 个券商的解析器, 以券商专属标题作为特征关键词 """
+    title = f"券商{n:04d}客户对账单"
+
+    def match(self, data, **data_attrs):
+        return title in scan_tokens(data)
+
+    return type(f"BenchParser{n}", (MainlandParser,), {
+        "_PARSER_NAME": f"bench_{n}",
+        "_FOR_TYPE": "excel",
+        "_FOR_REGION": "Mainland",
+        "_SIGNATURES": (title, HORIZON_TAGS, u"证券代码"),
+        "match": match,
+    })
+
+
+def make_statement(n: int, rows: int = 2000) -> pandas.DataFrame:
+    head = [[f"券商{n:04d}客户对账单", numpy.nan, numpy.nan],
+            [HORIZON_TAGS[0], "1001234", numpy.nan],
+            [u"证券代码", u"证券名称", u"市值"]]
+    body = [[f"{600000 + i}", f"股票{i}", float(i)] for i in range(rows)]
+    return pandas.DataFrame(head + body, dtype=object)
+
+
+def bench(count: int, repeat: int = 5):
+    parsers = [make_parser(n) for n in range(count)]
+    registry = ParserRegistry()
+    for parser in parsers:
+        registry.register(parser)
+    statement = make_statement(count - 1)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for parser in parsers:
+            if parser().match(statement):
+                break
+    linear = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        registry.match(statement)
+    indexed = (time.perf_counter() - start) / repeat
+    return {"parsers": count, "linear_seconds": linear, "indexed_seconds": indexed}
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("--counts", default=[10, 100, 1000], type=int, nargs='+', help="parser numbers.")
+    argsparser.add_argument("--repeat", default=5, type=int, help="repeat times of each measurement.")
+    args = argsparser.parse_args()
+
+    print(json.dumps([bench(count, args.repeat) for count in args.counts], indent=2))
@@ -0,0 +1,128 @@
+# coding=utf8
+
+"""
+解析流程基准: 对模拟对账单分别计时 读取/切分/列调整/类型整理 各阶段, 以 JSON 输出便于跨版本比较
+
+    python -m Stock.bench.pipeline --rows 1000 10000 100000 --dirty 0.05 --formats excel csv txt > bench.json
+"""
+
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy
+import pandas
+from Stock.bench.statement import FORMATS, SECTION_TYPES, make_statement, write_statement
+from Stock.exchange.parsers import MainlandParser, RegionSpec, comfort_table, comfort_trade_flow
+from X2.XExcel.read import read_excel_by_filepath, read_excel_by_fileflow, iter_text_lines
+
+# 各数据块切分规则: 表头取标准列中不含空白的前两列
+SPECS = [RegionSpec(name, [column for pos, column in enumerate(stdtype) if pos % 3][:2])
+         for name, stdtype in SECTION_TYPES.items()]
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _read_file(filepath: str, fmt: str):
+    if fmt == "txt":
+        return list(iter_text_lines(filepath))
+    return read_excel_by_filepath(filepath)
+
+
+def _read_flow(filepath: str):
+    with open(filepath, mode="rb") as handler:
+        return read_excel_by_fileflow(handler.read())
+
+
+def _split(table: pandas.DataFrame):
+    return MainlandParser().split_tables(table, SPECS)
+
+
+def _adjust(regions):
+    adjusted = {}
+    for name, region in regions.items():
+        if region is None:
+            continue
+        adjusted[name] = MainlandParser.adjust_columns(list(SECTION_TYPES[name]), region.columns,
+                                                       region.copy())
+    return adjusted
+
+
+def _comfort(adjusted):
+    return {name: comfort_trade_flow(table) if name == "trade_flow" else comfort_table(table, SECTION_TYPES[name])
+            for name, table in adjusted.items()}
+
+
+def bench(rows: int, fmt: str, dirty_ratio: float = 0.0, workdir: str = None) -> dict:
+    """
+    单个规模、单个格式的各阶段耗时(秒)
+
+    Args:
+        rows: 交易流水行数
+        fmt: excel/csv/txt
+        dirty_ratio: 数值单元格中脏数据比例
+        workdir: 文件输出目录
+
+    Returns: 计时结果, 读取失败时 error 为失败原因且后续阶段不计时
+    """
+    statement = make_statement(rows, dirty_ratio)
+    filepath = write_statement(statement, os.path.join(workdir, f"statement_{rows}"), fmt)
+    record = {"format": fmt, "rows": rows, "dirty_ratio": dirty_ratio,
+              "file_bytes": os.path.getsize(filepath), "error": None}
+
+    try:
+        data, record["read_seconds"] = _timed(_read_file, filepath, fmt)
+        if fmt != "txt":
+            _, record["read_fileflow_seconds"] = _timed(_read_flow, filepath)
+    except Exception as exc:
+        record["error"] = f"{type(exc).__name__}: {exc}"
+        return record
+    finally:
+        os.remove(filepath)
+    if fmt == "txt":
+        # 文本对账单通过 Event 逐行解析, 不经过整表切分
+        record["lines"] = len(data)
+        return record
+    if getattr(data, "error", False):
+        record["error"] = "read failed"
+        return record
+
+    table = next(iter(data.values()))
+    regions, record["split_seconds"] = _timed(_split, table)
+    adjusted, record["adjust_seconds"] = _timed(_adjust, regions)
+    comforted, record["comfort_seconds"] = _timed(_comfort, adjusted)
+    record["parsed_rows"] = {name: len(frame) for name, frame in comforted.items()}
+    return record
+
+
+def run(rows=(1000, 10000, 100000), formats=FORMATS, dirty_ratio: float = 0.0) -> dict:
+    workdir = tempfile.mkdtemp(prefix="skywalker_bench_")
+    try:
+        results = [bench(count, fmt, dirty_ratio, workdir) for count in rows for fmt in formats]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "python": platform.python_version(),
+        "pandas": pandas.__version__,
+        "numpy": numpy.__version__,
+        "results": results,
+    }
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import json
+
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("--rows", default=[1000, 10000, 100000], type=int, nargs='+', help="trade flow rows.")
+    argsparser.add_argument("--formats", default=list(FORMATS), nargs='+', choices=FORMATS, help="file formats.")
+    argsparser.add_argument("--dirty", default=0.0, type=float, help="dirty numeric cells ratio.")
+    args = argsparser.parse_args()
+
+    print(json.dumps(run(args.rows, args.formats, args.dirty), indent=2, ensure_ascii=False))
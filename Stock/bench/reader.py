@@ -0,0 +1,99 @@
+# coding=utf8
+
+"""
+表格读取基准: 在混合格式文件集合上对比 按异常逐个尝试解析 与 按文件开头字节识别格式 两种读取方式
+
+    python -m Stock.bench.reader --rows 2000 --repeat 3
+"""
+
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from io import BytesIO
+import pandas
+import xlrd
+from Stock.bench.statement import make_statement
+from X2.XExcel.read import read_excel_by_fileflow
+
+
+def _trial_and_error(fileflow: bytes) -> OrderedDict:
+    """ 识别格式前的读取顺序: openpyxl -> xlrd -> xlrd(GB18030) -> csv(GB18030), 仅作为对照 """
+    try:
+        return OrderedDict(pandas.read_excel(BytesIO(fileflow), sheet_name=None, header=None, engine='openpyxl'))
+    except (zipfile.BadZipfile, KeyError, ValueError):
+        pass
+    try:
+        try:
+            book = xlrd.open_workbook(file_contents=fileflow)
+        except UnicodeDecodeError:
+            book = xlrd.open_workbook(file_contents=fileflow, encoding_override="GB18030")
+        return OrderedDict(pandas.read_excel(book, sheet_name=None, header=None, engine='xlrd'))
+    except xlrd.XLRDError:
+        pass
+    try:
+        return OrderedDict({'default': pandas.read_csv(BytesIO(fileflow), encoding='GB18030', header=None)})
+    except (UnicodeDecodeError, pandas.errors.ParserError, pandas.errors.EmptyDataError):
+        return OrderedDict()
+
+
+def make_corpus(rows: int) -> OrderedDict:
+    """ 不同格式的对账单文件内容 """
+    statement = make_statement(rows)
+    workbook = BytesIO()
+    statement.to_excel(workbook, header=False, index=False)
+    csv_text = statement.to_csv(header=False, index=False)
+    html = u"<html><body>" + statement.head(min(rows, 200)).to_html(header=False, index=False) + u"</body></html>"
+    return OrderedDict([
+        ("xlsx", workbook.getvalue()),
+        ("csv_gb18030", csv_text.encode("GB18030")),
+        ("csv_utf8", csv_text.encode("utf-8")),
+        ("html_xls", html.encode("utf-8")),
+        ("garbage", bytes(range(256)) * max(rows // 10, 1)),
+        ("empty", b""),
+    ])
+
+
+def _time(reader, fileflow: bytes, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            result = reader(fileflow)
+        except Exception as exc:
+            result = type(exc).__name__
+    return (time.perf_counter() - start) / repeat, result
+
+
+def bench(rows: int = 2000, repeat: int = 3) -> list:
+    results = []
+    for name, fileflow in make_corpus(rows).items():
+        legacy_seconds, legacy = _time(_trial_and_error, fileflow, repeat)
+        sniffed_seconds, data = _time(read_excel_by_fileflow, fileflow, repeat)
+        results.append({
+            "file": name,
+            "bytes": len(fileflow),
+            "legacy_seconds": legacy_seconds,
+            "sniffed_seconds": sniffed_seconds,
+            "sniffed": getattr(data, "sniffed", None),
+            "tried": getattr(data, "tried", None),
+            "legacy_sheets": len(legacy) if isinstance(legacy, dict) else legacy,
+            "sheets": len(data) if isinstance(data, dict) else data,
+        })
+    return results
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import json
+
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("--rows", default=2000, type=int, help="statement rows.")
+    argsparser.add_argument("--repeat", default=3, type=int, help="repeat times of each measurement.")
+    args = argsparser.parse_args()
+
+    records = bench(args.rows, args.repeat)
+    summary = Counter()
+    for record in records:
+        summary["legacy_seconds"] += record["legacy_seconds"]
+        summary["sniffed_seconds"] += record["sniffed_seconds"]
+    print(json.dumps({"results": records, "total": dict(summary)}, indent=2, ensure_ascii=False))
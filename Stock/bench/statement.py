@@ -0,0 +1,167 @@
+# coding=utf8
+
+"""
+模拟对账单生成
+
+按 POSITION_COLUMNS_TYPES/TRADE_FLOW_COLUMNS_TYPES/CONTRACT_FLOW_COLUMNS_TYPES 生成一张与券商对账单
+版式一致的无表头整表(标题、账号、持仓、交易流水、合约数据块依次排列), 可以按比例加入脏数据
+(千分位、会计记账负数、空白、占位符), 并输出为 Excel/CSV/TXT 文件.
+
+    python -m Stock.bench.statement --rows 10000 --dirty 0.05 --formats excel csv txt --output /tmp
+"""
+
+import os
+import numpy
+import pandas
+from Stock.exchange.parsers import (HORIZON_TAGS, TRADE_EVENTS, POSITION_COLUMNS_TYPES,
+                                    TRADE_FLOW_COLUMNS_TYPES, CONTRACT_FLOW_COLUMNS_TYPES)
+
+FORMATS = ("excel", "csv", "txt")
+EXTENSIONS = {"excel": ".xlsx", "csv": ".csv", "txt": ".txt"}
+
+# 数据块标题, 同时作为表尾(单值行)
+SECTION_TITLES = {
+    "position": u"持仓",
+    "trade_flow": u"交易流水",
+    "contract": u"未了结合约",
+}
+SECTION_TYPES = {
+    "position": POSITION_COLUMNS_TYPES,
+    "trade_flow": TRADE_FLOW_COLUMNS_TYPES,
+    "contract": CONTRACT_FLOW_COLUMNS_TYPES,
+}
+TOTAL_ROW = u"合计"
+_ACCOUNT = u"1001234567"
+_PLACEHOLDERS = (u"--", u"", u" ")
+
+
+def _dirty_float(value: float, rng: numpy.random.Generator):
+    kind = rng.integers(4)
+    if kind == 0:
+        return f"{value:,.2f}"
+    if kind == 1:
+        return f"({abs(value):,.2f})"
+    if kind == 2:
+        return f" {value:.2f} "
+    return _PLACEHOLDERS[rng.integers(len(_PLACEHOLDERS))]
+
+
+def _column_values(column: str, dtype, rows: int, rng: numpy.random.Generator) -> numpy.ndarray:
+    if dtype is float:
+        return numpy.round(rng.normal(10000, 5000, rows), 2).astype(object)
+    if column in (u"证券代码",):
+        return numpy.array([f"{code:06d}" for code in rng.integers(1, 700000, rows)], dtype=object)
+    if column in (u"摘要",):
+        events = [event.strip().replace("\\", "") for event in TRADE_EVENTS]
+        return numpy.array(events, dtype=object)[rng.integers(len(events), size=rows)]
+    if column.endswith(u"日期") or column.endswith(u"日"):
+        days = pandas.Timestamp("2021-01-01") + pandas.to_timedelta(rng.integers(365, size=rows), unit="D")
+        return days.strftime("%Y%m%d").to_numpy(dtype=object)
+    return numpy.array([f"{column}{n}" for n in rng.integers(1000, size=rows)], dtype=object)
+
+
+def make_section(name: str, rows: int, dirty_ratio: float = 0.0,
+                 rng: numpy.random.Generator = None) -> pandas.DataFrame:
+    """
+    生成单个数据块(包含标题行、表头行、数据行、合计行)
+
+    Args:
+        name: position/trade_flow/contract
+        rows: 数据行数
+        dirty_ratio: 数值单元格中脏数据比例
+        rng: 随机数生成器
+
+    Returns: 无表头 object 类型 DataFrame
+    """
+    rng = rng or numpy.random.default_rng(0)
+    stdtype = SECTION_TYPES[name]
+    body = pandas.DataFrame({column: _column_values(column, dtype, rows, rng)
+                             for column, dtype in stdtype.items()}, dtype=object)
+    if dirty_ratio > 0:
+        for column, dtype in stdtype.items():
+            if dtype is not float:
+                continue
+            dirty = numpy.flatnonzero(rng.random(rows) < dirty_ratio)
+            values = body[column].to_numpy()
+            values[dirty] = [_dirty_float(values[pos], rng) for pos in dirty]
+            body[column] = values
+
+    width = len(stdtype)
+    title = [SECTION_TITLES[name]] + [numpy.nan] * (width - 1)
+    # 部分表头带有空白, adjust_columns 需要去除
+    header = [column if pos % 3 else u" ".join(column) for pos, column in enumerate(stdtype)]
+    total = [TOTAL_ROW] + [numpy.nan] * (width - 1)
+    head = pandas.DataFrame([title, header], dtype=object)
+    head.columns = body.columns = range(width)
+    return pandas.concat([head, body, pandas.DataFrame([total], dtype=object)], ignore_index=True)
+
+
+def make_statement(rows: int, dirty_ratio: float = 0.0, seed: int = 0,
+                   position_rows: int = None, contract_rows: int = None) -> pandas.DataFrame:
+    """
+    生成完整对账单整表
+
+    Args:
+        rows: 交易流水行数
+        dirty_ratio: 数值单元格中脏数据比例
+        seed: 随机种子
+        position_rows: 持仓行数, 默认为流水的 1/20
+        contract_rows: 合约行数, 默认为流水的 1/50
+
+    Returns: 无表头 object 类型 DataFrame, 列数为各数据块最大列数
+    """
+    rng = numpy.random.default_rng(seed)
+    counts = {
+        "position": position_rows if position_rows is not None else max(rows // 20, 1),
+        "trade_flow": rows,
+        "contract": contract_rows if contract_rows is not None else max(rows // 50, 1),
+    }
+    width = max(len(stdtype) for stdtype in SECTION_TYPES.values())
+    head = pandas.DataFrame([[u"客户对账单"] + [numpy.nan] * (width - 1),
+                             [HORIZON_TAGS[7], _ACCOUNT] + [numpy.nan] * (width - 2),
+                             [numpy.nan] * width], dtype=object)
+    parts = [head] + [make_section(name, count, dirty_ratio, rng) for name, count in counts.items()]
+    statement = pandas.concat(parts, ignore_index=True)
+    return statement.reindex(columns=range(width)).astype(object)
+
+
+def write_statement(statement: pandas.DataFrame, path: str, fmt: str) -> str:
+    """
+    输出对账单文件, CSV/TXT 以 GB18030 编码(与券商实际文件一致)
+
+    Args:
+        statement: make_statement 生成的整表
+        path: 不带扩展名的文件路径
+        fmt: excel/csv/txt
+
+    Returns: 文件路径
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}, should be one of {FORMATS}")
+    filepath = path + EXTENSIONS[fmt]
+    if fmt == "excel":
+        statement.to_excel(filepath, header=False, index=False)
+    elif fmt == "csv":
+        statement.to_csv(filepath, header=False, index=False, encoding="GB18030")
+    else:
+        lines = statement.fillna("").astype(str).apply(lambda row: u"\t".join(row).rstrip(), axis=1)
+        with open(filepath, mode="w", encoding="GB18030") as handler:
+            handler.write(u"\n".join(lines))
+    return filepath
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("--rows", default=1000, type=int, help="trade flow rows.")
+    argsparser.add_argument("--dirty", default=0.0, type=float, help="dirty numeric cells ratio.")
+    argsparser.add_argument("--seed", default=0, type=int, help="random seed.")
+    argsparser.add_argument("--formats", default=list(FORMATS), nargs='+', choices=FORMATS, help="output formats.")
+    argsparser.add_argument("--output", default=".", help="output directory.")
+    args = argsparser.parse_args()
+
+    frame = make_statement(args.rows, args.dirty, args.seed)
+    for file_format in args.formats:
+        print(write_statement(frame, os.path.join(args.output, f"statement_{args.rows}"), file_format))
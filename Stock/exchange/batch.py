@@ -0,0 +1,310 @@
+# coding=utf8
+
+"""
+对账单批量解析
+
+节假日或故障恢复后会一次性收到大量对账单, 在单个解释器中串行解析耗时过长.
+BatchParser 将文件分发到进程池中解析:
+
+  - 每个工作进程启动时导入解析器模块(解析器在导入时注册到 registry)并预热, 之后复用;
+  - 同时提交的任务数有上限, 避免一次性提交全部文件占用过多内存;
+  - 结果按完成顺序逐个返回, 不必等待全部完成;
+  - 单个文件解析超时即放弃, 记录为失败;
+  - 结束后汇总吞吐量与失败信息.
+
+    runner = BatchParser(workers=8, timeout=60, parser_modules=["Stock.exchange.brokers"])
+    for result in runner.run(filepaths):
+        ...
+    print(runner.summary)
+
+托管行发送的压缩包中常有几十个账户的对账单, run_archive 在线程池中并行解压各子文件(zlib 解压时
+释放 GIL), 每个子文件解压完成即提交到进程池解析, 总耗时接近最慢的子文件而不是所有子文件之和:
+
+    with open("statements.zip", "rb") as handler:
+        results = runner.run_archive(handler, target_ext=(".xls", ".xlsx", ".csv"))
+"""
+
+import importlib
+import logging
+import os
+import time
+import traceback
+import typing as t
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
+from X1.run import UnexpectedCompatible
+from X2.utlis import CompFileMemFree, execute_time_limit
+from X2.XExcel.read import LazyWorkbook, read_excel_by_filepath, read_excel_by_fileflow
+
+_logger = logging.getLogger(__name__)
+
+
+class FileResult(t.NamedTuple):
+    """
+    单个文件的解析结果
+
+    filepath: 文件路径, 压缩包中的子文件为子文件名称
+    result: 解析器 parse 返回的数据, 失败为 None
+    parser: 匹配到的解析器名称
+    error: 失败原因(异常堆栈), 成功为 None
+    seconds: 在工作进程中的耗时
+    """
+    filepath: str
+    result: t.Optional[t.Dict]
+    parser: t.Optional[str]
+    error: t.Optional[str]
+    seconds: float
+
+
+class BatchSummary(object):
+
+    def __init__(self):
+        self.total = 0
+        self.succeeded = 0
+        self.failures: t.List[t.Tuple[str, str]] = []
+        self.started = time.time()
+        self.finished = None
+
+    def add(self, result: FileResult):
+        self.total += 1
+        if result.error is None:
+            self.succeeded += 1
+        else:
+            self.failures.append((result.filepath, result.error))
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """ 每秒解析文件数 """
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> t.Dict:
+        return {
+            'total': self.total,
+            'succeeded': self.succeeded,
+            'failed': len(self.failures),
+            'seconds': round(self.seconds, 3),
+            'files_per_second': round(self.throughput, 3),
+            'failures': [filepath for filepath, _ in self.failures],
+        }
+
+    def __str__(self):
+        return (f"parsed {self.total} files in {self.seconds:.2f}s ({self.throughput:.2f} files/s), "
+                f"{self.succeeded} succeeded, {len(self.failures)} failed")
+
+
+def _init_worker(parser_modules: t.Sequence[str]):
+    """ 工作进程初始化: 导入解析器模块完成注册, 预热交易事件分类器 """
+    for module in parser_modules:
+        importlib.import_module(module)
+    from Stock.exchange.parsers import _trade_events_classifier
+    _trade_events_classifier()
+
+
+def _parse(filepath: str, read: t.Callable, timeout: t.Optional[int], data_attrs: t.Dict) -> FileResult:
+    from Stock.exchange.parsers.registry import registry
+
+    start = time.time()
+    parser = None
+    data = None
+    try:
+        with execute_time_limit(timeout or 0):
+            # Excel 按 sheet 延迟解析, 解析器只读取用到的 sheet
+            data = read()
+            if getattr(data, 'error', False):
+                raise ValueError(f"can not read file {filepath}")
+            instance = registry.match(data, **data_attrs)
+            if instance is None:
+                raise LookupError(f"no parser matched file {filepath}")
+            parser = instance.parsername
+            result = instance.parse(data, **data_attrs)
+    except Exception:
+        return FileResult(filepath, None, parser, traceback.format_exc(), time.time() - start)
+    finally:
+        if isinstance(data, LazyWorkbook):
+            data.close()
+    return FileResult(filepath, result, parser, None, time.time() - start)
+
+
+def _parse_file(filepath: str, timeout: t.Optional[int], data_attrs: t.Dict) -> FileResult:
+    return _parse(filepath, lambda: read_excel_by_filepath(filepath, lazy=True), timeout, data_attrs)
+
+
+def _parse_fileflow(name: str, fileflow: bytes, timeout: t.Optional[int], data_attrs: t.Dict) -> FileResult:
+    return _parse(name, lambda: read_excel_by_fileflow(fileflow, lazy=True), timeout, data_attrs)
+
+
+def _extract(name: str, open_member: t.Callable, target_ext, target_files,
+             password: t.Optional[bytes]) -> t.List[t.Tuple[str, bytes]]:
+    """ 在线程中解压子文件, 嵌套的压缩包展开为其中匹配的子文件 """
+    with open_member() as source:
+        fileflow = source.read()
+    if CompFileMemFree.is_archive_name(name):
+        try:
+            return [(f"{name}/{subname}", subfile.read())
+                    for subname, subfile in CompFileMemFree.iter_members(BytesIO(fileflow), target_ext,
+                                                                         target_files, password)]
+        except UnexpectedCompatible:
+            pass
+    return [(name, fileflow)] if CompFileMemFree.matcher(target_ext, target_files)(name) else []
+
+
+class BatchParser(object):
+
+    def __init__(self, workers: int = None,
+                 max_in_flight: int = None,
+                 timeout: int = None,
+                 parser_modules: t.Sequence[str] = (),
+                 decompress_workers: int = None):
+        """
+        Args:
+            workers: 工作进程数, 默认为 CPU 核数.
+            max_in_flight: 同时提交的最大任务数, 默认为工作进程数的两倍.
+            timeout: 单个文件解析超时秒数, 不设置则不限制.
+            parser_modules: 工作进程启动时需要导入的解析器模块, 解析器在模块导入时注册到
+                            Stock.exchange.parsers.registry.registry .
+            decompress_workers: run_archive 解压线程数, 默认同 ThreadPoolExecutor.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.timeout = timeout
+        self.parser_modules = tuple(parser_modules)
+        self.decompress_workers = decompress_workers
+        self.summary = BatchSummary()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   initializer=_init_worker,
+                                   initargs=(self.parser_modules,))
+
+    def _collect(self, result: FileResult) -> FileResult:
+        self.summary.add(result)
+        if result.error is not None:
+            _logger.warning(f"Failed to parse {result.filepath}: {result.error.splitlines()[-1]}")
+        return result
+
+    def run(self, filepaths: t.Iterable[str], **data_attrs) -> t.Iterator[FileResult]:
+        """
+        解析文件, 按完成顺序逐个返回结果
+
+        Args:
+            filepaths: 文件路径序列, 可以是生成器.
+            **data_attrs: 传递给解析器 match/parse 的数据属性.
+
+        """
+        self.summary = BatchSummary()
+        filepaths = iter(filepaths)
+        with self._executor() as executor:
+            pending = set()
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    try:
+                        filepath = next(filepaths)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(_parse_file, filepath, self.timeout, data_attrs))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._collect(future.result())
+        self.summary.finished = time.time()
+        _logger.info(str(self.summary))
+
+    def run_archive(self, filelike: t.BinaryIO,
+                    target_ext: t.Union[t.Tuple, str] = None,
+                    target_files: t.Sequence[str] = None,
+                    password: bytes = None,
+                    **data_attrs) -> t.List[FileResult]:
+        """
+        解析压缩包中的对账单: 线程池并行解压, 每个子文件解压完成即提交到进程池解析;
+        解压中与解析中的子文件总数同样以 max_in_flight 为上限
+
+        Args:
+            filelike: 压缩包(zip/rar)二进制文件对象.
+            target_ext: 需要解析的子文件扩展名, 同 CompFileMemFree.iter_members .
+            target_files: 需要解析的子文件名称, 同 CompFileMemFree.iter_members .
+            password: 解压密码.
+            **data_attrs: 传递给解析器 match/parse 的数据属性.
+
+        Returns: 解析结果, 按子文件在压缩包中的顺序排列(嵌套压缩包的子文件位于该压缩包的位置)
+        """
+        self.summary = BatchSummary()
+        match = CompFileMemFree.matcher(target_ext, target_files)
+        results: t.Dict[t.Tuple[int, int], FileResult] = {}
+        with CompFileMemFree.open_archive(filelike, password) as members, \
+                ThreadPoolExecutor(max_workers=self.decompress_workers) as threads, \
+                self._executor() as executor:
+            members = enumerate(members)
+            # 解压中及解析中的任务, 总数不超过 max_in_flight, 避免一次性解压全部子文件占用过多内存
+            extracting, parsing = {}, {}
+            exhausted = False
+            while True:
+                while not exhausted and len(extracting) + len(parsing) < self.max_in_flight:
+                    try:
+                        position, (name, _, open_member) = next(members)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if CompFileMemFree.is_archive_name(name) or match(name):
+                        future = threads.submit(_extract, name, open_member, target_ext, target_files, password)
+                        extracting[future] = (position, name)
+                if not extracting and not parsing:
+                    break
+                done, _ = wait(set(extracting) | set(parsing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in parsing:
+                        results[parsing.pop(future)] = self._collect(future.result())
+                        continue
+                    position, name = extracting.pop(future)
+                    try:
+                        fileflows = future.result()
+                    except Exception:
+                        results[(position, 0)] = self._collect(
+                            FileResult(name, None, None, traceback.format_exc(), 0.0))
+                        continue
+                    # 嵌套压缩包的子文件已在内存中, 全部提交
+                    for no, (subname, fileflow) in enumerate(fileflows):
+                        parsed = executor.submit(_parse_fileflow, subname, fileflow, self.timeout, data_attrs)
+                        parsing[parsed] = (position, no)
+        self.summary.finished = time.time()
+        _logger.info(str(self.summary))
+        return [results[key] for key in sorted(results)]
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import json
+
+    argsparser = argparse.ArgumentParser()
+    argsparser.add_argument("files", nargs='+', help="statement files to parse.")
+    argsparser.add_argument("--workers", default=None, type=int, help="worker process number.")
+    argsparser.add_argument("--max-in-flight", default=None, type=int, help="max submitted files at once.")
+    argsparser.add_argument("--timeout", default=None, type=int, help="timeout seconds of each file.")
+    argsparser.add_argument("--parser-modules", default=[], nargs='+', help="modules registering parsers.")
+    argsparser.add_argument("--archive", action='store_true', help="files are archives(zip/rar) of statements.")
+    args = argsparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = BatchParser(workers=args.workers, max_in_flight=args.max_in_flight,
+                         timeout=args.timeout, parser_modules=args.parser_modules)
+
+    def _report(file_results):
+        for file_result in file_results:
+            print(json.dumps({'file': file_result.filepath, 'parser': file_result.parser,
+                              'ok': file_result.error is None, 'seconds': round(file_result.seconds, 3)},
+                             ensure_ascii=False))
+        print(json.dumps(runner.summary.to_dict(), indent=2, ensure_ascii=False))
+
+    if args.archive:
+        for archive in args.files:
+            with open(archive, mode='rb') as archive_handler:
+                _report(runner.run_archive(archive_handler))
+    else:
+        _report(runner.run(args.files))
@@ -1,10 +1,12 @@
 # coding=utf8
 
-import re
+import numpy
+import pandas
 from enum import Enum
 from typing import Tuple
 from X1.stand import ArgStandError
 from X1.run import UnexpectedData
+from X2.utlis import compile_regex
 
 
 class StockData(Enum):
@@ -113,14 +115,79 @@ class _Column:
     def adapt(self, value):
         raise NotImplemented
 
+    def adapt_series(self, series: pandas.Series) -> pandas.Series:
+        """ 整列转换, 子类没有批量实现时逐个单元格调用 adapt """
+        return series.map(self.adapt)
+
+
+# 数值字符串中的千分位逗号及空白
+_NUMERIC_NOISE = u"[,，\\s]"
+# 会计记账形式的负数 (1234.50) / （1234.50）
+_BRACKETED_NUMBER = u"^[(（](.*)[)）]$"
+
+
+def _clean_numeric_text(text: str) -> str:
+    """ 去除千分位逗号和空白, 会计记账形式的负数 (1,234.50) / （1,234.50） 转为 -1234.50 """
+    text = text.strip()
+    if text and text[0] in "(（" and text[-1] in ")）":
+        text = "-" + text[1:-1]
+    return text.replace(",", "").replace("，", "").replace(" ", "")
+
+
+def _to_float_array(values: numpy.ndarray) -> numpy.ndarray:
+    """ 按单元格类型分组转换, 字符串无法直接转换时才整列清洗 """
+    result = numpy.full(len(values), numpy.nan)
+    text = numpy.fromiter((isinstance(item, str) for item in values), dtype=bool, count=len(values))
+    other = ~text
+    try:
+        result[other] = values[other].astype(float)
+    except (TypeError, ValueError):
+        # None/日期等无法转换为数值的单元格
+        result[other] = pandas.to_numeric(pandas.Series(values[other]), errors='coerce')
+
+    if text.any():
+        strings = values[text]
+        try:
+            parsed = strings.astype(float)
+        except ValueError:
+            parsed = _parse_numeric_text(strings)
+        result[text] = parsed
+    return result
+
+
+def _parse_numeric_text(strings: numpy.ndarray) -> numpy.ndarray:
+    """ 整列按字符串方法清洗后整列转换, 规则同 _clean_numeric_text, 无法转换的为 NaN """
+    text = pandas.Series(strings, dtype=object).str.replace(_NUMERIC_NOISE, "", regex=True)
+    text = text.str.replace(_BRACKETED_NUMBER, "-\\1", regex=True)
+    return pandas.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+
+
+def to_float_series(series: pandas.Series) -> pandas.Series:
+    """
+    整列转换为浮点数, 规则与 FloatColumn.adapt 相同, 但无法转换的数据为 NaN 而不是抛出 ValueError.
+
+    干净的数据整列一次转换; 存在脏数据时才按单元格类型分组, 仅清洗无法直接转换的字符串.
+    """
+    if pandas.api.types.is_numeric_dtype(series.dtype):
+        return series.astype(float)
+    values = series.to_numpy(dtype=object)
+    try:
+        result = values.astype(float)
+    except (TypeError, ValueError):
+        result = _to_float_array(values)
+    return pandas.Series(result, index=series.index, name=series.name)
+
 
 class FloatColumn(_Column):
     def __init__(self, **kwargs):
         super().__init__(dtype=float, **kwargs)
 
     def adapt(self, value):
-        value = re.sub("[()（）,]", repl="", string=str(value))
-        return self.dtype(value)
+        return self.dtype(_clean_numeric_text(str(value)))
+
+    def adapt_series(self, series: pandas.Series) -> pandas.Series:
+        """ 与 adapt 规则相同, 但无法转换的数据为 NaN 而不是抛出 ValueError """
+        return to_float_series(series)
 
 
 class StringColumn(_Column):
@@ -130,6 +197,9 @@ class StringColumn(_Column):
     def adapt(self, value):
         return self.dtype(value)
 
+    def adapt_series(self, series: pandas.Series) -> pandas.Series:
+        return series.astype(self.dtype)
+
 class BreakingColumn(_Column):
     def __init__(self, breaking_rule, **kwargs):
         """
@@ -137,7 +207,8 @@ class BreakingColumn(_Column):
 
         Args:
             breaking_rule: 分割的正则表达式规则,这是一个二元组数据;第一个元素是组名元组数据;
-                           第二个元素是带有组名的正则表达式,且包含第一个元素中所有组名.
+                           第二个元素是带有组名的正则表达式,且包含第一个元素中所有组名;
+                           正则表达式在创建时编译并检查组名.
             **kwargs:
         """
         super().__init__(dtype=str, **kwargs)
@@ -145,11 +216,22 @@ class BreakingColumn(_Column):
                 len(breaking_rule) == 2 and
                 isinstance(breaking_rule[0], tuple)):
             raise ArgStandError("breaking_rule should be a tuple with 2 elements, refer to doc.")
+        regex = compile_regex(breaking_rule[1]) if isinstance(breaking_rule[1], str) else breaking_rule[1]
+        missing = set(breaking_rule[0]) - set(regex.groupindex)
+        if missing:
+            raise ArgStandError(f"Group names {sorted(missing)} can not be found in regex '{regex.pattern}'.")
+        self.breaking_rule = (breaking_rule[0], regex)
+
+    def adapt(self, value):
+        return self.breaking(self.breaking_rule, value)
 
     @staticmethod
     def breaking(breaking_rule, value):
+        regex = breaking_rule[1]
+        if isinstance(regex, str):
+            regex = compile_regex(regex)
         try:
-            result = re.search(breaking_rule[1], value).groupdict()
+            result = regex.search(value).groupdict()
             data = {}
             for ele in breaking_rule[0]:
                 data[ele] = result[ele]
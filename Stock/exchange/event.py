@@ -2,11 +2,17 @@
 
 import re
 import traceback
+import typing as t
 import warnings
 from inspect import getfullargspec
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from Stock.exchange import dtypes
 from X1.stand import ArgStandError
+from X2.utlis import compile_regex
+
+
+# 仅有单个数据的采集目标, 采集到一次即可
+_SINGLE_VALUE_DESTS = frozenset(dest for dest, groups in dtypes.DestinationGroups.items() if len(groups) == 1)
 
 
 class Action:
@@ -49,7 +55,7 @@ class Action:
         return any(conditions)
 
     def __call__(self, *args, **kwargs):
-        self._run(*args, **kwargs)
+        return self._run(*args, **kwargs)
 
 
 class Event(object):
@@ -90,6 +96,10 @@ class Event(object):
         self.actions: OrderedDict[dtypes.StockData, [Action]] = OrderedDict()
         self.containers = {}
         self.errors = {}
+        # (action名称, 异常类型, 异常参数) -> 出现次数
+        self.error_counts = Counter()
+        self._satisfied = set()
+        self._dispatch = None
 
     @staticmethod
     def __get_action_dest(action):
@@ -149,9 +159,9 @@ class Event(object):
 
         if action.dest not in self.actions:
             self.actions[action.dest] = []
+        # actions are sorted by priority once when dispatch table is compiled, see `_compile_dispatch`
         self.actions[action.dest].append(action)
-        # sort action by priority of action, the smaller the higher the priority
-        self.actions[action.dest].sort(key=lambda a: a.priority)
+        self._dispatch = None
 
         if container is not None:
             adopt_method = getattr(container, "append", None)
@@ -164,17 +174,52 @@ class Event(object):
                               "recommend is custom container firstly and only once for the same destination.")
 
         elif self.auto_container is True:
-            self.register_container(action.dest, __inside=True)
+            self.register_container(action.dest, _inside=True)
 
-    def register_container(self, __dest, /, *, __inside=False):
-        if not isinstance(__dest, str):
+    def register_container(self, __dest, /, *, _inside=False):
+        if isinstance(__dest, Action):
             __dest = self.__get_action_dest(__dest)
 
-        if __dest not in self.actions:
+        if __dest not in self.containers:
             self.containers[__dest] = []
-        elif not __inside:
+            self._dispatch = None
+        elif not _inside:
             warnings.warn("Container register once only, no necessary to register twice more for the same destination")
 
+    def _compile_dispatch(self):
+        """
+        将 actions 编译为按 priority 排序的扁平元组 (dest, (action, ...), container.append),
+        已采集到数据的单值 dest 不再编入; 注册 action/container 后重新编译.
+        """
+        dispatch = []
+        for dest, actions in self.actions.items():
+            # the smaller the higher the priority, stable for the same priority
+            actions.sort(key=lambda a: a.priority)
+            if dest in self._satisfied:
+                continue
+            container = self.containers.get(dest)
+            dispatch.append((dest, tuple(actions), container.append if container is not None else None))
+        self._dispatch = tuple(dispatch)
+        return self._dispatch
+
+    def _record_error(self, action, exc):
+        """ 相同行为的相同异常只格式化一次, 之后仅计数 """
+        signature = (action.name, type(exc), repr(exc.args))
+        self.error_counts[signature] += 1
+        if self.error_counts[signature] == 1:
+            self.errors[action.name] = traceback.format_exc()
+
+    def check_expired(self, *args, **kwargs) -> bool:
+        """
+        根据失效触发行为更新事件状态, 仅对已激活的事件生效, 失效后不再恢复.
+
+        Returns: 事件是否已失效
+        """
+        if self.running is True and self.expired is False:
+            if any(trigger(*args, **kwargs) for trigger in self.deactivate_triggers):
+                self.expired = True
+        return self.expired
+
     def __call__(self, *args, **kwargs):
         """
         Event对象作为被调用对象使用,在数据采集过程中最小单位数据遍历一次即调用一次,根据Event对象
@@ -186,6 +231,9 @@ class Event(object):
         authority属性权重来进行排序,数据的的采集也会以此为先后顺序,一旦存在action采集到数据,后续的
         action将不会再执行.
 
+        事件激活后 actions 编译为固定的分发元组逐条调用; 单值数据(账号/日期/总资产等)的 dest
+        采集到一次后即从分发元组中移除, 之后的数据不再经过这些 action.
+
         Args:
             Event对象在创建期间就对所有行为进行了封装,当Event对象被调用时,传入的参数均为需要被采集的必要数据
 
@@ -195,27 +243,29 @@ class Event(object):
             raise RuntimeError("Event has expired!")
 
         if self.running is False:
-            if any(trigger(*args, **kwargs) for trigger in self.active_triggers):
-                self.running = True
-
-        if self.running is True:
-            for dest, actions in self.actions.items():
-                catchone = False
-                for action in actions:
-                    result = None
-                    try:
-                        # 为了能够更加精确把控行为,将事件也传入行为处理中
-                        result = action(self, *args, **kwargs)
-                    except (Exception,):
-                        exc = traceback.format_exc()
-                        name = action.name
-                        self.errors[name] = exc
-                    if result is not None:
-                        catchone = True
-                        if dest in self.containers:
-                            self.containers[dest].append(result)
-                    if catchone is True:
-                        break
+            if not any(trigger(*args, **kwargs) for trigger in self.active_triggers):
+                return
+            self.running = True
+
+        dispatch = self._dispatch if self._dispatch is not None else self._compile_dispatch()
+        satisfied = False
+        for dest, actions, adopt in dispatch:
+            for action in actions:
+                try:
+                    # 为了能够更加精确把控行为,将事件也传入行为处理中
+                    result = action._run(self, *args, **kwargs)
+                except Exception as exc:
+                    self._record_error(action, exc)
+                    continue
+                if result is not None:
+                    if adopt is not None:
+                        adopt(result)
+                    if dest in _SINGLE_VALUE_DESTS:
+                        self._satisfied.add(dest)
+                        satisfied = True
+                    break
+        if satisfied:
+            self._compile_dispatch()
 
 
 class EventManage:
@@ -224,12 +274,15 @@ class EventManage:
         self.events = dict()
         self.errors = dict()
         self.results = dict()
+        # 流式推送时仍然有效的事件, 注册/注销事件后重新生成
+        self._live = None
 
     def register(self, event, /, *args, **kwargs):
         __event = getattr(event, 'name')
         self.events[__event] = (event, args, kwargs)
         self.errors[__event] = None
         self.results[__event] = None
+        self._live = None
 
     def unregister(self, __event):
         if isinstance(__event, Event):
@@ -240,6 +293,7 @@ class EventManage:
             self.results.pop(__event)
         except KeyError:
             raise KeyError(f"event <{__event}> was not registered")
+        self._live = None
 
     def run(self):
         for __event, (action, args, kwargs) in self.events.items():
@@ -250,21 +304,69 @@ class EventManage:
                 exc = traceback.format_exc()
                 self.errors[__event] = exc
 
+    def _harvest(self, event):
+        """ 取出事件容器中采集的数据及行为错误 """
+        self.results[event.name] = event.containers
+        if event.errors:
+            self.errors[event.name] = event.errors
+
+    def feed(self, *args, **kwargs) -> bool:
+        """
+        流式推送一条最小单位数据(如文本对账单的一行)给所有有效事件, 注册事件时传入的参数追加在数据之后.
+        事件失效后立即取出采集结果并移出推送列表, 之后的数据不再经过该事件.
+
+        Returns: 是否还有有效事件, 为 False 时可以提前结束数据读取
+        """
+        if self._live is None:
+            self._live = [(event, _args, _kwargs) for event, _args, _kwargs in self.events.values()
+                          if not event.expired]
+        expired = False
+        for event, _args, _kwargs in self._live:
+            event(*args, *_args, **kwargs, **_kwargs)
+            if event.check_expired(*args, *_args, **kwargs, **_kwargs):
+                self._harvest(event)
+                expired = True
+        if expired:
+            self._live = [item for item in self._live if not item[0].expired]
+        return bool(self._live)
+
+    def stream(self, rows: t.Iterable) -> dict:
+        """
+        逐条推送数据直至数据结束或所有事件失效, 数据可以是生成器, 全程只持有当前一条数据.
+
+        Args:
+            rows: 数据序列, 每一项作为一次 feed 的参数; tuple 会被展开为多个参数
+
+        Returns: {事件名称: {dest: 采集数据}}
+        """
+        for row in rows:
+            alive = self.feed(*row) if isinstance(row, tuple) else self.feed(row)
+            if not alive:
+                break
+        for event, _, _ in self.events.values():
+            if event.running is False:
+                warnings.warn(f"Event <{event.name}> has never been activated")
+            elif event.expired is False:
+                self._harvest(event)
+        self._live = None
+        return self.results
+
 
 def deliver_regex(pattern, rawdata):
     """
     将正则表达式和需要匹配的数据进行传递,返回匹配结果
     Args:
-        pattern: 正则表达式,正则表达式必须保证被匹配数据都带有命名空间
+        pattern: 正则表达式(字符串或已编译对象),正则表达式必须保证被匹配数据都带有命名空间,
+                 字符串通过进程内共享缓存编译
         rawdata: 被匹配数据
 
     Returns:
         - 无数据:None
         - 有数据:dict
     """
-    if "(?P<" not in pattern:
-        raise ValueError(f"can not find namespace in pattern '{pattern}'")
-    regex = re.compile(pattern)
+    regex = pattern if isinstance(pattern, re.Pattern) else compile_regex(pattern)
+    if not regex.groupindex:
+        raise ValueError(f"can not find namespace in pattern '{regex.pattern}'")
     result = regex.search(rawdata)
     if result is not None:
         return result.groupdict()
@@ -0,0 +1,128 @@
+# coding=utf8
+
+"""
+大文件 CSV/TXT 对账单分块读取
+
+UBS/CICC 等导出的 CSV/TXT 对账单可达数百 MB, 整表读入(所有列推断为 object)再切分占用的内存是文件
+大小的数倍. 这里通过内存映射定位数据表表头, 只解析标准列并按块返回整理好的数据, 内存占用取决于
+块大小而不是文件大小:
+
+    for chunk in iter_table_chunks(filepath, TRADE_FLOW_COLUMNS_TYPES, chunksize=50000):
+        ...
+
+编码只识别一次(开头为纯 ASCII 时按之后第一段含非 ASCII 的内容识别), 不能按该编码解码时抛出异常, 不替换
+为 U+FFFD; 各块的类别不同, category 列(摘要)在块内保留为 str, 需要时合并后再转换. 表尾判断与 split_table
+相近, 标准列中仅有一个非空值的行(如合计、下一数据块标题)即为表尾, 之后的数据不再读取; 空行跳过.
+"""
+
+import codecs
+import mmap
+import re
+import typing as t
+from collections import OrderedDict
+import pandas
+from Stock.exchange.parsers import TRADE_FLOW_COLUMNS_TYPES, comfort_table
+from X2.XCoding import guess_encoding
+from X2.XExcel.sniff import SNIFF_SIZE, stream_encoding
+
+_WHITESPACE = re.compile(u"\\s")
+
+
+def _normalize(column) -> str:
+    return _WHITESPACE.sub("", column) if isinstance(column, str) else column
+
+
+def _locate_header(mapped: mmap.mmap, keywords: t.Sequence[str], encoding: str) -> t.Optional[t.Tuple[int, str]]:
+    """
+    返回表头所在行号及行内容, 表头行需(去除空白后)包含所有关键词;
+    表头中的关键词可能带有空白(如 "发 生 日 期"), 依次以各关键词原文定位候选行
+    """
+    codec = codecs.lookup(encoding).name
+    if codec.startswith(("utf-16", "utf-32")):
+        # 按字节查找关键词及换行符, 不支持多字节编码单元的编码
+        raise ValueError(f"{encoding} encoded file is not supported, please convert it to utf-8 first")
+    # utf-8-sig 编码关键词时会在开头加上 BOM
+    anchor_encoding = "utf-8" if codec == "utf-8-sig" else encoding
+    for keyword in keywords:
+        anchor = keyword.encode(anchor_encoding)
+        position = mapped.find(anchor)
+        while position != -1:
+            start = mapped.rfind(b"\n", 0, position) + 1
+            end = mapped.find(b"\n", position)
+            end = len(mapped) if end == -1 else end
+            line = mapped[start: end].decode(encoding, errors='replace')
+            compact = _normalize(line)
+            if all(_normalize(_keyword) in compact for _keyword in keywords):
+                return mapped[:start].count(b"\n"), line
+            position = mapped.find(anchor, end)
+    return None
+
+
+def _delimiter(line: str) -> str:
+    if u"\t" in line:
+        return u"\t"
+    if u"," in line:
+        return u","
+    return r"\s+"
+
+
+def iter_table_chunks(filepath: str,
+                      columns_types: t.Mapping = TRADE_FLOW_COLUMNS_TYPES,
+                      header_keywords: t.Sequence[str] = None,
+                      chunksize: int = 50000,
+                      encoding: str = None,
+                      sep: str = None) -> t.Iterator[pandas.DataFrame]:
+    """
+    分块读取 CSV/TXT 对账单中的数据表
+
+    Args:
+        filepath: 文件路径
+        columns_types: 标准列类型, 只解析其中的列, 每块数据按 comfort_table 整理, category 列保留为 str
+        header_keywords: 表头关键词, 默认为标准列的前两列
+        chunksize: 每块行数
+        encoding: 文件编码, 默认根据文件中第一段含非 ASCII 的内容识别
+        sep: 分隔符, 默认根据表头行识别(制表符/逗号/空白)
+
+    Returns: 按 columns_types 整理的 DataFrame 块, index 为数据行序号; 找不到表头时不返回数据
+
+    Raises: ValueError, 文件编码为 utf-16/utf-32; UnicodeDecodeError, 数据不能按编码解码
+    """
+    header_keywords = list(header_keywords or list(columns_types)[:2])
+    with open(filepath, mode='rb') as handler:
+        try:
+            mapped = mmap.mmap(handler.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            return
+        with mapped:
+            encoding = encoding or stream_encoding(mapped) or guess_encoding(mapped[:SNIFF_SIZE])
+            # mmap.find 默认从当前位置开始查找
+            mapped.seek(0)
+            located = _locate_header(mapped, header_keywords, encoding)
+    if located is None:
+        return
+    skiprows, header_line = located
+
+    wanted = {_normalize(column) for column in columns_types}
+    chunk_types = OrderedDict((column, str if dtype == "category" else dtype) for column, dtype in columns_types.items())
+    reader = pandas.read_csv(filepath,
+                             sep=sep or _delimiter(header_line),
+                             encoding=encoding,
+                             skiprows=skiprows,
+                             header=0,
+                             usecols=lambda column: _normalize(column) in wanted,
+                             dtype=object,
+                             chunksize=chunksize,
+                             memory_map=True,
+                             on_bad_lines='skip')
+    with reader:
+        for chunk in reader:
+            chunk.columns = [_normalize(column) for column in chunk.columns]
+            filled = chunk.notna().sum(axis=1).to_numpy()
+            ended = filled == 1
+            if ended.any():
+                chunk = chunk.iloc[:int(ended.argmax())]
+            if len(chunk):
+                yield comfort_table(chunk, chunk_types)
+            if ended.any():
+                break
@@ -1,8 +1,11 @@
 
 import numpy
+import pandas
 import re
 from collections import OrderedDict
-from functools import wraps
+from functools import lru_cache, wraps
+from Stock.exchange.dtypes import to_float_series
+from Stock.exchange.parsers.region import TableScanner, RegionSpec
 
 # 未定义
 INP_UNDEFINED   = 'undefined'
@@ -73,6 +76,10 @@ class _BaseParser(object):
     _FOR_REGION  = INP_UNDEFINED  # UBS/CICC/Mainland
     _PARSER_AUTH = INP_UNDEFINED  # coder
     _AUTH_MAIL   = INP_UNDEFINED  # coder email addr
+    # 文件特征关键词, 每一项为一组可替换的关键词(任一出现即可), 所有组都出现时才会调用 match;
+    # 例如 (HORIZON_TAGS, u"证券代码", u"证券名称"), 账号标志任一出现且同时出现证券代码和证券名称;
+    # 延迟读取的 Excel 只在各 sheet 前 registry.SCAN_ROWS 行中查找
+    _SIGNATURES  = ()
 
     @_classproperty
     def parsername(cls):
@@ -94,6 +101,11 @@ class _BaseParser(object):
     def author_mail(cls):
         return cls._AUTH_MAIL
 
+    @_classproperty
+    def signatures(cls):
+        return tuple((group,) if isinstance(group, str) else tuple(group)
+                     for group in cls._SIGNATURES)
+
     @_classproperty
     def parser_info(cls):
         return {
@@ -178,9 +190,20 @@ class MainlandParser(_BaseParser):
     def split_table(self, table, columns_kws, end_row_kws=None,
                     str_searchable=False, str_search_for='all',
                     starttriggerone=False, endtriggerone=False,
-                    pullback=None):
-
-        start_index = end_index = columns = None
+                    pullback=None, scanner=None):
+        u"""
+        从整表中切分出表头关键词所在的数据块
+
+        @table              整表数据, index 为连续整数
+        @columns_kws        表头关键词, 表头行需包含所有关键词单元格
+        @end_row_kws        表尾关键词
+        @str_searchable     是否允许通过行字符串检索关键词
+        @str_search_for     字符串检索作用于表头(start)/表尾(end)/全部(all)
+        @starttriggerone    字符串检索表头时命中任一关键词即可
+        @endtriggerone      字符串检索表尾时命中任一关键词即可
+        @pullback           出现该类关键词时放弃切分, 返回 None
+        @scanner            同一张表复用的 TableScanner, 不传时新建
+        """
         str_search_for_start = str_search_for_end = False
         str_search_for = str(str_search_for)
 
@@ -192,83 +215,55 @@ class MainlandParser(_BaseParser):
             elif str_search_for in ('1', 'end', '(1,)'):
                 str_search_for_end = True
 
-        end_row_kws = end_row_kws or [None]
-        pullback = pullback or []
-
-        for row_index, row_data in table.iterrows():
-            #
-            # 在一次完整的解析过程中
-            # 当传入的table是一个完整的表时split_point才起效
-            # 倘若传入的table为分割的表数据,split_point将变得毫无意义
-            self.split_point.update_index(row_index + 1)
-
-            row_items = row_data.tolist()
-            row_str   = row_data.to_string(index=False)
-
-            if start_index is None:
-                #
-                # 寻找表头位置
-                if set(row_items) & set(columns_kws) == set(columns_kws):
-                    columns = row_items
-                    start_index = row_index + 1
-                    continue
+        if scanner is None:
+            scanner = TableScanner(table)
+        region = scanner.locate(columns_kws, end_row_kws,
+                                str_search_start=str_search_for_start,
+                                str_search_end=str_search_for_end,
+                                starttriggerone=starttriggerone,
+                                endtriggerone=endtriggerone,
+                                pullback=pullback)
+        return self._cut_region(table, region)
+
+    def split_tables(self, table, specs):
+        u"""
+        一次扫描切分出多个数据块(持仓/流水/合约等), 行特征只计算一次,
+        各区域的定位规则与 split_table 相同
+
+        @table              整表数据, index 为连续整数
+        @specs              RegionSpec 或 (name, columns_kws, end_row_kws, flags) 序列
+        @Return
+            <collections.OrderDict> instance, 区域名称为 key, 未找到的区域为 None
+        """
+        scanner = TableScanner(table)
+        regions = OrderedDict()
+        split_point = int(self.split_point)
+        for spec in specs:
+            if not isinstance(spec, RegionSpec):
+                spec = RegionSpec(*spec)
+            regions[spec.name] = self.split_table(table, spec.columns_kws, spec.end_row_kws,
+                                                  scanner=scanner, **(spec.flags or {}))
+            split_point = max(split_point, int(self.split_point))
+        self.split_point.update_index(split_point)
+        return regions
+
+    def _cut_region(self, table, region):
+        #
+        # 在一次完整的解析过程中
+        # 当传入的table是一个完整的表时split_point才起效
+        # 倘若传入的table为分割的表数据,split_point将变得毫无意义
+        if region.stop is not None:
+            self.split_point.update_index(table.index[region.stop] + 1)
+        if region.pulled or region.start is None:
+            return
+
+        columns = table.iloc[region.start].tolist()
+        start_index = table.index[region.start] + 1
+        if region.end is not None:
+            if region.end < region.stop:
+                end_index = table.index[region.stop] - 1
             else:
-                if set(row_items) & set(end_row_kws) == set(end_row_kws):
-                    #
-                    # 寻找表尾位置
-                    end_index = row_index - 1
-                    break
-                # if set(dataItems) == {numpy.nan}:  ## <- 个人经验：别使用这种方法
-                elif not filter(lambda item: repr(item) != 'nan', row_items):
-                    #
-                    # 行数据全为nan即表尾
-                    end_index = row_index - 1
-                    break
-                elif len(set(row_items) - {numpy.nan}) < 2 and not all(map(lambda _x: isinstance(_x, (int, float)), row_items)):
-                    #
-                    # 这里情况比较复杂,纯粹为了兼容所写
-                    end_index = row_index - 1
-                    break
-                elif (start_index is not None) and (row_index == table.index[-1]):
-                    #
-                    # 最后一行数据
-                    if all(map(lambda _key: _key in row_items, end_row_kws)):
-                        end_index = row_index - 1
-                    else:
-                        end_index = row_index
-                    break
-
-            if (start_index is None) and (str_search_for_start is True):
-
-                contains = [(column_kw in row_str) for column_kw in columns_kws]
-                if all(contains) or ((starttriggerone is True) and any(contains)):
-                    contain_all_start_row_kws = True
-                else:
-                    contain_all_start_row_kws = False
-                if contain_all_start_row_kws is True:
-                    columns = row_items
-                    start_index = row_index + 1
-                    continue
-
-            if (end_index is None) and (str_search_for_end is True):
-
-                contains = [end_row_kw in row_str for end_row_kw in end_row_kws]
-                if all(contains) or ((endtriggerone is True) and any(contains)):
-                    contain_all_end_row_key = True
-                else:
-                    contain_all_end_row_key = False
-                if (start_index is not None) and (end_index is None) and (contain_all_end_row_key is True):
-                    end_index = row_index - 1
-                    break
-
-            if (start_index is not None) and (end_index is not None):
-                break
-
-            for lw in pullback:
-                if lw in row_str:
-                    return
-
-        if (start_index is not None) and (end_index is not None):
+                end_index = table.index[region.end]
             mini_table = table.loc[start_index: end_index]
             mini_table.columns = columns
             return mini_table
@@ -357,13 +352,26 @@ def floatreturn(func):
     return wrapper
 
 def comfort_table(table, stdtype):
-    std_columns  = set(stdtype.keys())
-    lack_columns = std_columns - set(table.columns)
-    for lack in lack_columns:
-        table[lack] = numpy.nan
-    df_table = table[list(std_columns)]
-    df_table = df_table.astype(stdtype)
-    return df_table
+    u"""
+    按标准列类型整理表数据, 缺失的列补充为空值
+
+    @table              待整理的 DataFrame
+    @stdtype            标准列类型, 如 TRADE_FLOW_COLUMNS_TYPES
+    @Return
+        按 stdtype 列顺序排列的新 DataFrame, float 列中无法转换的数据为 NaN
+    """
+    columns = OrderedDict()
+    for column, dtype in stdtype.items():
+        if column in table.columns:
+            series = table[column]
+        else:
+            series = pandas.Series(numpy.nan, index=table.index, dtype=object)
+        if dtype is float:
+            columns[column] = to_float_series(series).to_numpy()
+        else:
+            # 取 .array 而不是 .to_numpy(), 保留 category 等扩展类型; 不取 Series 本身, 避免按 index 对齐
+            columns[column] = series.astype(dtype).array
+    return pandas.DataFrame(columns, index=table.index, copy=False)
 
 
 POSITION_COLUMNS_TYPES = OrderedDict(
@@ -376,7 +384,7 @@ POSITION_COLUMNS_TYPES = OrderedDict(
 
 TRADE_FLOW_COLUMNS_TYPES = OrderedDict(
     {
-        u"发生日期": str,   u"摘要"     : str,  u"证券代码" : str,  u"证券名称" : str,
+        u"发生日期": str,   u"摘要"     : "category",  u"证券代码" : str,  u"证券名称" : str,
         u"成交股数": float,     u"成交价格" : float,    u"发生金额" : float,    u"资金余额" : float,
         u"手续费"  : float,     u"印花税"   : float,    u"过户费"   : float,    u"清算费"   : float,
         u"佣金"    : float,     u"备注"     : str
@@ -404,6 +412,51 @@ TRADE_EVENTS = [u"证券买入", u"证券卖出", u"回购融券", u"股息入
                 u"融券证券划入", u"ETF申购扣费", u"ETF申购减股", u"ETF申购扣资", u"ETF申购", u"ETF赎回扣费", u"ETF赎回加股", u"ETF赎回返资",
                 u"ETF赎回"]
 
+# 交易流水中由摘要归类得到的交易事件列
+TRADE_EVENT_COLUMN = u"交易事件"
+
+
+@lru_cache(maxsize=None)
+def _trade_events_classifier():
+    u"""
+    由 TRADE_EVENTS 构建(每个进程一次)的分类器
+
+    @Return
+        (编译后的交替正则, 事件标签列表)
+        事件标签为去除转义与首尾空白后的 TRADE_EVENTS, 顺序固定, 作为 category 编码
+    """
+    patterns = OrderedDict()
+    for event in TRADE_EVENTS:
+        pattern = event.strip()
+        patterns.setdefault(re.sub(u"\\\\(.)", u"\\1", pattern), pattern)
+    # 较长的事件优先, 避免 "ETF申购扣费" 被 "ETF申购" 提前匹配
+    alternation = u"|".join(sorted(patterns.values(), key=len, reverse=True))
+    return re.compile(u"(" + alternation + u")"), list(patterns.keys())
+
+
+def classify_trade_events(summaries):
+    u"""
+    将一整列摘要归类为交易事件
+
+    @summaries          摘要列 <pandas.Series>
+    @Return
+        category 类型的 <pandas.Series>, 类别为 TRADE_EVENTS 事件标签, 未能归类的为 NaN,
+        `.cat.codes` 即为事件编码(未归类为 -1)
+    """
+    regex, labels = _trade_events_classifier()
+    matched = summaries.astype(object).str.extract(regex, expand=False)
+    return pandas.Series(pandas.Categorical(matched, categories=labels), index=summaries.index)
+
+
+def comfort_trade_flow(table):
+    u"""
+    按 TRADE_FLOW_COLUMNS_TYPES 规整交易流水, 并由摘要归类出交易事件列
+    """
+    df_table = comfort_table(table, TRADE_FLOW_COLUMNS_TYPES)
+    df_table[TRADE_EVENT_COLUMN] = classify_trade_events(df_table[u"摘要"])
+    return df_table
+
+
 # 账号数据所在位置标志(水平方向上)
 HORIZON_TAGS = (u"信用资金帐号", u"信用资金帐号：", u"信用资金账号", u"信用资金账号：", u"信用客户号:",
                 u"资产帐户：", u"资产账号:", u'资金帐号：',
@@ -0,0 +1,216 @@
+# coding=utf8
+
+"""
+表区域检测
+
+对账单 Excel/CSV 读取后通常是一张没有表头的大表, 持仓/流水/合约等数据块按顺序排列在其中.
+原先 MainlandParser.split_table 通过 iterrows 逐行转换字符串、构建集合来寻找表头表尾,
+流水数据量大时是解析过程中最主要的耗时.
+
+TableScanner 对整表一次性计算行特征(关键词命中、全空行、数值行、行字符串), 之后的表头/表尾
+定位只在布尔数组上做 argmax 查找, 不再逐行遍历 DataFrame.
+"""
+
+import numpy
+import pandas
+import typing as t
+
+# 与 Series.to_string 中缺失值的展示保持一致
+_NAN_REPR = 'NaN'
+
+_is_nan = numpy.frompyfunc(lambda _x: _x != _x, 1, 1)
+_is_number = numpy.frompyfunc(lambda _x: isinstance(_x, (int, float)), 1, 1)
+
+
+class RegionSpec(t.NamedTuple):
+    """
+    区域切分描述, 用于 MainlandParser.split_tables 一次性切分多个数据块
+
+    name: 区域名称, 作为切分结果的 key
+    columns_kws: 表头关键词
+    end_row_kws: 表尾关键词
+    flags: split_table 其余参数(str_searchable/str_search_for/starttriggerone/endtriggerone/pullback)
+    """
+    name: str
+    columns_kws: t.Sequence
+    end_row_kws: t.Optional[t.Sequence] = None
+    flags: t.Optional[t.Dict] = None
+
+
+class Region(t.NamedTuple):
+    """
+    区域检测结果, 均为行位置(而非 index 标签)
+
+    start: 表头所在行位置, 未找到为 None
+    end: 表尾(数据最后一行)所在行位置, 未确定为 None
+    stop: 检测结束时所在行位置, 用于更新 split_point, 空表为 None
+    pulled: 是否因 pullback 关键词放弃检测
+    """
+    start: t.Optional[int]
+    end: t.Optional[int]
+    stop: t.Optional[int]
+    pulled: bool = False
+
+
+def _first(mask, begin=0):
+    """ 返回布尔数组中从 begin 起第一个 True 的位置, 不存在返回 None """
+    if begin >= len(mask):
+        return None
+    sub = mask[begin:]
+    pos = int(sub.argmax())
+    if not sub[pos]:
+        return None
+    return begin + pos
+
+
+class TableScanner(object):
+
+    def __init__(self, table: pandas.DataFrame):
+        """
+        整表行特征计算, 结果按关键词缓存, 同一张表多次定位不会重复计算.
+
+        Args:
+            table: 待检测的表数据, index 应为连续整数(与 split_table 的要求一致)
+        """
+        self.table = table
+        self.values = table.to_numpy(dtype=object)
+        self.nrows = self.values.shape[0]
+
+        self._nan = None
+        self._row_strings = None
+        self._few_values = None
+        self._cell_hits = {}
+        self._str_hits = {}
+
+    @property
+    def nan(self) -> numpy.ndarray:
+        if self._nan is None:
+            self._nan = _is_nan(self.values).astype(bool)
+        return self._nan
+
+    @property
+    def all_nan(self) -> numpy.ndarray:
+        """ 行数据全为 nan """
+        return self.nan.all(axis=1)
+
+    @property
+    def few_values(self) -> numpy.ndarray:
+        """
+        行数据中(除 nan 以外)不同值少于 2 个且不全为数值, 一般为标题/合计等说明性质的行,
+        作为表尾判断依据.
+
+        全为 nan 的行全部是浮点数, 不会被认为是表尾; 原逐行实现中 `not filter(...)`
+        在 py3 下始终为 False, 全空行同样不会结束表格, 这里保持一致.
+        """
+        if self._few_values is None:
+            values, nan = self.values, self.nan
+            if self.nrows == 0 or values.shape[1] == 0:
+                self._few_values = numpy.zeros(self.nrows, dtype=bool)
+                return self._few_values
+            first = values[numpy.arange(self.nrows), (~nan).argmax(axis=1)]
+            same = (values == first[:, None]) | nan
+            numeric = _is_number(values).astype(bool).all(axis=1)
+            self._few_values = same.all(axis=1) & ~numeric
+        return self._few_values
+
+    @property
+    def row_strings(self) -> pandas.Series:
+        """ 每行数据拼接为一个字符串, 仅在关键词字符串检索时使用 """
+        if self._row_strings is None:
+            cells = pandas.DataFrame(numpy.where(self.nan, _NAN_REPR, self.values)).astype(str)
+            if cells.shape[1] == 0:
+                self._row_strings = pandas.Series([''] * self.nrows, dtype=object)
+            else:
+                self._row_strings = cells[0].str.cat([cells[c] for c in cells.columns[1:]], sep='\n')
+        return self._row_strings
+
+    def cells_equal(self, keyword) -> numpy.ndarray:
+        """ 行中存在与关键词相等的单元格 """
+        hit = self._cell_hits.get(keyword)
+        if hit is None:
+            hit = (self.values == keyword).any(axis=1) if self.values.size else numpy.zeros(self.nrows, dtype=bool)
+            self._cell_hits[keyword] = hit
+        return hit
+
+    def rows_contain(self, keyword) -> numpy.ndarray:
+        """ 行字符串包含关键词 """
+        hit = self._str_hits.get(keyword)
+        if hit is None:
+            if isinstance(keyword, str):
+                hit = self.row_strings.str.contains(keyword, regex=False).to_numpy(dtype=bool)
+            else:
+                hit = numpy.zeros(self.nrows, dtype=bool)
+            self._str_hits[keyword] = hit
+        return hit
+
+    def _combine(self, masks, triggerone=False) -> numpy.ndarray:
+        if not masks:
+            return numpy.ones(self.nrows, dtype=bool)
+        masks = numpy.vstack(masks)
+        combined = masks.all(axis=0)
+        if triggerone:
+            combined |= masks.any(axis=0)
+        return combined
+
+    def locate(self, columns_kws, end_row_kws=None,
+               str_search_start=False, str_search_end=False,
+               starttriggerone=False, endtriggerone=False,
+               pullback=None) -> Region:
+        """
+        定位表头表尾, 规则与原 split_table 逐行实现相同:
+
+        表头: 行中包含所有 columns_kws 单元格; 字符串检索时行字符串包含所有(或任一)关键词.
+        表尾: 行中包含所有 end_row_kws 单元格; 说明性质的行(参考 few_values);
+              最后一行; 字符串检索时行字符串包含所有(或任一)关键词.
+        pullback: 非表头非表尾的行字符串中出现任一关键词即放弃检测.
+
+        Args:
+            columns_kws: 表头关键词
+            end_row_kws: 表尾关键词
+            str_search_start: 是否通过字符串检索表头
+            str_search_end: 是否通过字符串检索表尾
+            starttriggerone: 字符串检索表头时命中任一关键词即可
+            endtriggerone: 字符串检索表尾时命中任一关键词即可
+            pullback: 放弃检测关键词
+
+        Returns: Region
+        """
+        if self.nrows == 0:
+            return Region(None, None, None)
+        last = self.nrows - 1
+        end_row_kws = list(end_row_kws or [None])
+        pullback = list(pullback or [])
+
+        header = self._combine([self.cells_equal(kw) for kw in columns_kws])
+        if str_search_start:
+            header = header | self._combine([self.rows_contain(kw) for kw in columns_kws], starttriggerone)
+
+        if pullback:
+            pulled = numpy.vstack([self.rows_contain(kw) for kw in pullback]).any(axis=0)
+        else:
+            pulled = numpy.zeros(self.nrows, dtype=bool)
+
+        start = _first(header)
+        give_up = _first(pulled & ~header)
+        if give_up is not None and (start is None or give_up < start):
+            return Region(None, None, give_up, pulled=True)
+        if start is None:
+            return Region(None, None, last)
+        if start == last:
+            return Region(start, None, last)
+
+        footer = self._combine([self.cells_equal(kw) for kw in end_row_kws]) | self.few_values
+        if str_search_end:
+            footer_by_str = self._combine([self.rows_contain(kw) for kw in end_row_kws], endtriggerone)
+            # 最后一行只根据单元格判断表尾, 与原实现的判断顺序一致
+            footer_by_str[last] = False
+            footer = footer | footer_by_str
+
+        stop = _first(footer, start + 1)
+        give_up = _first(pulled, start + 1)
+        if give_up is not None and give_up < last and (stop is None or give_up < stop):
+            return Region(start, None, give_up, pulled=True)
+        if stop is None:
+            # 直至最后一行都未出现表尾, 最后一行即为数据
+            return Region(start, last, last)
+        return Region(start, stop - 1, stop)
@@ -0,0 +1,166 @@
+# coding=utf8
+
+"""
+解析器注册管理
+
+解析器按 (for_file, for_region, parsername) 注册, 同时根据各解析器声明的特征关键词(_SIGNATURES)
+建立 关键词 -> 解析器 的倒排索引. 为文件寻找解析器时先对文件所有单元格扫描一次, 通过倒排索引筛选
+出特征关键词全部出现的候选解析器, 再逐一调用候选解析器的 match, 避免每个解析器都完整读一遍数据.
+LazyWorkbook 中尚未解析的 sheet 只扫描前 SCAN_ROWS 行(peek), 不会因筛选而解析所有 sheet.
+"""
+
+import pandas
+import typing as t
+from collections import OrderedDict, defaultdict
+from X1.stand import ArgStandError
+from X2.XExcel.read import LazyWorkbook
+from Stock.exchange.parsers import _BaseParser, BASE_CLASSES
+
+# LazyWorkbook 中尚未解析的 sheet 扫描的行数, 特征关键词(标题、账号、表头)应出现在这些行中
+SCAN_ROWS = 200
+
+
+def _sheets(data) -> t.Iterable[pandas.DataFrame]:
+    if isinstance(data, pandas.DataFrame):
+        return (data,)
+    if isinstance(data, LazyWorkbook):
+        loaded = set(data.loaded)
+        return (data[name] if name in loaded else data.peek(name, SCAN_ROWS) for name in data)
+    if isinstance(data, t.Mapping):
+        return data.values()
+    return data
+
+
+def scan_tokens(data) -> t.Set[str]:
+    """
+    收集文件中所有(去除首尾空白的)字符串单元格
+
+    Args:
+        data: DataFrame 或 read_excel_by_* 返回的 {sheet名称: DataFrame}, LazyWorkbook 中尚未解析的
+              sheet 只扫描前 SCAN_ROWS 行
+
+    Returns: 单元格字符串集合
+    """
+    tokens = set()
+    for sheet in _sheets(data):
+        if sheet.size == 0:
+            continue
+        cells = pandas.unique(sheet.to_numpy(dtype=object).ravel())
+        tokens.update(cell.strip() for cell in cells if isinstance(cell, str))
+    return tokens
+
+
+class ParserRegistry(object):
+
+    def __init__(self):
+        self._parsers: t.Dict[t.Tuple[str, str, str], t.Type[_BaseParser]] = OrderedDict()
+        # 关键词 -> {(解析器key, 关键词组序号)}
+        self._index: t.Dict[str, t.Set[t.Tuple[t.Tuple[str, str, str], int]]] = defaultdict(set)
+        # 未声明特征关键词的解析器, 无法筛选, 总是作为候选
+        self._unsigned: t.List[t.Tuple[str, str, str]] = []
+        # 解析器key -> (注册序号, 关键词组数量)
+        self._meta: t.Dict[t.Tuple[str, str, str], t.Tuple[int, int]] = {}
+        self._serial = 0
+
+    @staticmethod
+    def key(parser: t.Type[_BaseParser]) -> t.Tuple[str, str, str]:
+        return parser.for_file, parser.for_region, parser.parsername
+
+    def __len__(self):
+        return len(self._parsers)
+
+    def __contains__(self, parser):
+        return self.key(parser) in self._parsers
+
+    def __iter__(self):
+        return iter(self._parsers.values())
+
+    def register(self, parser: t.Type[_BaseParser]):
+        """
+        注册解析器, 可以作为类装饰器使用
+
+        Args:
+            parser: 继承自 MainlandParser/CICCParser/UBSParser 的解析器类
+        """
+        if not (isinstance(parser, type) and issubclass(parser, BASE_CLASSES)):
+            raise ArgStandError(f"parser should be a subclass of {BASE_CLASSES}, but {parser}")
+        key = self.key(parser)
+        if key in self._parsers:
+            raise ArgStandError(f"parser {key} has been registered by {self._parsers[key]}")
+
+        self._parsers[key] = parser
+        signatures = parser.signatures
+        self._meta[key] = (self._serial, len(signatures))
+        self._serial += 1
+        if not signatures:
+            self._unsigned.append(key)
+        for group_no, group in enumerate(signatures):
+            for token in group:
+                self._index[token.strip()].add((key, group_no))
+        return parser
+
+    def unregister(self, parser: t.Type[_BaseParser]):
+        key = self.key(parser)
+        if self._parsers.pop(key, None) is None:
+            raise KeyError(f"parser {key} was not registered")
+        del self._meta[key]
+        if key in self._unsigned:
+            self._unsigned.remove(key)
+        for token in [token for token, postings in self._index.items() if any(p[0] == key for p in postings)]:
+            self._index[token] = {p for p in self._index[token] if p[0] != key}
+            if not self._index[token]:
+                del self._index[token]
+
+    def get(self, for_file: str, for_region: str, parsername: str) -> t.Type[_BaseParser]:
+        return self._parsers[(for_file, for_region, parsername)]
+
+    def candidates(self, data, for_file: str = None, for_region: str = None) -> t.List[t.Type[_BaseParser]]:
+        """
+        根据文件单元格筛选候选解析器, 所有特征关键词组均有出现的解析器才会成为候选,
+        未声明特征关键词的解析器排在最后.
+
+        Args:
+            data: DataFrame 或 read_excel_by_* 返回的 {sheet名称: DataFrame}
+            for_file: 限定文件类型
+            for_region: 限定解析器归属
+
+        Returns: 候选解析器列表, 按注册顺序排列
+        """
+        hit_groups = defaultdict(set)
+        for token in scan_tokens(data):
+            for key, group_no in self._index.get(token, ()):
+                hit_groups[key].add(group_no)
+
+        signed = sorted((key for key, groups in hit_groups.items()
+                         if len(groups) == self._meta[key][1]),
+                        key=lambda _key: self._meta[_key][0])
+        candidates = []
+        for key in signed + self._unsigned:
+            if for_file is not None and key[0] != for_file:
+                continue
+            if for_region is not None and key[1] != for_region:
+                continue
+            candidates.append(self._parsers[key])
+        return candidates
+
+    def match(self, data, for_file: str = None, for_region: str = None, **data_attrs) -> t.Optional[_BaseParser]:
+        """
+        返回第一个 match 成功的解析器实例, 均不匹配返回 None
+
+        Args:
+            data: 传递给解析器 match 的数据
+            for_file: 限定文件类型
+            for_region: 限定解析器归属
+            **data_attrs: 传递给解析器 match 的数据属性
+        """
+        for parser in self.candidates(data, for_file=for_file, for_region=for_region):
+            instance = parser()
+            try:
+                matched = instance.match(data, **data_attrs)
+            except NotImplementedError:
+                continue
+            if matched:
+                return instance
+
+
+registry = ParserRegistry()
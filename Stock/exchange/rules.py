@@ -0,0 +1,157 @@
+# coding=utf8
+
+"""
+文本对账单匹配规则
+
+txt_match_rules 表中的规则(data_regex/check_regex/uncheck_regex)逐行作用于文本数据, 规则在加载时
+一次性编译, 并按 dtypes.DestinationGroups 检查 data_regex 的组名, 逐行匹配时不再做任何编译或检查.
+
+    ruleset = RuleSet.from_rows(rows, brokerage_id=3)
+    for line in iter_text_lines(filepath):
+        for rule in ruleset.rules_for(StockData.trade_flow):
+            data = rule.search(line)
+"""
+
+import typing as t
+from collections import OrderedDict
+from Stock.exchange.dtypes import StockData, DestinationGroups
+from X1.stand import ArgStandError
+from X2.utlis import compile_regex
+
+
+def _compile(pattern: t.Optional[str]) -> t.Optional[t.Pattern]:
+    if pattern is None or pattern == '':
+        return None
+    return compile_regex(pattern)
+
+
+class MatchRule(object):
+
+    __slots__ = ('rule_id', 'genus', 'data_regex', 'check_regex', 'check_follow',
+                 'uncheck_regex', 'uncheck_follow', 'must_return', 'priority', 'delimit_sign')
+
+    def __init__(self, genus: StockData, data_regex: str,
+                 check_regex: str = None, check_follow: bool = False,
+                 uncheck_regex: str = None, uncheck_follow: bool = False,
+                 must_return: bool = False, priority: int = 1,
+                 delimit_sign: str = None, rule_id: int = None):
+        """
+        Args:
+            genus: 解析归属类型
+            data_regex: 取值正则, 组名必须属于 DestinationGroups[genus]
+            check_regex: `数据发现`正则
+            check_follow: 数据发现时是否取值当前行数据
+            uncheck_regex: `数据结束`正则
+            uncheck_follow: 数据结束时是否取值当前行数据
+            must_return: 一定要有结果与否
+            priority: 优先使用处理权级, 越小越优先
+            delimit_sign: 格式化文本数据分隔符
+            rule_id: txt_match_rules 表 id
+        """
+        if not isinstance(genus, StockData):
+            raise ArgStandError(f"genus should be a StockData member, but {genus!r}")
+        self.rule_id = rule_id
+        self.genus = genus
+        self.data_regex = _compile(data_regex)
+        if self.data_regex is None:
+            raise ArgStandError(f"rule {rule_id}: data_regex is required")
+        self.check_regex = _compile(check_regex)
+        self.check_follow = bool(check_follow)
+        self.uncheck_regex = _compile(uncheck_regex)
+        self.uncheck_follow = bool(uncheck_follow)
+        self.must_return = bool(must_return)
+        self.priority = priority if priority is not None else 1
+        self.delimit_sign = delimit_sign
+        self._check_groups()
+
+    def _check_groups(self):
+        groups = set(self.data_regex.groupindex)
+        if not groups:
+            raise ArgStandError(f"rule {self.rule_id}: can not find namespace in pattern "
+                                f"'{self.data_regex.pattern}'")
+        unknown = groups - set(DestinationGroups[self.genus])
+        if unknown:
+            raise ArgStandError(f"rule {self.rule_id}: groups {sorted(unknown)} are not allowed for {self.genus}, "
+                                f"refer to dtypes.DestinationGroups")
+
+    @classmethod
+    def from_row(cls, row: t.Mapping) -> 'MatchRule':
+        """ 根据 txt_match_rules 表记录创建规则 """
+        return cls(genus=StockData(row['data_genus_id']),
+                   data_regex=row['data_regex'],
+                   check_regex=row.get('check_regex'),
+                   check_follow=row.get('check_follow'),
+                   uncheck_regex=row.get('uncheck_regex'),
+                   uncheck_follow=row.get('uncheck_follow'),
+                   must_return=row.get('must_return'),
+                   priority=row.get('priority'),
+                   delimit_sign=row.get('delimit_sign'),
+                   rule_id=row.get('id'))
+
+    def search(self, line: str) -> t.Optional[t.Dict[str, str]]:
+        result = self.data_regex.search(line)
+        if result is not None:
+            return result.groupdict()
+        return None
+
+    def checked(self, line: str) -> bool:
+        return self.check_regex is not None and self.check_regex.search(line) is not None
+
+    def unchecked(self, line: str) -> bool:
+        return self.uncheck_regex is not None and self.uncheck_regex.search(line) is not None
+
+    def __repr__(self):
+        return f"<MatchRule {self.rule_id} {self.genus.name} '{self.data_regex.pattern}'>"
+
+
+class RuleSet(object):
+
+    def __init__(self, rules: t.Iterable[MatchRule], brokerage_id: int = None):
+        """
+        单个券商的全部规则, 按解析归属类型分组, 组内按 priority 排序
+
+        Args:
+            rules: 规则
+            brokerage_id: 券商 id
+        """
+        self.brokerage_id = brokerage_id
+        grouped = OrderedDict()
+        for rule in sorted(rules, key=lambda _rule: _rule.priority):
+            grouped.setdefault(rule.genus, []).append(rule)
+        self._rules: t.Dict[StockData, t.Tuple[MatchRule, ...]] = OrderedDict(
+            (genus, tuple(rules)) for genus, rules in grouped.items())
+
+    @classmethod
+    def from_rows(cls, rows: t.Iterable[t.Mapping], brokerage_id: int = None) -> 'RuleSet':
+        """
+        根据 txt_match_rules 表记录创建规则集, 任一规则不合法都会在加载时抛出 ArgStandError
+
+        Args:
+            rows: 表记录
+            brokerage_id: 仅加载该券商的规则, 为 None 时加载全部记录
+        """
+        return cls((MatchRule.from_row(row) for row in rows
+                    if brokerage_id is None or row.get('brokerage_id') == brokerage_id),
+                   brokerage_id=brokerage_id)
+
+    @property
+    def genera(self) -> t.Tuple[StockData, ...]:
+        return tuple(self._rules)
+
+    def rules_for(self, genus: StockData) -> t.Tuple[MatchRule, ...]:
+        return self._rules.get(genus, ())
+
+    def search(self, genus: StockData, line: str) -> t.Optional[t.Dict[str, str]]:
+        """ 按优先级返回第一个匹配的规则结果 """
+        for rule in self._rules.get(genus, ()):
+            result = rule.search(line)
+            if result is not None:
+                return result
+        return None
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._rules.values())
+
+    def __iter__(self):
+        for rules in self._rules.values():
+            yield from rules
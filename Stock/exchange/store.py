@@ -0,0 +1,227 @@
+# coding=utf8
+
+"""
+解析结果列式存储
+
+持仓、交易流水、未了结合约等表数据以 JSON 记录({"data": [{...}, ...]})输出时, 序列化和内存开销都与
+行数×列数成正比. StatementStore 将各类表数据按 交易日/账户 分区写为 Parquet 或 Arrow IPC 文件:
+
+    root/trade_flow/trade_date=20210105/trade_account=1001234/part-0.parquet
+
+下游分析只读取需要的列和日期/账户分区; Arrow IPC 格式不压缩, 读取时通过内存映射零拷贝加载.
+
+    store = StatementStore("/data/statements", fmt="arrow")
+    store.write(StockData.trade_flow, flow, trade_date="20210105", trade_account="1001234")
+    frame = store.read(StockData.trade_flow, columns=[u"证券代码", u"发生金额"], trade_dates=["20210105"])
+
+依赖 pyarrow, 未安装时创建 StatementStore 会抛出 NoComponentError.
+"""
+
+import os
+import typing as t
+from urllib.parse import quote, unquote
+import pandas
+from Stock.exchange.dtypes import StockData
+from Stock.exchange.parsers import (POSITION_COLUMNS_TYPES, TRADE_FLOW_COLUMNS_TYPES, CONTRACT_FLOW_COLUMNS_TYPES,
+                                    TRADE_EVENT_COLUMN, comfort_table, comfort_trade_flow)
+from X1.component import NoComponentError
+from X1.stand import ArgStandError
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.feather
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FMT_PARQUET = 'parquet'
+FMT_ARROW = 'arrow'
+_EXTENSIONS = {FMT_PARQUET: '.parquet', FMT_ARROW: '.arrow'}
+
+PARTITION_COLUMNS = ("trade_date", "trade_account")
+
+# 数据类型 -> (目录名称, 标准列类型)
+TABLE_KINDS: t.Dict[StockData, t.Tuple[str, t.Mapping]] = {
+    StockData.stock_position: ("stock_position", POSITION_COLUMNS_TYPES),
+    StockData.trade_flow: ("trade_flow", TRADE_FLOW_COLUMNS_TYPES),
+    StockData.contract_position: ("contract_position", CONTRACT_FLOW_COLUMNS_TYPES),
+}
+
+
+def _arrow_type(dtype):
+    if dtype is float:
+        return pyarrow.float64()
+    if dtype == "category":
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.string()
+
+
+def table_schema(kind: StockData) -> "pyarrow.Schema":
+    """
+    数据类型对应的 Arrow schema, 所有分区文件使用相同的 schema, 整列为空时也不会推断为 null 类型
+
+    Args:
+        kind: StockData.stock_position/trade_flow/contract_position
+
+    Returns: pyarrow.Schema, 列顺序与标准列类型一致, 交易流水末尾为交易事件列
+    """
+    _, columns_types = TABLE_KINDS[kind]
+    fields = [pyarrow.field(column, _arrow_type(dtype)) for column, dtype in columns_types.items()]
+    if kind is StockData.trade_flow:
+        fields.append(pyarrow.field(TRADE_EVENT_COLUMN, _arrow_type("category")))
+    return pyarrow.schema(fields)
+
+
+class StatementStore(object):
+
+    def __init__(self, root: str, fmt: str = FMT_PARQUET):
+        """
+        Args:
+            root: 存储根目录
+            fmt: parquet(压缩, 体积小) 或 arrow(Arrow IPC 不压缩, 读取时内存映射零拷贝)
+        """
+        if pyarrow is None:
+            raise NoComponentError("StatementStore requires pyarrow, please install it first.")
+        if fmt not in _EXTENSIONS:
+            raise ArgStandError(f"fmt should be one of {tuple(_EXTENSIONS)}, but {fmt}")
+        self.root = root
+        self.fmt = fmt
+        self._filesystem = pyarrow.fs.LocalFileSystem(use_mmap=fmt == FMT_ARROW)
+
+    @staticmethod
+    def _kind(kind: StockData) -> t.Tuple[str, t.Mapping]:
+        try:
+            return TABLE_KINDS[kind]
+        except KeyError:
+            raise ArgStandError(f"{kind} is not a table kind, should be one of {tuple(TABLE_KINDS)}")
+
+    def partition_path(self, kind: StockData, trade_date: str, trade_account: str) -> str:
+        name, _ = self._kind(kind)
+        return os.path.join(self.root, name,
+                            f"trade_date={quote(str(trade_date), safe='')}",
+                            f"trade_account={quote(str(trade_account), safe='')}")
+
+    @staticmethod
+    def _conform(kind: StockData, frame: pandas.DataFrame) -> pandas.DataFrame:
+        _, columns_types = TABLE_KINDS[kind]
+        if kind is StockData.trade_flow and TRADE_EVENT_COLUMN not in frame.columns:
+            return comfort_trade_flow(frame)
+        if list(frame.columns)[:len(columns_types)] != list(columns_types):
+            conformed = comfort_table(frame, columns_types)
+            if TRADE_EVENT_COLUMN in frame.columns:
+                conformed[TRADE_EVENT_COLUMN] = frame[TRADE_EVENT_COLUMN]
+            return conformed
+        return frame
+
+    def write(self, kind: StockData, frame: pandas.DataFrame, trade_date: str, trade_account: str) -> str:
+        """
+        写入一张对账单中的一类表数据, 同一 交易日/账户 分区再次写入时覆盖(重复解析结果一致)
+
+        Args:
+            kind: StockData.stock_position/trade_flow/contract_position
+            frame: 表数据, 列不是标准列时先按 comfort_table/comfort_trade_flow 整理
+            trade_date: 交易日 YYYYmmdd
+            trade_account: 账户
+
+        Returns: 写入的文件路径
+        """
+        schema = table_schema(kind)
+        frame = self._conform(kind, frame)
+        table = pyarrow.Table.from_pandas(frame[schema.names], schema=schema, preserve_index=False)
+        # 去掉 pandas 元数据, 读取时 schema 只由 table_schema 决定
+        table = table.replace_schema_metadata(None)
+
+        directory = self.partition_path(kind, trade_date, trade_account)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "part-0" + _EXTENSIONS[self.fmt])
+        # 以 . 开头的临时文件不会被数据集读取
+        temppath = os.path.join(directory, ".part-0.tmp")
+        try:
+            if self.fmt == FMT_PARQUET:
+                pyarrow.parquet.write_table(table, temppath)
+            else:
+                # 不压缩才能在读取时零拷贝
+                pyarrow.feather.write_feather(table, temppath, compression='uncompressed')
+            os.replace(temppath, path)
+        except BaseException:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+            raise
+        return path
+
+    def write_frames(self, frames: t.Mapping[StockData, pandas.DataFrame],
+                     trade_date: str, trade_account: str) -> t.List[str]:
+        """ 写入一张对账单中的各类表数据, 空表不写入 """
+        return [self.write(kind, frame, trade_date, trade_account)
+                for kind, frame in frames.items() if frame is not None and len(frame)]
+
+    def dataset_schema(self, kind: StockData) -> "pyarrow.Schema":
+        """ 表数据及分区列的 schema """
+        schema = table_schema(kind)
+        for column in PARTITION_COLUMNS:
+            schema = schema.append(pyarrow.field(column, pyarrow.string()))
+        return schema
+
+    def dataset(self, kind: StockData) -> "pyarrow.dataset.Dataset":
+        name, _ = self._kind(kind)
+        partitioning = pyarrow.dataset.partitioning(
+            pyarrow.schema([pyarrow.field(column, pyarrow.string()) for column in PARTITION_COLUMNS]),
+            flavor='hive')
+        return pyarrow.dataset.dataset(os.path.join(self.root, name),
+                                       schema=self.dataset_schema(kind),
+                                       format='feather' if self.fmt == FMT_ARROW else 'parquet',
+                                       partitioning=partitioning,
+                                       filesystem=self._filesystem)
+
+    def read_table(self, kind: StockData,
+                   columns: t.Sequence[str] = None,
+                   trade_dates: t.Iterable[str] = None,
+                   trade_accounts: t.Iterable[str] = None) -> "pyarrow.Table":
+        """
+        读取表数据, 按分区目录过滤交易日/账户, 不匹配分区中的文件不会被读取, 只加载需要的列
+
+        Args:
+            kind: StockData.stock_position/trade_flow/contract_position
+            columns: 需要的列, 可以包含 trade_date/trade_account 分区列, 默认为所有列
+            trade_dates: 交易日范围, 默认为所有交易日
+            trade_accounts: 账户范围, 默认为所有账户
+
+        Returns: pyarrow.Table
+        """
+        name, _ = self._kind(kind)
+        if not os.path.isdir(os.path.join(self.root, name)):
+            schema = self.dataset_schema(kind)
+            return schema.empty_table() if columns is None else schema.empty_table().select(list(columns))
+        expression = None
+        for column, values in zip(PARTITION_COLUMNS, (trade_dates, trade_accounts)):
+            if values is None:
+                continue
+            condition = pyarrow.dataset.field(column).isin([str(value) for value in values])
+            expression = condition if expression is None else expression & condition
+        columns = None if columns is None else list(columns)
+        return self.dataset(kind).to_table(columns=columns, filter=expression)
+
+    def read(self, kind: StockData,
+             columns: t.Sequence[str] = None,
+             trade_dates: t.Iterable[str] = None,
+             trade_accounts: t.Iterable[str] = None) -> pandas.DataFrame:
+        """ 同 read_table, 返回 DataFrame """
+        return self.read_table(kind, columns, trade_dates, trade_accounts).to_pandas()
+
+    def partitions(self, kind: StockData) -> t.List[t.Tuple[str, str]]:
+        """ 已写入的 (交易日, 账户) 分区 """
+        name, _ = self._kind(kind)
+        partitions = []
+        directory = os.path.join(self.root, name)
+        if not os.path.isdir(directory):
+            return partitions
+        for date_entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if not date_entry.is_dir() or not date_entry.name.startswith("trade_date="):
+                continue
+            for account_entry in sorted(os.scandir(date_entry.path), key=lambda entry: entry.name):
+                if account_entry.is_dir() and account_entry.name.startswith("trade_account="):
+                    partitions.append((unquote(date_entry.name.split("=", 1)[1]),
+                                       unquote(account_entry.name.split("=", 1)[1])))
+        return partitions
@@ -0,0 +1,30 @@
+# coding=utf8
+
+"""
+BatchParser 测试用解析器, 工作进程通过 parser_modules 导入时注册
+
+文件内容为 `休眠秒数,<秒数>`, 解析时等待该秒数后返回; 秒数为负数时抛出 ValueError.
+"""
+
+import time
+from Stock.exchange.parsers import MainlandParser
+from Stock.exchange.parsers.registry import registry
+
+
+@registry.register
+class SleepParser(MainlandParser):
+
+    _PARSER_NAME = "sleep"
+    _FOR_TYPE    = "csv"
+    _FOR_REGION  = "test"
+    _SIGNATURES  = (u"休眠秒数",)
+
+    def match(self, data, **data_attrs):
+        return True
+
+    def parse(self, data, **data_attrs):
+        seconds = float(next(iter(data.values())).iloc[0, 1])
+        if seconds < 0:
+            raise ValueError(f"negative seconds {seconds}")
+        time.sleep(seconds)
+        return {"data": [{"seconds": seconds}], "data_attrs": data_attrs}
@@ -0,0 +1,204 @@
+# coding=utf8
+
+"""
+批量解析测试: run 按完成顺序返回结果并限制同时提交的任务数; 压缩包解析结果按子文件在压缩包中的顺序返回
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from io import BytesIO
+import pandas
+from Stock.exchange import batch
+from Stock.exchange.batch import BatchParser
+
+PARSER_MODULES = ["Stock.test.batch_parsers"]
+
+
+def _zip(members: dict) -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as handler:
+        for name, data in members.items():
+            handler.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _rar_block(head_type: int, flags: int, body: bytes = b"") -> bytes:
+    header = struct.pack("<BHH", head_type, flags, 7 + len(body)) + body
+    return struct.pack("<H", zlib.crc32(header) & 0xFFFF) + header
+
+
+def _rar(members: dict) -> bytes:
+    """ RAR 4.x 格式, 子文件不压缩(stored), rarfile 直接从压缩包文件对象中读取 """
+    blocks = [b"Rar!\x1a\x07\x00", _rar_block(0x73, 0, b"\x00" * 6)]
+    for name, data in members.items():
+        name = name.encode()
+        body = struct.pack("<IIBIIBBHI", len(data), len(data), 3, zlib.crc32(data), 0x21, 20, 0x30,
+                           len(name), 0o100644 << 16) + name
+        blocks.append(_rar_block(0x74, 0x8000, body) + data)
+    blocks.append(_rar_block(0x7B, 0x4000))
+    return b"".join(blocks)
+
+
+class _SlowFile(BytesIO):
+    """ 每次读取都让出线程, 使多个线程的 seek/read 交错 """
+
+    def read(self, *args):
+        time.sleep(0.001)
+        return super().read(*args)
+
+    def readinto(self, buffer):
+        time.sleep(0.001)
+        return super().readinto(buffer)
+
+
+def _sleep_files(directory: str, seconds) -> list:
+    filepaths = []
+    for no, second in enumerate(seconds):
+        filepath = os.path.join(directory, f"{no}.csv")
+        with open(filepath, mode="w", encoding="utf-8") as handler:
+            handler.write(f"休眠秒数,{second}\n")
+        filepaths.append(filepath)
+    return filepaths
+
+
+def test_run_order():
+    directory = tempfile.mkdtemp()
+    try:
+        filepaths = _sleep_files(directory, [0.8, 0.0, 0.4])
+        runner = BatchParser(workers=3, parser_modules=PARSER_MODULES)
+        results = list(runner.run(filepaths, trade_date="20210105"))
+        # 按完成顺序返回
+        assert [result.filepath for result in results] == [filepaths[1], filepaths[2], filepaths[0]]
+        assert all(result.error is None and result.parser == "sleep" for result in results)
+        assert results[0].result["data_attrs"] == {"trade_date": "20210105"}
+        assert runner.summary.total == runner.summary.succeeded == 3
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_run_in_flight():
+    directory = tempfile.mkdtemp()
+    try:
+        filepaths = _sleep_files(directory, [0.05] * 8)
+        consumed = []
+
+        def produce():
+            for filepath in filepaths:
+                consumed.append(filepath)
+                yield filepath
+
+        runner = BatchParser(workers=1, max_in_flight=2, parser_modules=PARSER_MODULES)
+        results = []
+        for result in runner.run(produce()):
+            # 已提交未返回的任务(含当前结果)不超过 max_in_flight
+            assert len(consumed) - len(results) <= 2
+            results.append(result)
+        assert sorted(result.filepath for result in results) == sorted(filepaths)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_run_errors():
+    directory = tempfile.mkdtemp()
+    try:
+        timeout, failed, succeeded = _sleep_files(directory, [5, -1, 0])
+        unmatched = os.path.join(directory, "unmatched.csv")
+        with open(unmatched, mode="w", encoding="utf-8") as handler:
+            handler.write(u"发生日期,证券代码\n")
+        runner = BatchParser(workers=2, timeout=1, parser_modules=PARSER_MODULES)
+        started = time.time()
+        results = {result.filepath: result for result in runner.run([timeout, failed, succeeded, unmatched])}
+        # 超时的文件在超时后放弃, 不等待解析完成
+        assert time.time() - started < 4
+        assert results[succeeded].error is None
+        assert "TimeoutError" in results[timeout].error and results[timeout].parser == "sleep"
+        assert "ValueError: negative seconds" in results[failed].error
+        assert "LookupError: no parser matched" in results[unmatched].error and results[unmatched].parser is None
+        assert runner.summary.to_dict()["failed"] == 3 and runner.summary.succeeded == 1
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_run_archive_order():
+    csv = u"发生日期,证券代码\n20210105,600000\n".encode("GB18030")
+    inner = _zip({"b1.csv": csv, "skip.txt": b"", "b2.csv": csv})
+    archive = _zip({"a.csv": csv * 1000, "nested.zip": inner, "readme.txt": b"", "c.csv": csv})
+    runner = BatchParser(workers=2, decompress_workers=3)
+    results = runner.run_archive(BytesIO(archive), target_ext=".csv")
+    assert [result.filepath for result in results] == ["a.csv", "nested.zip/b1.csv", "nested.zip/b2.csv", "c.csv"]
+    # 未注册解析器, 均记录为失败
+    assert runner.summary.total == 4 and len(runner.summary.failures) == 4
+
+
+def test_run_archive_rar():
+    members = {f"{no}.csv": f"休眠秒数,0.00{no}\n".encode("utf-8") + b"#" * (256 * 1024) for no in range(6)}
+    runner = BatchParser(workers=2, decompress_workers=6, parser_modules=PARSER_MODULES)
+    results = runner.run_archive(_SlowFile(_rar(members)), target_ext=".csv")
+    # 多个线程同时解压 rar 子文件时内容不会错乱
+    assert [result.filepath for result in results] == list(members)
+    assert [result.error for result in results] == [None] * 6
+    assert [result.result["data"][0]["seconds"] for result in results] == [no / 1000 for no in range(6)]
+
+
+def _workbook(seconds: float) -> bytes:
+    buffer = BytesIO()
+    with pandas.ExcelWriter(buffer) as writer:
+        pandas.DataFrame([[u"休眠秒数", seconds]]).to_excel(writer, sheet_name="sleep", header=False, index=False)
+        pandas.DataFrame([[u"其他"]]).to_excel(writer, sheet_name="other", header=False, index=False)
+    return buffer.getvalue()
+
+
+def test_parse_lazy_workbook(monkeypatch):
+    import Stock.test.batch_parsers  # noqa: F401, 注册 SleepParser
+    opened = []
+
+    def read(fileflow):
+        workbook = batch.read_excel_by_fileflow(fileflow, lazy=True)
+        monkeypatch.setattr(workbook, "close", lambda: opened.remove(workbook))
+        opened.append(workbook)
+        return workbook
+
+    for seconds, error in ((0, None), (-1, "ValueError")):
+        fileflow = _workbook(seconds)
+        result = batch._parse("statement.xlsx", lambda: read(fileflow), None, {})
+        assert (result.error is None) if error is None else (error in result.error)
+    # 解析成功或失败后均关闭
+    assert opened == []
+
+
+def test_run_archive_in_flight(monkeypatch):
+    csv = u"发生日期,证券代码\n20210105,600000\n".encode("GB18030")
+    archive = _zip({f"{no}.csv": csv for no in range(8)})
+    lock = threading.Lock()
+    counts = {"running": 0, "peak": 0}
+
+    def extract(*args):
+        with lock:
+            counts["running"] += 1
+            counts["peak"] = max(counts["peak"], counts["running"])
+        time.sleep(0.05)
+        with lock:
+            counts["running"] -= 1
+        return origin(*args)
+
+    origin = batch._extract
+    monkeypatch.setattr(batch, "_extract", extract)
+    runner = BatchParser(workers=1, max_in_flight=2, decompress_workers=8)
+    results = runner.run_archive(BytesIO(archive), target_ext=".csv")
+    assert [result.filepath for result in results] == [f"{no}.csv" for no in range(8)]
+    # 解压线程数多于 max_in_flight 时, 同时解压的子文件数仍受限
+    assert counts["peak"] <= 2
+
+
+if __name__ == '__main__':
+    test_run_order()
+    test_run_in_flight()
+    test_run_errors()
+    test_run_archive_order()
+    test_run_archive_rar()
@@ -0,0 +1,117 @@
+# coding=utf8
+
+"""
+表数据整理测试: 数值列整列转换、comfort_table、交易事件归类
+"""
+
+import numpy
+import pandas
+import pytest
+from Stock.exchange.dtypes import FloatColumn, _clean_numeric_text, to_float_series
+from Stock.exchange.parsers import (TRADE_EVENT_COLUMN, TRADE_EVENTS, TRADE_FLOW_COLUMNS_TYPES, classify_trade_events,
+                                    comfort_table, comfort_trade_flow)
+
+nan = numpy.nan
+
+
+@pytest.mark.parametrize("text, expected", [
+    (u"1,234.50", u"1234.50"),
+    (u" 1 234.50\t", u"1234.50"),
+    (u"(1,234.50)", u"-1234.50"),
+    (u"（1，234.50）", u"-1234.50"),
+    (u"-8.00", u"-8.00"),
+    (u"", u""),
+])
+def test_clean_numeric_text(text, expected):
+    assert _clean_numeric_text(text) == expected
+
+
+def test_to_float_series():
+    series = pandas.Series([u"1,234.50", u"(1,234.50)", 3, None, u"--", u"  8 ", 2.5, pandas.Timestamp("20210105")],
+                           index=list("abcdefgh"), name=u"发生金额")
+    result = to_float_series(series)
+    expected = pandas.Series([1234.5, -1234.5, 3.0, nan, nan, 8.0, 2.5, nan], index=list("abcdefgh"), name=u"发生金额")
+    pandas.testing.assert_series_equal(result, expected)
+    # 干净数据整列转换
+    pandas.testing.assert_series_equal(to_float_series(pandas.Series([u"1", u"2.5"])), pandas.Series([1.0, 2.5]))
+    pandas.testing.assert_series_equal(to_float_series(pandas.Series([1, 2])), pandas.Series([1.0, 2.0]))
+    # 超长字符串与会计记账负数混在一起时整列清洗
+    series = pandas.Series([u"（1，234.50）", u"备注" * 100000, u"1 000", u"-"])
+    numpy.testing.assert_array_equal(to_float_series(series).to_numpy(), [-1234.5, nan, 1000.0, nan])
+
+
+def test_float_column_adapt_series():
+    column = FloatColumn(cn=u"发生金额", eng="amount")
+    series = pandas.Series([u"(1,234.50)", u"1,000", u"abc"])
+    # 与 adapt 规则相同, 无法转换的数据为 NaN
+    assert column.adapt(u"(1,234.50)") == -1234.5
+    with pytest.raises(ValueError):
+        column.adapt(u"abc")
+    pandas.testing.assert_series_equal(column.adapt_series(series), pandas.Series([-1234.5, 1000.0, nan]))
+
+
+def test_comfort_table():
+    table = pandas.DataFrame({u"摘要": [u"证券买入", u"证券卖出", u"证券买入"],
+                              u"证券代码": [600000, u"000001", u"600000"],
+                              u"发生金额": [u"(1,234.50)", u"1,000", None],
+                              u"无关列": [1, 2, 3]},
+                             index=[5, 5, 7])
+    result = comfort_table(table, TRADE_FLOW_COLUMNS_TYPES)
+    assert list(result.columns) == list(TRADE_FLOW_COLUMNS_TYPES)
+    assert list(result.index) == [5, 5, 7]
+    assert isinstance(result[u"摘要"].dtype, pandas.CategoricalDtype)
+    assert list(result[u"摘要"].cat.categories) == [u"证券买入", u"证券卖出"]
+    assert result[u"证券代码"].tolist() == [u"600000", u"000001", u"600000"]
+    numpy.testing.assert_array_equal(result[u"发生金额"].to_numpy(), [-1234.5, 1000.0, nan])
+    assert result[u"成交股数"].dtype == float and result[u"成交股数"].isna().all()
+
+
+def _labels():
+    return list(classify_trade_events(pandas.Series([], dtype=object)).cat.categories)
+
+
+def test_trade_event_labels():
+    labels = _labels()
+    # 去除转义与首尾空白, 重复的事件只保留一个, 顺序与 TRADE_EVENTS 一致
+    assert len(labels) == len(set(labels)) == len(set(TRADE_EVENTS))
+    assert labels[:3] == [u"证券买入", u"证券卖出", u"回购融券"]
+    assert u"申购中签(转非流通)" in labels and u"资产修正存" in labels
+    assert labels.index(u"ETF申购扣费") < labels.index(u"ETF申购")
+
+
+def test_classify_trade_events():
+    summaries = pandas.Series([u"ETF申购扣费", u"ETF申购", u"ETF赎回返资", u"担保品买入", u"普通证券买入",
+                               u"申购中签(转非流通)", u"资产修正存", u"申购中签转非流通", u"未知业务", None, nan],
+                              index=range(10, 21))
+    events = classify_trade_events(summaries)
+    assert list(events.index) == list(range(10, 21))
+    # 重叠的事件名按最长匹配, 摘要中包含事件名即可归类
+    assert events.tolist()[:7] == [u"ETF申购扣费", u"ETF申购", u"ETF赎回返资", u"担保品买入", u"证券买入",
+                                   u"申购中签(转非流通)", u"资产修正存"]
+    # TRADE_EVENTS 中的转义按正则匹配, 不匹配去掉括号的摘要; 未归类的为 NaN
+    assert events.iloc[7:].isna().all()
+
+    labels = _labels()
+    codes = events.cat.codes.tolist()
+    assert codes[:7] == [labels.index(event) for event in events.tolist()[:7]]
+    assert codes[7:] == [-1] * 4
+
+
+def test_comfort_trade_flow():
+    table = pandas.DataFrame({u"摘要": [u"证券买入", u"ETF申购扣费", u"未知业务"],
+                              u"发生金额": [u"(1,234.50)", u"8.00", u"0"]})
+    result = comfort_trade_flow(table)
+    assert list(result.columns) == list(TRADE_FLOW_COLUMNS_TYPES) + [TRADE_EVENT_COLUMN]
+    assert isinstance(result[TRADE_EVENT_COLUMN].dtype, pandas.CategoricalDtype)
+    assert list(result[TRADE_EVENT_COLUMN].cat.categories) == _labels()
+    assert result[TRADE_EVENT_COLUMN].cat.codes.tolist() == [0, _labels().index(u"ETF申购扣费"), -1]
+    assert result[u"发生金额"].tolist() == [-1234.5, 8.0, 0.0]
+
+
+if __name__ == '__main__':
+    test_to_float_series()
+    test_float_column_adapt_series()
+    test_comfort_table()
+    test_trade_event_labels()
+    test_classify_trade_events()
+    test_comfort_trade_flow()
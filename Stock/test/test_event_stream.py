@@ -0,0 +1,125 @@
+# coding=utf8
+
+"""
+文本对账单逐行推送 EventManage 测试
+"""
+
+import os
+import tempfile
+import pytest
+from Stock.exchange.dtypes import StockData
+from Stock.exchange.event import Action, Event, EventManage, deliver_regex
+from X2.XExcel.read import iter_text_lines
+
+LINES = [
+    u"客户对账单",
+    u"资金帐号：1001234",
+    u"持仓",
+    u"证券代码 证券名称 股份余额",
+    u"600000 浦发银行 1000",
+    u"000001 平安银行 200",
+    u"合计",
+    u"交易流水",
+    u"20210104 证券买入 600000 100",
+    u"20210104 证券卖出 000001 200",
+]
+
+
+def _event(name, start, stop, pattern, calls):
+    event = Event(name)
+    event.register_active_trigger(lambda line: line == start)
+    event.register_deactivate_trigger(lambda line: line == stop)
+
+    def pick(_event, line):
+        calls.append(line)
+        return deliver_regex(pattern, line)
+
+    event.register_action(Action(pick, name=f"{name}_pick", dest=name))
+    return event
+
+
+def _write(lines, encoding):
+    handler, filepath = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handler, mode='wb') as fp:
+        fp.write('\r\n'.join(lines).encode(encoding))
+    return filepath
+
+
+def test_iter_text_lines():
+    filepath = _write(LINES, 'GB18030')
+    try:
+        assert list(iter_text_lines(filepath)) == LINES
+    finally:
+        os.remove(filepath)
+    # 开头超过识别样本大小的内容为纯 ASCII
+    lines = [u"20210104 600000 100"] * 5000 + LINES
+    filepath = _write(lines, 'GB18030')
+    try:
+        assert list(iter_text_lines(filepath)) == lines
+        # 不能按指定编码解码时不替换为 U+FFFD
+        with pytest.raises(UnicodeDecodeError):
+            list(iter_text_lines(filepath, encoding='utf-8'))
+    finally:
+        os.remove(filepath)
+
+
+def test_stream():
+    position_calls, flow_calls = [], []
+    manage = EventManage()
+    manage.register(_event(u"position", u"持仓", u"合计",
+                           r"^(?P<code>\d{6}) (?P<name>\S+) (?P<volume>\d+)$", position_calls))
+    manage.register(_event(u"trade_flow", u"交易流水", LINES[-1],
+                           r"^(?P<date>\d{8}) (?P<summary>\S+)", flow_calls))
+
+    consumed = []
+
+    def rows():
+        for line in LINES + [u"不应读取"]:
+            consumed.append(line)
+            yield line
+
+    results = manage.stream(rows())
+    assert [item['code'] for item in results[u"position"][u"position"]] == [u"600000", u"000001"]
+    assert [item['summary'] for item in results[u"trade_flow"][u"trade_flow"]] == [u"证券买入", u"证券卖出"]
+    # 失效事件不再被调用, 所有事件失效后停止读取
+    assert position_calls[-1] == u"合计"
+    assert u"交易流水" not in position_calls
+    assert consumed[-1] == LINES[-1]
+
+
+def test_dispatch():
+    calls = []
+    event = Event(u"summary")
+    event.register_active_trigger(lambda line: True)
+
+    def account(_event, line):
+        calls.append(u"account")
+        return deliver_regex(u"资金帐号：(?P<trade_account>\\d+)", line)
+
+    def broken(_event, line):
+        calls.append(u"broken")
+        raise ValueError(u"broken")
+
+    def position(_event, line):
+        calls.append(u"position")
+        return deliver_regex(r"^(?P<stock_code>\d{6}) ", line)
+
+    event.register_action(Action(position, name=u"position", dest=StockData.stock_position, priority=2))
+    event.register_action(Action(broken, name=u"broken", dest=StockData.stock_position, priority=1))
+    event.register_action(Action(account, name=u"account", dest=StockData.trade_account))
+    for line in LINES:
+        event(line)
+
+    # 单值数据采集到一次后不再调用, 同一 dest 按 priority 调用
+    assert calls.count(u"account") == 2
+    assert calls[:3] == [u"broken", u"position", u"account"]
+    assert event.containers[StockData.trade_account] == [{"trade_account": "1001234"}]
+    assert [item["stock_code"] for item in event.containers[StockData.stock_position]] == [u"600000", u"000001"]
+    assert list(event.error_counts.values()) == [len(LINES)]
+    assert u"ValueError" in event.errors[u"broken"]
+
+
+if __name__ == '__main__':
+    test_iter_text_lines()
+    test_stream()
+    test_dispatch()
@@ -0,0 +1,112 @@
+# coding=utf8
+
+"""
+大文件 CSV/TXT 分块读取测试: 分块结果需与 整表读取 -> 切分 -> 列调整 -> 类型整理 一致
+"""
+
+import os
+import tempfile
+from collections import OrderedDict
+import pandas
+import pytest
+from Stock.bench.pipeline import SPECS
+from Stock.bench.statement import make_statement, write_statement
+from Stock.exchange.ingest import iter_table_chunks
+from Stock.exchange.parsers import MainlandParser, TRADE_FLOW_COLUMNS_TYPES, comfort_table
+
+
+# 分块读取时 category 列保留为 str
+CHUNK_TYPES = OrderedDict(TRADE_FLOW_COLUMNS_TYPES)
+CHUNK_TYPES[u"摘要"] = str
+
+
+def _expected(statement: pandas.DataFrame) -> pandas.DataFrame:
+    region = MainlandParser().split_tables(statement, SPECS)["trade_flow"]
+    adjusted = MainlandParser.adjust_columns(list(TRADE_FLOW_COLUMNS_TYPES), region.columns, region.copy())
+    return comfort_table(adjusted, CHUNK_TYPES).reset_index(drop=True)
+
+
+def test_iter_table_chunks():
+    statement = make_statement(1200, dirty_ratio=0.05)
+    expected = _expected(statement)
+    workdir = tempfile.mkdtemp()
+    for fmt in ("csv", "txt"):
+        filepath = write_statement(statement, os.path.join(workdir, "statement"), fmt)
+        try:
+            chunks = list(iter_table_chunks(filepath, TRADE_FLOW_COLUMNS_TYPES, chunksize=500))
+        finally:
+            os.remove(filepath)
+        assert len(chunks) == 3, fmt
+        assert all(chunk[u"摘要"].dtype == object for chunk in chunks)
+        pandas.testing.assert_frame_equal(pandas.concat(chunks).reset_index(drop=True), expected)
+    os.rmdir(workdir)
+
+
+def test_missing_header():
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as handler:
+        handler.write(u"无关内容,1\n".encode("GB18030"))
+    try:
+        assert list(iter_table_chunks(handler.name)) == []
+    finally:
+        os.remove(handler.name)
+
+
+def _reencode(filepath: str, encoding: str):
+    with open(filepath, mode="rb") as handler:
+        content = handler.read().decode("GB18030")
+    with open(filepath, mode="wb") as handler:
+        handler.write(content.encode(encoding))
+
+
+def test_bom_csv():
+    statement = make_statement(300)
+    expected = _expected(statement)
+    workdir = tempfile.mkdtemp()
+    filepath = write_statement(statement, os.path.join(workdir, "statement"), "csv")
+    try:
+        _reencode(filepath, "utf-8-sig")
+        result = pandas.concat(iter_table_chunks(filepath, TRADE_FLOW_COLUMNS_TYPES)).reset_index(drop=True)
+        pandas.testing.assert_frame_equal(result, expected)
+        # 表头在第一行, 紧接 BOM
+        with open(filepath, mode="wb") as handler:
+            handler.write(u"发生日期,证券代码\n20210105,600000\n".encode("utf-8-sig"))
+        assert [len(chunk) for chunk in iter_table_chunks(filepath, header_keywords=[u"发生日期"])] == [1]
+        with open(filepath, mode="wb") as handler:
+            handler.write(u"发生日期,证券代码\n20210105,600000\n".encode("utf-16"))
+        with pytest.raises(ValueError):
+            list(iter_table_chunks(filepath))
+    finally:
+        os.remove(filepath)
+        os.rmdir(workdir)
+
+
+def test_ascii_head():
+    statement = make_statement(300)
+    expected = _expected(statement)
+    workdir = tempfile.mkdtemp()
+    filepath = write_statement(statement, os.path.join(workdir, "statement"), "csv")
+    try:
+        # 表头之前有超过识别样本大小的 ASCII 内容, GB18030 编码的中文在其后
+        with open(filepath, mode="rb") as handler:
+            content = handler.read()
+        with open(filepath, mode="wb") as handler:
+            handler.write(b"exported,20210105\n" * 1000 + content)
+        result = pandas.concat(iter_table_chunks(filepath, TRADE_FLOW_COLUMNS_TYPES)).reset_index(drop=True)
+        pandas.testing.assert_frame_equal(result, expected)
+
+        # 不能按识别出的编码解码时不替换为 U+FFFD
+        with open(filepath, mode="wb") as handler:
+            handler.write((u"发生日期,摘要\n" + u"20210105,证券买入\n" * 1000).encode("utf-8"))
+            handler.write(u"20210106,证券卖出\n".encode("GB18030"))
+        with pytest.raises(UnicodeDecodeError):
+            list(iter_table_chunks(filepath, header_keywords=[u"发生日期"]))
+    finally:
+        os.remove(filepath)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    test_iter_table_chunks()
+    test_missing_header()
+    test_bom_csv()
+    test_ascii_head()
@@ -0,0 +1,119 @@
+# coding=utf8
+
+"""
+解析器注册及特征关键词筛选测试
+"""
+
+from io import BytesIO
+import numpy
+import pandas
+import pytest
+from X1.stand import ArgStandError
+from X2.XExcel.read import read_excel_by_fileflow
+from Stock.exchange.parsers import HORIZON_TAGS, MainlandParser, UBSParser
+from Stock.exchange.parsers.registry import SCAN_ROWS, ParserRegistry, scan_tokens
+
+nan = numpy.nan
+
+
+def _parser(name, signatures=(), base=MainlandParser, for_file="excel", matched=True):
+    def match(self, data, **data_attrs):
+        return matched(data) if callable(matched) else matched
+
+    return type(name, (base,), {"_PARSER_NAME": name, "_FOR_TYPE": for_file, "_FOR_REGION": base.__name__,
+                                "_SIGNATURES": signatures, "match": match})
+
+
+def _statement(*cells):
+    return pandas.DataFrame([list(cells), [nan, 1.5, None]])
+
+
+def test_scan_tokens():
+    sheets = {"sheet0": pandas.DataFrame([[u" 证券代码\t", 600000, nan], [u"证券名称", u"证券代码", None]]),
+              "sheet1": pandas.DataFrame([[u"资金账号：", pandas.Timestamp("20210105")]]),
+              "empty": pandas.DataFrame()}
+    assert scan_tokens(sheets) == {u"证券代码", u"证券名称", u"资金账号："}
+    assert scan_tokens(sheets["sheet0"]) == {u"证券代码", u"证券名称"}
+    assert scan_tokens(pandas.DataFrame()) == set()
+
+
+def test_scan_tokens_lazy():
+    buffer = BytesIO()
+    with pandas.ExcelWriter(buffer) as writer:
+        rows = [[u"证券代码"]] + [[no] for no in range(SCAN_ROWS)] + [[u"合计"]]
+        pandas.DataFrame(rows).to_excel(writer, sheet_name="sheet0", header=False, index=False)
+        pandas.DataFrame([[u"资金账号："]]).to_excel(writer, sheet_name="sheet1", header=False, index=False)
+    workbook = read_excel_by_fileflow(buffer.getvalue(), lazy=True)
+    with workbook:
+        # 未解析的 sheet 只扫描前 SCAN_ROWS 行, 扫描后仍未解析
+        assert scan_tokens(workbook) == {u"证券代码", u"资金账号："}
+        assert workbook.loaded == []
+        # 已解析的 sheet 整表扫描
+        workbook["sheet0"]
+        assert scan_tokens(workbook) == {u"证券代码", u"合计", u"资金账号："}
+
+
+def test_candidates():
+    registry = ParserRegistry()
+    flow = registry.register(_parser("flow", (HORIZON_TAGS, u"证券代码", u" 证券名称 ")))
+    position = registry.register(_parser("position", (u"证券代码", u"市值")))
+    unsigned = registry.register(_parser("unsigned"))
+    assert len(registry) == 3 and flow in registry
+
+    # 命中: 每组关键词都出现(组内任一即可), 单元格及关键词均去除首尾空白
+    assert registry.candidates(_statement(u"牛卡号:", u" 证券代码 ", u"证券名称\n")) == [flow, unsigned]
+    assert registry.candidates(_statement(u"资产帐户：", u"证券代码", u"证券名称")) == [flow, unsigned]
+    # 未命中: 缺少任一组关键词, 只剩未声明关键词的解析器
+    assert registry.candidates(_statement(u"证券代码", u"证券名称", u"其他")) == [unsigned]
+    assert registry.candidates(_statement(u"无关", u"内容", u"")) == [unsigned]
+    # 单元格需与关键词完全一致
+    assert registry.candidates(_statement(u"牛卡号:", u"证券代码", u"证券名称(股)")) == [unsigned]
+
+
+def test_candidates_tie():
+    registry = ParserRegistry()
+    first = registry.register(_parser("first", (u"证券代码",), matched=False))
+    # 两个解析器的关键词均全部出现时按注册顺序排列, 与关键词数量无关
+    ubs = registry.register(_parser("ubs", (u"证券代码", u"证券名称"), base=UBSParser))
+    data = _statement(u"证券代码", u"证券名称", u"")
+    assert registry.candidates(data) == [first, ubs]
+    assert registry.candidates(data, for_region="UBSParser") == [ubs]
+    assert registry.candidates(data, for_file="csv") == []
+    # match 返回第一个 match 成功的解析器
+    assert isinstance(registry.match(data), ubs)
+
+    registry.unregister(first)
+    assert registry.candidates(data) == [ubs]
+    assert registry.candidates(_statement(u"证券代码", u"", u"")) == []
+
+
+def test_match():
+    registry = ParserRegistry()
+    registry.register(_parser("abstract", (u"证券代码",), matched=lambda data: MainlandParser().match(data)))
+    chosen = registry.register(_parser("chosen", (u"证券代码",), matched=lambda data: len(data) == 2))
+    data = _statement(u"证券代码", u"", u"")
+    # match 未实现(NotImplementedError)的解析器跳过
+    assert isinstance(registry.match(data), chosen)
+    assert registry.match(_statement(u"其他", u"", u"")) is None
+
+
+def test_register_errors():
+    registry = ParserRegistry()
+    parser = registry.register(_parser("flow", (u"证券代码",)))
+    with pytest.raises(ArgStandError):
+        registry.register(_parser("flow", (u"证券名称",)))
+    with pytest.raises(ArgStandError):
+        registry.register(object)
+    registry.unregister(parser)
+    with pytest.raises(KeyError):
+        registry.unregister(parser)
+    assert len(registry) == 0 and registry.candidates(_statement(u"证券代码", u"", u"")) == []
+
+
+if __name__ == '__main__':
+    test_scan_tokens()
+    test_scan_tokens_lazy()
+    test_candidates()
+    test_candidates_tie()
+    test_match()
+    test_register_errors()
@@ -0,0 +1,58 @@
+# coding=utf8
+
+"""
+文本对账单匹配规则加载测试
+"""
+
+from Stock.exchange.dtypes import StockData, BreakingColumn
+from Stock.exchange.event import deliver_regex
+from Stock.exchange.rules import MatchRule, RuleSet
+from X1.stand import ArgStandError
+
+ROWS = [
+    dict(id=1, data_genus_id=10, brokerage_id=3, priority=2,
+         data_regex=r"^(?P<trade_date>\d{8})\s+(?P<event>\S+)\s+(?P<stock_code>\d{6})"),
+    dict(id=2, data_genus_id=10, brokerage_id=3, priority=1,
+         data_regex=r"^(?P<trade_date>\d{8})\s+(?P<event>银行转证券)", check_regex=u"交易流水"),
+    dict(id=3, data_genus_id=1, brokerage_id=3,
+         data_regex=u"资金帐号：(?P<trade_account>\\d+)"),
+    dict(id=4, data_genus_id=1, brokerage_id=4,
+         data_regex=u"(?P<stock_code>\\d+)"),
+]
+
+
+def test_rule_set():
+    ruleset = RuleSet.from_rows(ROWS, brokerage_id=3)
+    assert len(ruleset) == 3
+    assert [rule.rule_id for rule in ruleset.rules_for(StockData.trade_flow)] == [2, 1]
+    assert ruleset.search(StockData.trade_account, u"资金帐号：1001234") == {"trade_account": "1001234"}
+    assert ruleset.search(StockData.trade_flow, u"20210105 银行转证券 50000") == \
+        {"trade_date": "20210105", "event": u"银行转证券"}
+    assert ruleset.rules_for(StockData.trade_flow)[0].checked(u"交易流水")
+
+
+def test_illegal_groups():
+    for row in (ROWS[3], dict(ROWS[2], data_regex=u"资金帐号：\\d+")):
+        try:
+            MatchRule.from_row(row)
+        except ArgStandError:
+            continue
+        raise AssertionError(row)
+
+
+def test_breaking_column():
+    column = BreakingColumn(((u"code", u"market"), r"(?P<code>\d{6})\.(?P<market>SH|SZ)"), cn="证券", eng="stock")
+    assert column.adapt("600000.SH") == {"code": "600000", "market": "SH"}
+    try:
+        BreakingColumn(((u"code", u"name"), r"(?P<code>\d{6})"), cn="证券", eng="stock")
+    except ArgStandError:
+        pass
+    else:
+        raise AssertionError("group names should be checked on creating")
+    assert deliver_regex(r"(?P<code>\d{6})", u"证券 600000") == {"code": "600000"}
+
+
+if __name__ == '__main__':
+    test_rule_set()
+    test_illegal_groups()
+    test_breaking_column()
@@ -0,0 +1,202 @@
+# coding=utf8
+
+"""
+MainlandParser.split_table 整表检测实现与原 iterrows 逐行实现的等价性测试
+"""
+
+import numpy
+import pandas
+from Stock.exchange.parsers import MainlandParser, IndexSign
+
+nan = numpy.nan
+
+
+def legacy_split_table(parser, table, columns_kws, end_row_kws=None,
+                       str_searchable=False, str_search_for='all',
+                       starttriggerone=False, endtriggerone=False,
+                       pullback=None):
+    """ 原 MainlandParser.split_table 逐行实现, 仅作为对照 """
+
+    start_index = end_index = columns = None
+    str_search_for_start = str_search_for_end = False
+    str_search_for = str(str_search_for)
+
+    if str_searchable is True:
+        if str_search_for in ('all', '(0, 1)', '(1, 0)'):
+            str_search_for_start = str_search_for_end = True
+        elif str_search_for in ('0', 'start', '(0,)'):
+            str_search_for_start = True
+        elif str_search_for in ('1', 'end', '(1,)'):
+            str_search_for_end = True
+
+    end_row_kws = end_row_kws or [None]
+    pullback = pullback or []
+
+    for row_index, row_data in table.iterrows():
+        parser.split_point.update_index(row_index + 1)
+
+        row_items = row_data.tolist()
+        row_str = row_data.to_string(index=False)
+
+        if start_index is None:
+            if set(row_items) & set(columns_kws) == set(columns_kws):
+                columns = row_items
+                start_index = row_index + 1
+                continue
+        else:
+            if set(row_items) & set(end_row_kws) == set(end_row_kws):
+                end_index = row_index - 1
+                break
+            elif not filter(lambda item: repr(item) != 'nan', row_items):
+                end_index = row_index - 1
+                break
+            elif len(set(row_items) - {numpy.nan}) < 2 and not all(map(lambda _x: isinstance(_x, (int, float)), row_items)):
+                end_index = row_index - 1
+                break
+            elif (start_index is not None) and (row_index == table.index[-1]):
+                if all(map(lambda _key: _key in row_items, end_row_kws)):
+                    end_index = row_index - 1
+                else:
+                    end_index = row_index
+                break
+
+        if (start_index is None) and (str_search_for_start is True):
+            contains = [(column_kw in row_str) for column_kw in columns_kws]
+            if all(contains) or ((starttriggerone is True) and any(contains)):
+                columns = row_items
+                start_index = row_index + 1
+                continue
+
+        if (end_index is None) and (str_search_for_end is True):
+            contains = [end_row_kw in row_str for end_row_kw in end_row_kws]
+            if all(contains) or ((endtriggerone is True) and any(contains)):
+                if (start_index is not None) and (end_index is None):
+                    end_index = row_index - 1
+                    break
+
+        for lw in pullback:
+            if lw in row_str:
+                return
+
+    if (start_index is not None) and (end_index is not None):
+        mini_table = table.loc[start_index: end_index]
+        mini_table.columns = columns
+        return mini_table
+    elif (start_index >= len(table)) and columns:
+        mini_table = table.loc[start_index: start_index]
+        mini_table.columns = columns
+        return mini_table
+
+
+def _statement():
+    rows = [
+        [u"客户对账单", nan, nan, nan, nan],
+        [u"资金帐号：", u"1001234", nan, u"币种", u"人民币"],
+        [nan, nan, nan, nan, nan],
+        [u"持仓", nan, nan, nan, nan],
+        [u"证券代码", u"证券名称", u"股份余额", u"市价", u"市值"],
+        [u"600000", u"浦发银行", 1000, 10.5, 10500.0],
+        [u"000001", u"平安银行", 200, 15.2, 3040.0],
+        [nan, nan, nan, nan, nan],
+        [u"000002", u"万科A", 300, nan, nan],
+        [u"合计", nan, nan, nan, 13540.0],
+        [u"交易流水", nan, nan, nan, nan],
+        [u"发生日期", u"摘要", u"证券代码", u"成交股数", u"发生金额"],
+        [u"20210104", u"证券买入", u"600000", 100, -1050.0],
+        [u"20210104", u"证券卖出", u"000001", 200, 3040.0],
+        [u"20210105", u"银行转证券", nan, nan, 50000.0],
+        [1, 2, 3, 4, 5],
+        [u"20210106", u"股息入帐", u"600000", nan, 12.3],
+    ]
+    return pandas.DataFrame(rows, dtype=object)
+
+
+CASES = [
+    dict(columns_kws=[u"证券代码", u"证券名称"]),
+    dict(columns_kws=[u"证券代码", u"证券名称"], end_row_kws=[u"合计"]),
+    dict(columns_kws=[u"发生日期", u"摘要"]),
+    dict(columns_kws=[u"发生日期", u"摘要"], end_row_kws=[u"股息入帐"]),
+    dict(columns_kws=[u"发生日期", u"摘要"], pullback=[u"银行转证券"]),
+    dict(columns_kws=[u"证券代码", u"证券名称"], pullback=[u"资金帐号"]),
+    dict(columns_kws=[u"证券代码", u"证券名称"], pullback=[u"交易流水"]),
+    dict(columns_kws=[u"代码", u"名称"], end_row_kws=[u"合计"], str_searchable=True),
+    dict(columns_kws=[u"代码", u"不存在"], end_row_kws=[u"合计"], str_searchable=True,
+         str_search_for='start', starttriggerone=True),
+    dict(columns_kws=[u"发生日期", u"摘要"], end_row_kws=[u"转证券", u"不存在"],
+         str_searchable=True, str_search_for='end', endtriggerone=True),
+    dict(columns_kws=[u"发生日期", u"摘要"], end_row_kws=[u"入帐"],
+         str_searchable=True, str_search_for='end'),
+    dict(columns_kws=[u"股息入帐"]),
+    dict(columns_kws=[]),
+]
+
+
+def _assert_same(table, kwargs):
+    expected_parser, actual_parser = MainlandParser(), MainlandParser()
+    actual = actual_parser.split_table(table.copy(), **kwargs)
+    try:
+        expected = legacy_split_table(expected_parser, table.copy(), **kwargs)
+    except TypeError:
+        # 原实现未找到表头时会比较 None >= int 而报错, 新实现返回 None
+        assert actual is None, kwargs
+        return
+    assert int(expected_parser.split_point) == int(actual_parser.split_point), kwargs
+    if expected is None:
+        assert actual is None, kwargs
+    else:
+        pandas.testing.assert_frame_equal(expected, actual)
+
+
+def test_equivalence():
+    table = _statement()
+    for kwargs in CASES:
+        _assert_same(table, kwargs)
+
+
+def test_equivalence_on_sliced_table():
+    table = _statement()
+    table = table.loc[table.index[10]:]
+    for kwargs in CASES:
+        _assert_same(table, kwargs)
+
+
+def test_header_on_last_row():
+    table = _statement().iloc[:5]
+    _assert_same(table, dict(columns_kws=[u"证券代码", u"证券名称"]))
+
+
+def test_numeric_frame():
+    table = pandas.DataFrame(numpy.arange(30, dtype=float).reshape(10, 3))
+    _assert_same(table, dict(columns_kws=[3.0, 4.0]))
+    _assert_same(table, dict(columns_kws=[3.0], end_row_kws=[15.0]))
+
+
+def test_split_tables():
+    table = _statement()
+    specs = [(u"position", [u"证券代码", u"证券名称"], [u"合计"], None),
+             (u"trade_flow", [u"发生日期", u"摘要"], None, {"pullback": [u"不存在"]}),
+             (u"contract", [u"合约日期"], None, None)]
+    parser = MainlandParser()
+    regions = parser.split_tables(table, specs)
+    assert list(regions) == [u"position", u"trade_flow", u"contract"]
+    assert regions[u"contract"] is None
+    for name, columns_kws, end_row_kws, flags in specs[:2]:
+        expected = MainlandParser().split_table(table, columns_kws, end_row_kws, **(flags or {}))
+        pandas.testing.assert_frame_equal(expected, regions[name])
+    assert int(parser.split_point) == len(table)
+
+
+def test_header_not_found():
+    parser = MainlandParser()
+    parser.split_point = IndexSign()
+    assert parser.split_table(_statement(), [u"不存在"]) is None
+    assert int(parser.split_point) == len(_statement())
+
+
+if __name__ == '__main__':
+    test_equivalence()
+    test_equivalence_on_sliced_table()
+    test_header_on_last_row()
+    test_numeric_frame()
+    test_split_tables()
+    test_header_not_found()
@@ -0,0 +1,62 @@
+# coding=utf8
+
+"""
+解析结果列式存储测试, 依赖 pyarrow
+"""
+
+import shutil
+import tempfile
+import pytest
+from Stock.bench.pipeline import SPECS
+from Stock.bench.statement import SECTION_TYPES, make_statement
+from Stock.exchange.dtypes import StockData
+from Stock.exchange.parsers import MainlandParser, comfort_table, comfort_trade_flow
+
+pytest.importorskip("pyarrow")
+
+from Stock.exchange.store import StatementStore  # noqa: E402
+
+KINDS = {"position": StockData.stock_position, "trade_flow": StockData.trade_flow,
+         "contract": StockData.contract_position}
+
+
+def _frames():
+    """ 模拟对账单 切分 -> 列调整 -> 类型整理 后的各类表数据 """
+    frames = {}
+    for name, region in MainlandParser().split_tables(make_statement(200, dirty_ratio=0.05), SPECS).items():
+        if region is None:
+            continue
+        table = MainlandParser.adjust_columns(list(SECTION_TYPES[name]), region.columns, region.copy())
+        frames[KINDS[name]] = comfort_trade_flow(table) if name == "trade_flow" else \
+            comfort_table(table, SECTION_TYPES[name])
+    return frames
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_partitioned_store(fmt):
+    frames = _frames()
+    root = tempfile.mkdtemp()
+    try:
+        store = StatementStore(root, fmt)
+        for trade_date in ("20210104", "20210105"):
+            for trade_account in ("1001", "10/02"):
+                store.write_frames(frames, trade_date, trade_account)
+        # 重复写入同一分区时覆盖
+        store.write_frames(frames, "20210105", "10/02")
+        partitions = store.partitions(StockData.trade_flow)
+        assert len(partitions) == 4 and ("20210105", "10/02") in partitions
+
+        flow = store.read(StockData.trade_flow, columns=[u"发生金额", u"交易事件", "trade_account"],
+                          trade_dates=["20210105"], trade_accounts=["10/02"])
+        expected = frames[StockData.trade_flow].reset_index(drop=True)
+        assert flow[u"发生金额"].equals(expected[u"发生金额"])
+        assert (flow[u"交易事件"].astype(object).fillna("") == expected[u"交易事件"].astype(object).fillna("")).all()
+        assert set(flow["trade_account"]) == {"10/02"}
+        assert len(store.read(StockData.stock_position)) == 4 * len(frames[StockData.stock_position])
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    test_partitioned_store("parquet")
+    test_partitioned_store("arrow")
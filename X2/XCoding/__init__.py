@@ -5,6 +5,7 @@ import chardet
 import logging
 from typing import BinaryIO
 from six import string_types
+from X2.XCoding.detect import detect_sample, encoding_service
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +29,17 @@ def get_coding(chars):
     return detector.result['encoding']
 
 
-def convert_to_unicode(content, encode=None, decode=None):
+def guess_encoding(content, source=None):
+    u"""
+    识别字节数据的编码, 只对开头部分样本识别, 识别结果不可靠(置信度不足或常见误判编码)时按 GB18030 处理;
+    指定来源(如发件域名、券商编号)时使用该来源已识别的编码, 参考 X2.XCoding.detect.EncodingService
+    """
+    if source is not None:
+        return encoding_service.detect(content, source)
+    return detect_sample(content).encoding
+
+
+def convert_to_unicode(content, encode=None, decode=None, source=None):
     u"""
     为了统一编码, 在数据处理过程中尽可能统一采用unicode字符处理,
     该方法将数据均处理成unicode字符,chardet模块识别置信度根据实际情况调整,
@@ -40,22 +51,9 @@ def convert_to_unicode(content, encode=None, decode=None):
             if decode is not None:
                 content = content.encode(encode or "GB18030").decode(decode)
         elif encode is not None:
-            content = string_types(content, encode)
+            content = str(content, encode)
         else:
-            detectReport = chardet.detect(content)
-            encodeTyp = detectReport["encoding"]
-            confidence = detectReport["confidence"]
-            language = detectReport["language"]
-            if encodeTyp is not None:
-                if encodeTyp in ('ISO-8859-1', 'KOI8-R', 'IBM855'):
-                    encodeTyp = "GB18030"
-                elif confidence < 0.95:
-                    encodeTyp = "GB18030"
-            elif language in ('Thai', 'Russia'):
-                encodeTyp = "GB18030"
-            else:
-                encodeTyp = "GB18030"
-            content = content.decode(encodeTyp)
+            content = content.decode(guess_encoding(content, source))
     except UnicodeDecodeError as e:
         content = content.decode('GB18030', errors='replace')
     return content
@@ -0,0 +1,158 @@
+# coding=utf8
+
+u"""
+编码识别服务
+
+chardet 对整段数据识别时耗时与数据量成正比, 数 MB 的附件/邮件正文识别一次需要数秒; 而同一券商(发件域名、
+券商编号、解析器)的文件编码基本固定. EncodingService:
+
+  - 只对开头的有限样本分块喂给 UniversalDetector, detector.done 后立即结束;
+  - 样本为纯 ASCII 时改为从第一个非 ASCII 字节处取样, 避免英文表头导致误判为 ascii;
+  - 按来源 key 记录识别结果及置信度, 同一来源再次识别时只需按已知编码严格解码样本验证, 验证失败才重新识别
+    (GB18030 几乎能解码任意字节, 样本同时是合法 utf-8 时视为验证失败);
+  - 识别结果不可靠(未识别、常见误判编码或置信度不足)时按 GB18030 处理.
+
+    service = EncodingService()
+    encoding = service.detect(fileflow, source=("mail", "broker.com"))
+"""
+
+import codecs
+import re
+import threading
+import typing as t
+from chardet.universaldetector import UniversalDetector
+
+# 识别时使用的样本大小
+SAMPLE_SIZE = 64 * 1024
+# 每次喂给 UniversalDetector 的数据大小
+FEED_SIZE = 4 * 1024
+DEFAULT_ENCODING = 'GB18030'
+# chardet 对中文数据的常见误判结果
+MISDETECTED = ('ISO-8859-1', 'KOI8-R', 'IBM855', 'MacCyrillic', 'Windows-1252', 'TIS-620')
+# 识别结果可信的最低置信度
+CONFIDENCE = 0.95
+# 按兼容的超集编码解码, 避免样本之外出现扩展字符时解码失败
+SUPERSETS = {'ascii': 'utf-8', 'GB2312': 'GB18030', 'GBK': 'GB18030'}
+
+_NON_ASCII = re.compile(b"[\x80-\xff]")
+
+
+class Detection(t.NamedTuple):
+    u"""
+    encoding: 识别出的编码, 不可靠时为 DEFAULT_ENCODING
+    confidence: chardet 置信度, 来源缓存命中时为缓存的置信度
+    reliable: 识别结果是否可靠
+    """
+    encoding: str
+    confidence: float
+    reliable: bool
+
+
+def _feed(sample: bytes) -> t.Tuple[t.Optional[str], float]:
+    detector = UniversalDetector()
+    view = memoryview(sample)
+    for offset in range(0, len(view), FEED_SIZE):
+        detector.feed(bytes(view[offset: offset + FEED_SIZE]))
+        if detector.done:
+            break
+    detector.close()
+    return detector.result['encoding'], detector.result['confidence'] or 0.0
+
+
+def sample_of(content: bytes, sample_size: int = SAMPLE_SIZE) -> bytes:
+    u"""
+    取用于识别编码的样本, 开头部分为纯 ASCII 时从第一个非 ASCII 字节处开始取样
+    """
+    sample = content[:sample_size]
+    if len(content) > sample_size and not _NON_ASCII.search(sample):
+        found = _NON_ASCII.search(content, sample_size)
+        if found is not None:
+            # 非 ASCII 字符之前保留一部分, 避免从多字节字符中间开始
+            start = max(found.start() - FEED_SIZE, 0)
+            sample = content[start: start + sample_size]
+    return sample
+
+
+def detect_sample(content: bytes, sample_size: int = SAMPLE_SIZE, threshold: float = CONFIDENCE) -> Detection:
+    u"""
+    对数据样本识别编码, 结果不可靠时返回 DEFAULT_ENCODING
+    """
+    encoding, confidence = _feed(sample_of(content, sample_size))
+    if encoding is None or encoding in MISDETECTED or confidence < threshold:
+        return Detection(DEFAULT_ENCODING, confidence, False)
+    return Detection(SUPERSETS.get(encoding, encoding), confidence, True)
+
+
+def decodable(sample: bytes, encoding: str) -> bool:
+    u"""
+    样本能否按编码严格解码, 样本结尾可能截断在多字节字符中间
+    """
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def _confirms(sample: bytes, encoding: str) -> bool:
+    if not decodable(sample, encoding):
+        return False
+    # GB18030 几乎能解码任意字节, 含非 ASCII 字符的样本同时是合法 utf-8 时以 utf-8 为准
+    return encoding == 'utf-8' or not (_NON_ASCII.search(sample) and decodable(sample, 'utf-8'))
+
+
+class EncodingService(object):
+
+    def __init__(self, sample_size: int = SAMPLE_SIZE, threshold: float = CONFIDENCE):
+        u"""
+        sample_size: 识别编码的样本大小
+        threshold: 识别结果可信的最低置信度, 低于该值的结果不会作为来源编码缓存
+        """
+        self.sample_size = sample_size
+        self.threshold = threshold
+        self.hits = self.misses = 0
+        self._sources: t.Dict[t.Hashable, Detection] = {}
+        self._lock = threading.Lock()
+
+    def source_encoding(self, source: t.Hashable) -> t.Optional[Detection]:
+        return self._sources.get(source)
+
+    def forget(self, source: t.Hashable = None):
+        with self._lock:
+            if source is None:
+                self._sources.clear()
+            else:
+                self._sources.pop(source, None)
+
+    def detect(self, content: bytes, source: t.Hashable = None) -> str:
+        return self.detection(content, source).encoding
+
+    def detection(self, content: bytes, source: t.Hashable = None) -> Detection:
+        u"""
+        识别数据编码
+
+        content: 字节数据
+        source: 数据来源, 如 ("mail", 发件域名)、("broker", 券商编号)、("parser", 解析器名称),
+                为空时不使用来源缓存
+        """
+        if source is not None:
+            known = self._sources.get(source)
+            if known is not None and _confirms(sample_of(content, self.sample_size), known.encoding):
+                self.hits += 1
+                return known
+        self.misses += 1
+        detection = detect_sample(content, self.sample_size, self.threshold)
+        if source is not None and detection.reliable:
+            with self._lock:
+                known = self._sources.get(source)
+                # 已知编码解码失败说明来源编码已变化, 以新的可靠结果为准
+                if known is None or known.encoding != detection.encoding or known.confidence < detection.confidence:
+                    self._sources[source] = detection
+        return detection
+
+    def decode(self, content: bytes, source: t.Hashable = None, errors: str = 'strict') -> str:
+        return content.decode(self.detect(content, source), errors=errors)
+
+
+# 进程内共享的编码识别服务
+encoding_service = EncodingService()
@@ -0,0 +1,226 @@
+# coding=utf8
+
+u"""
+解析结果磁盘缓存
+
+同一份对账单附件经常会被重复处理(重发邮件、抄送账户、解析器修复后重跑), 以文件内容的 blake2b
+摘要为 key 缓存 read_excel_by_fileflow 的解析结果, 再次读取时只需计算一次摘要并加载缓存文件.
+
+缓存按 READER_VERSION 分目录存放, 读取逻辑变更时修改 READER_VERSION 即可使旧缓存失效(旧版本目录
+在创建缓存对象时删除); 缓存总大小超过上限时按最近访问时间淘汰.
+
+缓存文件为 pickle(protocol 5), 数值列的数据块作为带外缓冲区按 64 字节对齐写在 pickle 数据之后, 读取时
+以 mmap(写时复制)映射文件, 数值列直接引用映射的内存, 不再逐块复制:
+
+    | MAGIC | pickle 长度 | 缓冲区数 | (偏移, 长度) * 缓冲区数 | pickle 数据 | 缓冲区 ... |
+
+加载 pickle 可以执行任意代码, 缓存目录必须由调用方指定, 且只允许当前用户访问(0700), 不使用公共临时目录.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import stat
+import struct
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+
+from X2.XExcel.read import read_excel_by_fileflow
+
+_logger = logging.getLogger(__name__)
+
+# 读取逻辑(X2.XExcel.read)变更时需要修改, 使旧的缓存失效
+READER_VERSION = '3'
+_SUFFIX = '.pkl'
+_VERSION_PREFIX = 'reader-v'
+_MAGIC = b'SKWBPKL5'
+_HEADER = struct.Struct('<8sQQ')
+_SPAN = struct.Struct('<QQ')
+_ALIGNMENT = 64
+
+
+def content_key(fileflow: bytes) -> str:
+    return hashlib.blake2b(fileflow, digest_size=20).hexdigest()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _private_directory(path: str):
+    u"""
+    创建只允许当前用户访问的目录; 目录已存在时检查所有者及权限, 其他用户可以访问时拒绝使用
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.stat(path)
+    if not stat.S_ISDIR(status.st_mode):
+        raise NotADirectoryError(f"workbook cache directory {path} is not a directory")
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        raise PermissionError(f"workbook cache directory {path} is not owned by current user")
+    if hasattr(os, 'getuid') and status.st_mode & 0o077:
+        raise PermissionError(f"workbook cache directory {path} is accessible by other users, "
+                              f"its mode should be 0700 instead of {oct(stat.S_IMODE(status.st_mode))}")
+
+
+def dump(dataframes_map: OrderedDict, fp):
+    u"""
+    @Desc:
+        write parsed workbook to binary file, contiguous numeric blocks are stored out of band
+    """
+    buffers = []
+    payload = pickle.dumps(dataframes_map, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+    offset = _aligned(_HEADER.size + _SPAN.size * len(raws) + len(payload))
+    spans = []
+    for raw in raws:
+        spans.append((offset, raw.nbytes))
+        offset = _aligned(offset + raw.nbytes)
+    fp.write(_HEADER.pack(_MAGIC, len(payload), len(raws)))
+    for span in spans:
+        fp.write(_SPAN.pack(*span))
+    fp.write(payload)
+    for (offset, _), raw in zip(spans, raws):
+        fp.write(b"\x00" * (offset - fp.tell()))
+        fp.write(raw)
+
+
+def load(path: str) -> OrderedDict:
+    u"""
+    @Desc:
+        map file written by `dump`, numeric blocks reference the copy-on-write mapping
+    """
+    with open(path, mode='rb') as handler:
+        mapped = mmap.mmap(handler.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mapped)
+    magic, length, count = _HEADER.unpack_from(view)
+    if magic != _MAGIC:
+        raise pickle.UnpicklingError(f"unknown workbook cache format {magic!r}")
+    start = _HEADER.size + _SPAN.size * count
+    buffers = [view[offset: offset + size]
+               for offset, size in (_SPAN.unpack_from(view, _HEADER.size + _SPAN.size * no) for no in range(count))]
+    # 映射在引用它的数据块释放后随之释放
+    return pickle.loads(view[start: start + length], buffers=buffers)
+
+
+class WorkbookCache(object):
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 ** 3, version: str = READER_VERSION):
+        u"""
+        @directory:
+            cache root directory, created with mode 0700, an existing one must be owned by current user
+            and not accessible by others
+        @max_bytes:
+            max total size of cache files
+        @version:
+            reader version, caches of other versions are removed
+        """
+        self.root = directory
+        self.directory = os.path.join(self.root, _VERSION_PREFIX + version)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        _private_directory(self.root)
+        _private_directory(self.directory)
+        self._drop_stale_versions()
+        # 缓存文件 -> 大小, 按最近访问时间排序
+        self._entries: typing.Dict[str, int] = OrderedDict()
+        for entry in sorted(os.scandir(self.directory), key=lambda _entry: _entry.stat().st_atime):
+            if entry.name.endswith(_SUFFIX):
+                self._entries[entry.path] = entry.stat().st_size
+        self._size = sum(self._entries.values())
+
+    def _drop_stale_versions(self):
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.path != self.directory and entry.name.startswith(_VERSION_PREFIX):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Optional[OrderedDict]:
+        path = self._path(key)
+        try:
+            dataframes_map = load(path)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError, struct.error) as exc:
+            _logger.warning(f"Drop damaged workbook cache {path}: {type(exc).__name__}")
+            self._remove(path)
+            return None
+        os.utime(path)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return dataframes_map
+
+    def put(self, key: str, dataframes_map: OrderedDict):
+        path = self._path(key)
+        handler, temppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handler, mode='wb') as fp:
+                dump(dataframes_map, fp)
+            # 多进程同时写入同一 key 时以最后一次为准, 不会读到不完整的文件
+            os.replace(temppath, path)
+        except BaseException:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+            raise
+        with self._lock:
+            self._size -= self._entries.pop(path, 0)
+            self._entries[path] = os.path.getsize(path)
+            self._size += self._entries[path]
+        self._evict()
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._size -= self._entries.pop(path, 0)
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            with self._lock:
+                path = next(iter(self._entries))
+            self._remove(path)
+
+    def read(self, fileflow) -> OrderedDict:
+        u"""
+        @Desc:
+            same as `read_excel_by_fileflow`, parsed result is cached by content hash,
+            unreadable results(`error` is True) are not cached
+        @fileflow:
+            raw data <bytes> or binary file object
+        """
+        if hasattr(fileflow, 'read'):
+            fileflow = fileflow.read()
+        key = content_key(fileflow)
+        dataframes_map = self.get(key)
+        if dataframes_map is not None:
+            self.hits += 1
+            return dataframes_map
+        self.misses += 1
+        dataframes_map = read_excel_by_fileflow(fileflow)
+        if not getattr(dataframes_map, 'error', False):
+            self.put(key, dataframes_map)
+        return dataframes_map
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        _private_directory(self.directory)
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -2,126 +2,252 @@
 __author__ = 'caoxingcheng'
 
 import pandas
-import tempfile
 import typing
 import xlrd
 import zipfile
 import logging
 from collections import OrderedDict
 from copy import deepcopy
+from io import BytesIO
 from xml.etree.ElementTree import ParseError
 
-from X2.XCoding import convert_to_unicode
 from X2.XExcel import ERROR_EXCEL, EMPTY_EXCEL
+from X2.XExcel.sniff import (SNIFF_SIZE, FMT_XLSX, FMT_XLS, FMT_HTML, FMT_EMPTY, FMT_UNKNOWN,
+                             sniff_format, stream_encoding)
 
 _logger = logging.getLogger(__name__)
+_EXCEL_ENGINES = {FMT_XLSX: 'openpyxl', FMT_XLS: 'xlrd'}
 _DamagedFileNote = "Reading excel failed, try second solution " \
                    "but meet read error type: {exc_type} one more, " \
                    "this file is probably not a complete file in fact, " \
                    "if this file is important, you'd better check it out."
 
 
-def read_excel_by_fileflow(fileflow) -> OrderedDict:
+def _read_all_sheets(tabular: pandas.ExcelFile) -> OrderedDict:
     u"""
-    @Desc:
-        read and format excel data through binary data
-    @fileflow:
-        raw data <string>
-    @Return
-        <collections.OrderDict> instance, each sheet name as the key
+    read all sheets of an opened workbook in one call, the workbook is parsed only once
     """
-    if isinstance(fileflow, typing.BinaryIO):
-        fileflow = fileflow.read()
-    dataframes_map = OrderedDict()
+    with tabular:
+        return OrderedDict(tabular.parse(sheet_name=None, header=None))
+
+
+class LazyWorkbook(typing.Mapping):
+    u"""
+    sheet name -> DataFrame mapping of an opened workbook, sheet names are known at once
+    but each sheet is parsed on first access only and cached after that.
+
+    most parsers just look at one or two sheets, `peek` parses only the first rows of a sheet
+    which is enough for `match` checks.
+    """
+
+    error = False
+
+    def __init__(self, tabular: pandas.ExcelFile):
+        self._tabular = tabular
+        self._names = list(tabular.sheet_names)
+        self._sheets = {}
+
+    def __getitem__(self, sheet_name) -> pandas.DataFrame:
+        if sheet_name not in self._sheets:
+            if sheet_name not in self._names:
+                raise KeyError(sheet_name)
+            self._sheets[sheet_name] = self._tabular.parse(sheet_name=sheet_name, header=None)
+        return self._sheets[sheet_name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._names
+
+    @property
+    def loaded(self) -> typing.List[str]:
+        u""" names of parsed sheets """
+        return [name for name in self._names if name in self._sheets]
+
+    def peek(self, sheet_name, nrows: int) -> pandas.DataFrame:
+        u"""
+        @Desc:
+            parse the first `nrows` rows of a sheet without caching, a parsed sheet is sliced directly
+        @sheet_name:
+            sheet name, or sheet position as int
+        @nrows:
+            rows number
+        """
+        if isinstance(sheet_name, int):
+            sheet_name = self._names[sheet_name]
+        if sheet_name in self._sheets:
+            return self._sheets[sheet_name].iloc[:nrows]
+        if sheet_name not in self._names:
+            raise KeyError(sheet_name)
+        return self._tabular.parse(sheet_name=sheet_name, header=None, nrows=nrows)
+
+    def load(self) -> OrderedDict:
+        u""" parse all sheets, returns the same result as eager reading """
+        return OrderedDict((name, self[name]) for name in self._names)
+
+    def close(self):
+        self._tabular.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _source(source):
+    return BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _read_workbook(source, fmt: str, lazy: bool, tried: typing.List[str]) -> OrderedDict:
+    tried.append(fmt)
     try:
-        with tempfile.TemporaryFile() as tf_handler:
-            tf_handler.write(fileflow)
-            tf_handler.seek(0)
-            sheetsNames = pandas.ExcelFile(tf_handler).sheet_names
-            for sheet_name in sheetsNames:
-                dataframes_map[sheet_name] = pandas.read_excel(tf_handler,
-                                                               header=None,
-                                                               sheet_name=sheet_name)
-    except UnicodeDecodeError:
-        try:
-            dataframes_map.clear()
-            tabular = pandas.ExcelFile(xlrd.open_workbook(file_contents=fileflow,
-                                                          encoding_override="GB18030"),
-                                       engine='xlrd')
-            sheetsNames = tabular.sheet_names
-            for sheet_name in sheetsNames:
-                dataframes_map[sheet_name] = pandas.read_excel(tabular,
-                                                               header=None,
-                                                               sheet_name=sheet_name)
-        except (AssertionError, UnicodeDecodeError) as exc:
-            dataframes_map = deepcopy(ERROR_EXCEL)
+        tabular = pandas.ExcelFile(_source(source), engine=_EXCEL_ENGINES[fmt])
+        return LazyWorkbook(tabular) if lazy else _read_all_sheets(tabular)
+    except UnicodeDecodeError as exc:
+        if fmt != FMT_XLS:
             _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
+            return deepcopy(ERROR_EXCEL)
+    except (xlrd.XLRDError, ParseError, zipfile.BadZipfile, KeyError, ValueError) as exc:
+        _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
+        return deepcopy(ERROR_EXCEL)
+
+    tried.append('xls-GB18030')
+    try:
+        if isinstance(source, bytes):
+            book = xlrd.open_workbook(file_contents=source, encoding_override="GB18030")
+        else:
+            book = xlrd.open_workbook(filename=source, encoding_override="GB18030")
+        return _read_all_sheets(pandas.ExcelFile(book, engine='xlrd'))
+    except (AssertionError, UnicodeDecodeError, xlrd.XLRDError) as exc:
+        _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
+        return deepcopy(ERROR_EXCEL)
+
+
+def _read_html(source, tried: typing.List[str]) -> typing.Optional[OrderedDict]:
+    tried.append(FMT_HTML)
+    try:
+        tables = pandas.read_html(_source(source), header=None)
+    except ImportError:
+        # lxml/bs4 are not installed, read it as text as before
+        return None
+    except ValueError:
+        return deepcopy(ERROR_EXCEL)
+    return OrderedDict((f"table{no}", table) for no, table in enumerate(tables))
+
 
-    except xlrd.XLRDError:
+def _text_encoding(source) -> str:
+    if isinstance(source, bytes):
+        return stream_encoding(BytesIO(source)) or 'GB18030'
+    with open(source, mode='rb') as handler:
+        return stream_encoding(handler) or 'GB18030'
+
+
+def _read_csv(source, encoding: str, lines_fallback: bool, tried: typing.List[str]) -> OrderedDict:
+    tried.append(f"csv-{encoding}")
+    try:
+        return OrderedDict({'default': pandas.read_csv(_source(source), encoding=encoding, header=None)})
+    except pandas.errors.EmptyDataError:
+        return deepcopy(EMPTY_EXCEL)
+    except pandas.errors.ParserError:
+        if not lines_fallback:
+            return deepcopy(ERROR_EXCEL)
+    tried.append(f"lines-{encoding}")
+    with open(source, mode='r', encoding=encoding) as handler:
+        return OrderedDict({'default': pandas.DataFrame([line for line in handler])})
+
+
+def _read_text(source, lines_fallback: bool, tried: typing.List[str]) -> OrderedDict:
+    # 识别样本之后仍可能出现不能按识别编码解码的内容, 按 GB18030 重新读取
+    for encoding in OrderedDict.fromkeys((_text_encoding(source), 'GB18030')):
         try:
-            with tempfile.TemporaryFile() as tf_handler:
-                tf_handler.write(fileflow)
-                tf_handler.seek(0)
-                dataframes_map = {'default': pandas.read_csv(tf_handler,
-                                                             encoding='GB18030',
-                                                             header=None)}
-        except UnicodeDecodeError:
-            dataframes_map = deepcopy(ERROR_EXCEL)
-        except pandas.errors.EmptyDataError:
-            dataframes_map = deepcopy(EMPTY_EXCEL)
-        except pandas.errors.ParserError:
-            dataframes_map = deepcopy(ERROR_EXCEL)
-    except (ParseError, zipfile.BadZipfile):
+            return _read_csv(source, encoding, lines_fallback, tried)
+        except UnicodeDecodeError as exc:
+            _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
+    return deepcopy(ERROR_EXCEL)
+
+
+def _read_sniffed(source, head: bytes, lazy: bool, lines_fallback: bool) -> OrderedDict:
+    u"""
+    read data by the format sniffed from leading bytes, the result is tagged with
+    `sniffed` (sniffed format) and `tried` (decoders tried in order) for diagnostics
+    """
+    fmt = sniff_format(head)
+    tried = []
+    if fmt == FMT_EMPTY:
+        dataframes_map = deepcopy(EMPTY_EXCEL)
+    elif fmt == FMT_UNKNOWN:
+        _logger.warning(f"Unknown format of data starts with {head[:16]!r}")
         dataframes_map = deepcopy(ERROR_EXCEL)
+    elif fmt in _EXCEL_ENGINES:
+        dataframes_map = _read_workbook(source, fmt, lazy, tried)
+    else:
+        dataframes_map = _read_html(source, tried) if fmt == FMT_HTML else None
+        if dataframes_map is None:
+            dataframes_map = _read_text(source, lines_fallback, tried)
+    dataframes_map.sniffed = fmt
+    dataframes_map.tried = tried
     return dataframes_map
 
 
-def read_excel_by_filepath(filepath) -> OrderedDict:
+def read_excel_by_fileflow(fileflow, lazy: bool = False) -> OrderedDict:
+    u"""
+    @Desc:
+        read and format excel data through binary data,
+        format is sniffed from leading bytes(xlsx/xls/html/csv text), see `X2.XExcel.sniff`
+    @fileflow:
+        raw data <string>
+    @lazy:
+        return a `LazyWorkbook` for excel data, sheets are parsed on access
+    @Return
+        <collections.OrderDict> instance, each sheet name as the key,
+        attributes `sniffed` and `tried` record the sniffed format and tried decoders
+    """
+    if isinstance(fileflow, typing.BinaryIO):
+        fileflow = fileflow.read()
+    return _read_sniffed(fileflow, fileflow[:SNIFF_SIZE], lazy, lines_fallback=False)
+
+
+def read_excel_by_filepath(filepath, lazy: bool = False) -> OrderedDict:
     u"""
     @Desc:
-        read and format excel file data through opening and reading file stored in local filesystem
+        read and format excel file data through opening and reading file stored in local filesystem,
+        format is sniffed from leading bytes(xlsx/xls/html/csv text), see `X2.XExcel.sniff`
     @filepath:
         abspath
+    @lazy:
+        return a `LazyWorkbook` for excel file, sheets are parsed on access
     @Return:
-        <collections.OrderDict> instance, each sheet name as the key
+        <collections.OrderDict> instance, each sheet name as the key,
+        attributes `sniffed` and `tried` record the sniffed format and tried decoders
     """
-    dataframes_map = OrderedDict()
-    try:
-        sheets_names = pandas.ExcelFile(filepath).sheet_names
-        for sheetName in sheets_names:
-            dataframes_map[sheetName] = pandas.read_excel(filepath,
-                                                          header=None,
-                                                          sheet_name=sheetName)
-    except UnicodeDecodeError:
-        try:
-            tabular = pandas.ExcelFile(xlrd.open_workbook(filename=filepath,
-                                                          encoding_override="GB18030"),
-                                       engine='xlrd')
-            sheets_names = tabular.sheet_names
-            for sheetName in sheets_names:
-                dataframes_map[sheetName] = pandas.read_excel(tabular,
-                                                              header=None,
-                                                              sheet_name=sheetName)
-        except (AssertionError, UnicodeDecodeError) as exc:
-            dataframes_map = deepcopy(ERROR_EXCEL)
-            _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
+    with open(filepath, mode='rb') as handler:
+        head = handler.read(SNIFF_SIZE)
+    return _read_sniffed(filepath, head, lazy, lines_fallback=True)
 
-    except xlrd.XLRDError:
-        try:
-            dataframes_map.clear()
-            dataframes_map['default'] = pandas.read_csv(filepath,
-                                                        encoding='GB18030',
-                                                        header=None)
-        except pandas.errors.EmptyDataError:
-            dataframes_map = deepcopy(EMPTY_EXCEL)
-        except pandas.errors.ParserError:
-            with open(filepath, mode='r') as handler:
-                dataframes_map['default'] = pandas.DataFrame([convert_to_unicode(line)
-                                                              for line in handler])
-        except UnicodeDecodeError as exc:
-            _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
-            dataframes_map = deepcopy(ERROR_EXCEL)
-    except (ParseError, zipfile.BadZipfile) as exc:
-        _logger.warning(_DamagedFileNote.format(exc_type=type(exc)))
-        dataframes_map = deepcopy(ERROR_EXCEL)
-    return dataframes_map
+
+def iter_text_lines(filepath, encoding=None) -> typing.Iterator[str]:
+    u"""
+    @Desc:
+        read text file line by line as unicode, only the current line is held in memory,
+        encoding is guessed from the first bytes containing non-ASCII when not given, GB18030 if unknown,
+        see `X2.XExcel.sniff.stream_encoding`
+    @filepath:
+        text file path
+    @encoding:
+        text encoding
+    @Return
+        generator of lines without line breaks
+    @Raise
+        UnicodeDecodeError, lines can not be decoded by the encoding
+    """
+    if encoding is None:
+        with open(filepath, mode='rb') as handler:
+            encoding = stream_encoding(handler) or 'GB18030'
+    with open(filepath, mode='r', encoding=encoding, newline='') as handler:
+        for line in handler:
+            yield line.rstrip('\r\n')
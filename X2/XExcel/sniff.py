@@ -0,0 +1,108 @@
+# coding=utf8
+
+u"""
+根据文件开头的字节内容识别表格文件格式, 读取时直接选择对应的解析方式,
+不再依次尝试 openpyxl/xlrd/csv 并通过异常判断格式
+"""
+
+import codecs
+import re
+import typing
+
+FMT_XLSX = 'xlsx'
+FMT_XLS = 'xls'
+FMT_HTML = 'html'
+FMT_TEXT = 'text'
+FMT_EMPTY = 'empty'
+FMT_UNKNOWN = 'unknown'
+
+# 识别格式所需读取的文件开头字节数
+SNIFF_SIZE = 8 * 1024
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+# 部分券商导出的 .xls 实际为 html 表格
+_HTML_MARKS = (b"<html", b"<!doctype html", b"<table", b"<head", b"<body", b"<meta", b"<style")
+_UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+_NON_ASCII = re.compile(b"[\x80-\xff]")
+
+
+def _decodable(head: bytes, encoding: str) -> bool:
+    # 开头字节可能截断在多字节字符中间, 增量解码不要求结尾完整
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def text_encoding(head: bytes) -> typing.Optional[str]:
+    u"""
+    @Desc:
+        guess encoding of text data by BOM and strict decoding, utf-8 first and then GB18030
+    @head:
+        leading bytes of data
+    @Return
+        encoding name, None if it is not text data
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith(_UTF16_BOMS):
+        return 'utf-16'
+    if b"\x00" in head:
+        return None
+    if _decodable(head, 'utf-8'):
+        return 'utf-8'
+    if _decodable(head, 'GB18030'):
+        return 'GB18030'
+    return None
+
+
+def stream_encoding(stream: typing.BinaryIO) -> typing.Optional[str]:
+    u"""
+    @Desc:
+        guess encoding of text stream like `text_encoding`, ASCII only leading bytes are valid in any encoding,
+        go on reading and guess by the first bytes containing non-ASCII then, utf-8 if the whole stream is ASCII
+    @stream:
+        binary stream(file, BytesIO, mmap) read from current position
+    @Return
+        encoding name, None if it is not text data
+    """
+    head = stream.read(SNIFF_SIZE)
+    if not head.isascii() or b"\x00" in head:
+        return text_encoding(head)
+    while True:
+        chunk = stream.read(SNIFF_SIZE)
+        if not chunk:
+            return text_encoding(head)
+        if b"\x00" in chunk:
+            return None
+        found = _NON_ASCII.search(chunk)
+        if found is not None:
+            # ASCII 字节之后的第一个非 ASCII 字节必然是多字节字符的首字节
+            return text_encoding(chunk[found.start():] + stream.read(SNIFF_SIZE))
+
+
+def sniff_format(head: bytes) -> str:
+    u"""
+    @Desc:
+        recognize format of tabular data through magic bytes and content
+    @head:
+        leading bytes of data, `SNIFF_SIZE` bytes are enough
+    @Return
+        one of FMT_XLSX/FMT_XLS/FMT_HTML/FMT_TEXT/FMT_EMPTY/FMT_UNKNOWN
+    """
+    if not head.strip():
+        return FMT_EMPTY
+    if head.startswith(OLE2_MAGIC):
+        return FMT_XLS
+    if head.startswith(ZIP_MAGIC):
+        return FMT_XLSX
+    if head.startswith(_UTF16_BOMS):
+        return FMT_TEXT
+    stripped = head.lstrip(codecs.BOM_UTF8).lstrip().lower()
+    if stripped.startswith(b"<") and any(mark in stripped[:1024] for mark in _HTML_MARKS):
+        return FMT_HTML
+    if text_encoding(head) is not None:
+        return FMT_TEXT
+    return FMT_UNKNOWN
@@ -1 +1,237 @@
 # coding=utf8
+u"""
+流式输出 xlsx
+
+基于 openpyxl write-only 模式, 数据逐行写出, 内存占用与行数无关:
+
+    with StreamingWorkbook("settlement.xlsx") as workbook:
+        workbook.add_sheet(u"持仓", positions, styles={u"市值": "amount"})
+        workbook.add_sheet(u"交易流水", iter_rows(), columns=[u"发生日期", u"证券代码", u"成交金额"])
+
+单元格样式通过样式模板注册表按名称引用(register_style), 多个账户报表通过 write_workbooks 在进程池中并行输出.
+"""
+__author__ = 'caoxingcheng'
+
+import logging
+import os
+import typing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import pandas
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from X1.stand import ArgStandError
+
+_logger = logging.getLogger(__name__)
+
+# DataFrame 每次转换的行数, 控制转换时的内存占用
+_CHUNK_ROWS = 10000
+
+# 样式模板注册表: 模板名称 -> NamedStyle 参数
+STYLE_TEMPLATES: typing.Dict[str, typing.Dict] = OrderedDict()
+
+
+def register_style(name: str,
+                   font: Font = None,
+                   fill: PatternFill = None,
+                   border: Border = None,
+                   alignment: Alignment = None,
+                   number_format: str = None):
+    u"""
+    @Desc:
+        register a cell style template, cells refer to it by name,
+        templates should be registered at import time so that they exist in worker processes too
+    @name:
+        template name, an existing template with the same name is replaced
+    """
+    attrs = dict(font=font, fill=fill, border=border, alignment=alignment, number_format=number_format)
+    STYLE_TEMPLATES[name] = {attr: value for attr, value in attrs.items() if value is not None}
+
+
+_THIN = Side(style='thin', color='FFBFBFBF')
+register_style('header', font=Font(bold=True), fill=PatternFill('solid', fgColor='FFD9E1F2'),
+               border=Border(bottom=_THIN), alignment=Alignment(horizontal='center', vertical='center'))
+register_style('text', number_format='@')
+register_style('amount', number_format='#,##0.00')
+register_style('quantity', number_format='#,##0')
+register_style('price', number_format='0.000')
+register_style('percent', number_format='0.00%')
+register_style('date', number_format='yyyy-mm-dd', alignment=Alignment(horizontal='center'))
+
+
+class Sheet(typing.NamedTuple):
+    u"""
+    rows: DataFrame or iterable of row sequences
+    columns: header, default to columns of DataFrame, no header row for row iterables without columns
+    styles: column name -> style template name, keys should be in columns
+    header_style: style template name of header row
+    widths: column name -> column width, keys should be in columns
+    """
+    rows: typing.Union[pandas.DataFrame, typing.Iterable[typing.Sequence]]
+    columns: typing.Optional[typing.Sequence[str]] = None
+    styles: typing.Optional[typing.Mapping[str, str]] = None
+    header_style: typing.Optional[str] = 'header'
+    widths: typing.Optional[typing.Mapping[str, float]] = None
+
+
+def _frame_rows(frame: pandas.DataFrame) -> typing.Iterator[tuple]:
+    u"""
+    rows of DataFrame with python values, NaN/NaT are turned into empty cells
+    """
+    for start in range(0, len(frame), _CHUNK_ROWS):
+        chunk = frame.iloc[start: start + _CHUNK_ROWS].astype(object)
+        values = chunk.to_numpy()
+        values[pandas.isna(values)] = None
+        yield from map(tuple, values.tolist())
+
+
+def _python_value(value):
+    # openpyxl 不能写出 NaN, numpy 标量转换为 python 类型
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class StreamingWorkbook(object):
+
+    def __init__(self, path: typing.Union[str, typing.BinaryIO]):
+        u"""
+        @path:
+            output file path or binary file object, written when `save` is called
+        """
+        self.path = path
+        self.rows = 0
+        self._workbook = Workbook(write_only=True)
+        for name, attrs in STYLE_TEMPLATES.items():
+            # NamedStyle 绑定工作簿后才确定格式编号, 每个工作簿单独创建
+            self._workbook.add_named_style(NamedStyle(name=name, **attrs))
+
+    def add_sheet(self, name: str,
+                  rows: typing.Union[pandas.DataFrame, typing.Iterable[typing.Sequence]],
+                  columns: typing.Sequence[str] = None,
+                  styles: typing.Mapping[str, str] = None,
+                  header_style: typing.Optional[str] = 'header',
+                  widths: typing.Mapping[str, float] = None) -> int:
+        u"""
+        @Desc:
+            append a sheet and write its rows one by one, sheets are written in the order they are added
+        @rows:
+            DataFrame or iterable of row sequences(generator is fine)
+        @columns:
+            header, default to columns of DataFrame
+        @styles:
+            column name -> style template name, unstyled columns are written as raw values
+        @header_style:
+            style template name of header row, None for no style
+        @widths:
+            column name -> column width
+        @Return
+            number of data rows written
+        @Raise
+            ArgStandError, keys of styles or widths are not in columns(rows without columns can not be styled)
+        """
+        if isinstance(rows, pandas.DataFrame):
+            columns = list(rows.columns) if columns is None else list(columns)
+            rows = _frame_rows(rows)
+            convert = None
+        else:
+            convert = _python_value
+        columns = list(columns or ())
+        positions = {column: position for position, column in enumerate(columns)}
+        for argname, mapping in (("styles", styles), ("widths", widths)):
+            unknown = [column for column in (mapping or ()) if column not in positions]
+            if unknown:
+                raise ArgStandError(f"{argname} of sheet {name} refer to unknown columns {unknown}, "
+                                    f"columns are {columns}")
+        worksheet = self._workbook.create_sheet(title=name)
+        for column, width in (widths or {}).items():
+            worksheet.column_dimensions[get_column_letter(positions[column] + 1)].width = width
+
+        if columns:
+            # write-only 模式下需在写入第一行前设置
+            worksheet.freeze_panes = 'A2'
+            worksheet.append([self._cell(worksheet, column, header_style) for column in columns])
+        # 列序号 -> 样式名称
+        styled = [(positions[column], style) for column, style in (styles or {}).items()]
+        count = 0
+        for row in rows:
+            if convert is not None:
+                row = [convert(value) for value in row]
+            if styled:
+                row = list(row)
+                for position, style in styled:
+                    if position < len(row):
+                        row[position] = self._cell(worksheet, row[position], style)
+            worksheet.append(row)
+            count += 1
+        self.rows += count
+        return count
+
+    @staticmethod
+    def _cell(worksheet, value, style: typing.Optional[str]):
+        if style is None:
+            return value
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.style = style
+        return cell
+
+    def save(self):
+        self._workbook.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.save()
+
+
+def write_workbook(path: typing.Union[str, typing.BinaryIO],
+                   sheets: typing.Mapping[str, typing.Union[pandas.DataFrame, Sheet]]):
+    u"""
+    @Desc:
+        write sheets into one xlsx workbook
+    @sheets:
+        sheet name -> DataFrame or Sheet, in output order
+    @Return
+        path
+    """
+    with StreamingWorkbook(path) as workbook:
+        for name, sheet in sheets.items():
+            if not isinstance(sheet, Sheet):
+                sheet = Sheet(sheet)
+            workbook.add_sheet(name, sheet.rows, sheet.columns, sheet.styles, sheet.header_style, sheet.widths)
+    return path
+
+
+def _write_job(job: typing.Tuple[str, typing.Any]) -> str:
+    path, sheets = job
+    if callable(sheets):
+        # 在工作进程中生成数据, 避免在进程间传递大量数据
+        sheets = sheets()
+    return write_workbook(path, sheets)
+
+
+def write_workbooks(jobs: typing.Iterable[typing.Tuple[str, typing.Any]], workers: int = None) -> typing.List[str]:
+    u"""
+    @Desc:
+        write many workbooks(e.g. settlement reports of accounts) in a process pool
+    @jobs:
+        (path, sheets) pairs, sheets is a sheet mapping as in `write_workbook` or a picklable callable
+        (top-level function or functools.partial) returning the mapping, which runs in worker process
+    @workers:
+        worker processes number, default to CPU count, 1 for writing in current process
+    @Return
+        written paths in the order of jobs
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [_write_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_job, jobs, chunksize=4))
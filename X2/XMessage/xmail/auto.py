@@ -8,31 +8,129 @@ import traceback
 import typing as t
 import warnings
 from imaplib import IMAP4
+from collections import OrderedDict, deque
 from queue import Queue as ThreadQueue, Empty as EmptyQueueError
 from X1.component import ComponentFeatureError
 from X1.support import SysSupport
 from X1.run import UnexpectedCompatible, RetryException
 from X2.XMessage.xmail.connect import IMAPBox
-from X2.XMessage.xmail.record import get_done_uids
+from X2.XMessage.xmail.record import get_done_uids, get_uid_checkpoint, set_uid_checkpoint
 from X2.XMessage.xmail.utils import uid_rules, restart_connection
 from X2.XMessage.xmail.container import _MailData, MailEntity, MailContext, Attachment
 from X2.XMessage.xmail.record import RecordsStorage
 _logger = logging.getLogger(__name__)
 
 
-UidQueue = ThreadQueue(maxsize=30)
+class FolderQueue(ThreadQueue):
+    """
+    按文件夹分组的 (文件夹, UID) 队列
+
+    同一文件夹的 UID 先进先出, get 可以指定优先取出的文件夹, 下载线程优先取当前选中文件夹的 UID,
+    尽量停留在同一文件夹, 避免切换文件夹时的 SELECT 请求; 指定文件夹没有 UID 时取最早放入的文件夹.
+
+    下载线程处理完 UID 后通过 done 标记是否存储成功, ProduceUID 据此在 UID 全部存储后才记录检索位置.
+    """
+
+    def _init(self, maxsize):
+        self.queue = OrderedDict()
+        # 文件夹 -> 已放入队列、尚未处理完的 UID
+        self.unfinished_uids = {}
+        # 文件夹 -> 处理完但未能存储的 UID
+        self.failed_uids = {}
+
+    def _qsize(self):
+        return sum(map(len, self.queue.values()))
+
+    def _put(self, item):
+        box, uid = item
+        self.queue.setdefault(box, deque()).append(uid)
+        self.unfinished_uids.setdefault(box, set()).add(uid)
+
+    def _get(self, box=None):
+        if box not in self.queue:
+            box = next(iter(self.queue))
+        uids = self.queue[box]
+        uid = uids.popleft()
+        if not uids:
+            del self.queue[box]
+        return box, uid
+
+    def get(self, block=True, timeout=None, box=None):
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise EmptyQueueError
+            elif timeout is None:
+                while not self._qsize():
+                    self.not_empty.wait()
+            elif timeout < 0:
+                raise ValueError("'timeout' must be a non-negative number")
+            else:
+                endtime = time.monotonic() + timeout
+                while not self._qsize():
+                    remaining = endtime - time.monotonic()
+                    if remaining <= 0.0:
+                        raise EmptyQueueError
+                    self.not_empty.wait(remaining)
+            item = self._get(box)
+            self.not_full.notify()
+            return item
+
+    def get_nowait(self, box=None):
+        return self.get(block=False, box=box)
+
+    def done(self, box, uid, stored: bool = True):
+        """ 标记 UID 已处理完, stored 为是否存储成功 """
+        with self.mutex:
+            self.unfinished_uids.get(box, set()).discard(uid)
+            if not stored:
+                self.failed_uids.setdefault(box, set()).add(uid)
+
+    def unfinished(self, box) -> t.Set:
+        """ 文件夹中已放入队列、尚未处理完的 UID """
+        with self.mutex:
+            return set(self.unfinished_uids.get(box, ()))
+
+    def pop_failed(self, box, uids: t.Iterable) -> t.Set:
+        """ 取出 uids 中未能存储的 UID """
+        with self.mutex:
+            failed = self.failed_uids.get(box, set())
+            popped = failed.intersection(uids)
+            failed.difference_update(popped)
+            return popped
+
+
+# 容量需大于 下载线程数 * batch, 各下载线程才能凑满一批
+UidQueue = FolderQueue(maxsize=500)
 
 
 class ProduceUID(threading.Thread):
 
     def __init__(self, imap_box: IMAPBox,
                  boxes: t.Iterable = None,
-                 lookup_interval: int = 60 * 2):
+                 lookup_interval: int = 60 * 2,
+                 sqlite_db: str = None,
+                 resync_on_start: bool = True,
+                 idle: bool = False,
+                 idle_timeout: int = 60 * 25):
         """
+        检索待下载的 UID 放入 UidQueue.
+
+        每个文件夹记录 UID 检索位置(UIDVALIDITY, UIDNEXT), 之后只检索 `UIDNEXT:*` 范围内的新邮件,
+        STATUS 显示没有新邮件时不再检索; UIDVALIDITY 变化时全量检索, 与已下载的 UID 比对.
+        检索位置在放入队列的 UID 全部存储后才记录, 有 UID 未能存储时下次从原位置重新检索.
+
+        idle 为 True 且服务器支持 IDLE 时, 每个文件夹单独建立一个连接保持 IDLE(FolderWatcher),
+        收到新邮件推送后立即检索该文件夹, 定时检索作为补充; 服务器不支持 IDLE 时只定时检索.
+
         Args:
             imap_box: X2.XMessage.xmail.connect.IMAPBox 对象
             boxes: 想要下载的邮箱文件夹, 默认为('INBOX'[收件箱], 'Junk'[垃圾箱])
             lookup_interval: UID 检索时间间隔,默认为 (60*2) 秒
+            sqlite_db: 记录已下载 UID 及检索位置的 SQLite 数据库位置, 默认采用 $HOME/.mail_metadata.db .
+            resync_on_start: 启动后首次检索是否全量检索, 上次退出时队列中未下载的 UID 以及下载失败的 UID 会重新下载.
+            idle: 是否通过 IDLE 接收新邮件推送.
+            idle_timeout: 每次 IDLE 的最长秒数, 之后重新 IDLE, 应小于服务器 30 分钟无活动断开时间.
         """
         super(ProduceUID, self).__init__()
         self.imap_box = imap_box
@@ -42,7 +140,21 @@ class ProduceUID(threading.Thread):
             _logger.debug(f"Folders is not set, default folders {self.boxes} be set.")
         else:
             self.boxes = boxes
+        self.sqlite_db = sqlite_db
+        self.resync_on_start = resync_on_start
         self.todo_uids_map = {}
+        # 文件夹 -> 本次检索到的检索位置
+        self.checkpoints = {}
+        # 文件夹 -> (待记录的检索位置, 放入队列的 UID), UID 全部存储后记录
+        self._unsaved = {}
+        # 本次启动后检索过的文件夹
+        self._synced = set()
+        self.idle = idle
+        self.idle_timeout = idle_timeout
+        self.watchers: t.List[FolderWatcher] = []
+        # IDLE 推送有变化的文件夹
+        self._changed = set()
+        self._changed_condition = threading.Condition()
 
         # if local_uid_pointer is not None:
         #     self.local_uid_pointer = local_uid_pointer
@@ -116,22 +228,74 @@ class ProduceUID(threading.Thread):
             _logger.info(f"Actually get mail uid info from {uid_list[0]} to {uid_list[-1]} from {box}, total {len(uid_list)}")
         return uid_list
 
-    def _count_todo_uids(self):
+    @property
+    def user(self) -> str:
+        return self.imap_box.username.split('@', 1)[0]
+
+    def _folder_state(self, box: str) -> t.Tuple[t.Optional[int], t.Optional[int]]:
+        """ 文件夹 (UIDVALIDITY, UIDNEXT), 服务器 STATUS 未返回 UIDVALIDITY 时通过 SELECT 获取 """
+        try:
+            status = self.imap_box.status(box)
+        except IMAP4.error:
+            status = {}
+        if 'UIDVALIDITY' not in status:
+            self.imap_box._change_workfolder(box, force=True)
+            return self.imap_box.uidvalidity, status.get('UIDNEXT')
+        return status['UIDVALIDITY'], status.get('UIDNEXT')
+
+    def _diff_uids(self, box: str, start: int = 1) -> t.Tuple[t.List[int], int]:
+        """ 检索不小于 start 的 UID 与已下载的 UID 比对, 返回待下载 UID 及检索到的最大 UID """
+        # `n:*` 中 n 大于最大 UID 时服务器仍会返回最大 UID
+        online_uids = [uid for uid in self._query_box_uid_sbs(box, start=start) if uid >= start]
+        local_uids = get_done_uids(self.user, box=box, start=start, sqlite_path=self.sqlite_db)
+        # 之前放入队列的 UID 尚未下载完成, 不再重复放入
+        todo_uids = sorted(set(online_uids) - set(local_uids) - UidQueue.unfinished(box))
+
+        _logger.info(f"Folder => {box}: "
+                     f"Search UID from {start}; "
+                     f"Local number of UID is {len(local_uids)}; "
+                     f"Online number of UID is {len(online_uids)}; "
+                     f"Diff number of UID is {len(todo_uids)}")
+        return todo_uids, max(online_uids, default=0)
+
+    def _save_checkpoints(self):
+        """ 记录 UID 已全部处理完的文件夹的检索位置, 有 UID 未能存储时不记录, 下次重新检索 """
+        for box, (checkpoint, uids) in list(self._unsaved.items()):
+            if uids & UidQueue.unfinished(box):
+                continue
+            del self._unsaved[box]
+            failed = UidQueue.pop_failed(box, uids)
+            if failed:
+                _logger.warning(f"{len(failed)} mails of folder {box} are not stored, search them again next time.")
+                self._synced.discard(box)
+                continue
+            set_uid_checkpoint(self.user, box, *checkpoint, sqlite_path=self.sqlite_db)
+
+    def _count_todo_uids(self, boxes: t.Iterable = None):
+        self._save_checkpoints()
         self.todo_uids_map.clear()
-        for box in self.boxes:
-            # local uids
-            local_uids = get_done_uids(self.imap_box.username.split('@', 1)[0], box=box)
-            # online uids
-            online_uids = self._query_box_uid_sbs(box)
-            todo_uids = set(online_uids) - set(local_uids)
-            todo_uids = sorted(todo_uids)
-
-            _logger.info(f"Folder => {box}: "
-                         f"Local number of UID is {len(local_uids)}; "
-                         f"Online number of UID is {len(online_uids)}; "
-                         f"Diff number of UID is {len(todo_uids)}")
+        self.checkpoints.clear()
+        for box in boxes or self.boxes:
+            uidvalidity, uidnext = self._folder_state(box)
+            checkpoint = get_uid_checkpoint(self.user, box, sqlite_path=self.sqlite_db)
+            resync = (checkpoint is None or uidvalidity is None or checkpoint.uidvalidity != uidvalidity or
+                      (self.resync_on_start and box not in self._synced))
+            if checkpoint is not None and uidvalidity is not None and checkpoint.uidvalidity != uidvalidity:
+                _logger.warning(f"UIDVALIDITY of folder {box} changed from {checkpoint.uidvalidity} to {uidvalidity}, "
+                                f"resync all UID.")
+
+            if resync:
+                todo_uids, max_uid = self._diff_uids(box)
+            elif uidnext is not None and uidnext <= checkpoint.uidnext:
+                _logger.debug(f"Folder => {box}: no new mail since UID {checkpoint.uidnext}.")
+                todo_uids, max_uid = [], 0
+            else:
+                todo_uids, max_uid = self._diff_uids(box, start=checkpoint.uidnext)
 
             self.todo_uids_map[box] = todo_uids
+            if uidvalidity is not None:
+                self.checkpoints[box] = (uidvalidity, max(uidnext or 0, max_uid + 1,
+                                                          0 if resync else checkpoint.uidnext))
 
     def _pop_todo_uids(self):
         if not self.todo_uids_map:
@@ -140,29 +304,104 @@ class ProduceUID(threading.Thread):
             for uid in uids:
                 UidQueue.put((box, uid))
                 _logger.debug(f"Put folder {box} UID {uid} into UID queue.")
+            # UID 全部存储后再记录检索位置, 之前检索到的 UID 尚未处理完时一并等待
+            if box in self.checkpoints:
+                _, queued = self._unsaved.get(box, (None, set()))
+                self._unsaved[box] = (self.checkpoints[box], queued | set(uids))
+            self._synced.add(box)
+        self._save_checkpoints()
+
+    def notify(self, box: str):
+        """ 文件夹有新邮件, 唤醒检索 """
+        with self._changed_condition:
+            self._changed.add(box)
+            self._changed_condition.notify()
+
+    def _wait_changes(self, timeout: float) -> t.Optional[t.Set[str]]:
+        """ 等待 IDLE 推送, 返回有变化的文件夹, 超时返回 None """
+        with self._changed_condition:
+            self._changed_condition.wait_for(lambda: self._changed, timeout=max(timeout, 0))
+            changed, self._changed = self._changed, set()
+        return changed or None
+
+    def _start_watchers(self):
+        if not self.idle:
+            return
+        if not self.imap_box.idle_supported:
+            _logger.warning(f"Server {self.imap_box.server.hostname} does not support IDLE, "
+                            f"query new mails every {self.lookup_interval} seconds instead.")
+            return
+        for box in self.boxes:
+            watcher = FolderWatcher(self.imap_box.clone(), box, self.notify, idle_timeout=self.idle_timeout)
+            watcher.start()
+            self.watchers.append(watcher)
 
     def run(self):
+        self._start_watchers()
         last_looptime = time.time()
+        # None 表示检索所有文件夹
+        boxes = None
 
         while True:
 
-            _logger.debug("PopUid thread start a new loop to get new mail uid info.")
+            _logger.debug(f"PopUid thread start a new loop to get new mail uid info of {boxes or self.boxes}.")
             try:
-                self._count_todo_uids()
+                self._count_todo_uids(boxes)
             except BaseException as exc:
                 _logger.warning("Something wrong with server, connection probably. reconnect later.\n[Detail] " + str(exc))
                 restart_connection(self.imap_box, 60)
+                boxes = None
                 continue
             self._pop_todo_uids()
+            if boxes is None:
+                last_looptime = time.time()
+
+            sleep_time = self.lookup_interval - (time.time() - last_looptime)
+            _logger.debug(f"PopUid thread is waiting, wake up after {sleep_time} seconds or new mail arrived")
+            boxes = self._wait_changes(sleep_time)
 
-            check_time = time.time()
-            interval = check_time - last_looptime
-            last_looptime = check_time
-            if interval < self.lookup_interval:
-                sleep_time = self.lookup_interval - interval
-                time.sleep(sleep_time)
-                _logger.debug(f"PopUid thread is sleeping, wake up after {sleep_time} seconds")
-            _logger.debug(f"Now two minus has passed since last loop time")
+
+class FolderWatcher(threading.Thread):
+
+    def __init__(self, imap_box: IMAPBox,
+                 box: str,
+                 notify: t.Callable[[str], None],
+                 idle_timeout: int = 60 * 25,
+                 retry_interval: int = 60):
+        """
+        保持文件夹 IDLE, 收到 EXISTS 推送时通知有新邮件
+
+        Args:
+            imap_box: 专用于 IDLE 的连接, IDLE 期间该连接不能执行其他命令
+            box: 邮箱文件夹
+            notify: 有新邮件时调用, 参数为文件夹名称
+            idle_timeout: 每次 IDLE 的最长秒数, 之后重新 IDLE
+            retry_interval: 连接异常时重新连接的等待秒数
+        """
+        super(FolderWatcher, self).__init__(name=f"FolderWatcher-{box}", daemon=True)
+        self.imap_box = imap_box
+        self.box = box
+        self.notify = notify
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+
+    def run(self):
+        while True:
+            try:
+                updates = self.imap_box.idle(self.box, timeout=self.idle_timeout)
+            except BaseException as exc:
+                _logger.warning(f"IDLE on folder {self.box} failed, reconnect later.\n[Detail] {exc}")
+                try:
+                    restart_connection(self.imap_box, self.retry_interval)
+                except BaseException as reconnect_exc:
+                    _logger.warning(f"Reconnect for folder {self.box} failed.\n[Detail] {reconnect_exc}")
+                    continue
+                # 断开期间可能有新邮件
+                self.notify(self.box)
+                continue
+            if any(update.endswith(b"EXISTS") for update in updates):
+                _logger.debug(f"New mail arrived in folder {self.box}: {updates}")
+                self.notify(self.box)
 
 
 class UIDDownloader(threading.Thread):
@@ -186,7 +425,8 @@ class UIDDownloader(threading.Thread):
                  bucket: str = None,
                  local: str = None,
                  source: str = None,
-                 retry_interval: int = 120):
+                 retry_interval: int = 120,
+                 batch: int = 50):
         """
         下载线程
 
@@ -203,6 +443,9 @@ class UIDDownloader(threading.Thread):
             bucket: 当 save_to_ceph 为 True时, 必须设定 ceph 存储位置.
             local: 当 save_to_local 为 True时, 必须设定本地存储位置.
             source: 当 save_to_avenger 为 True时, 必须设定 Avenger 存储位置.
+            retry_interval: 连接异常时重新连接的等待秒数.
+            batch: 每次请求下载的邮件数量, 默认 50, 大于 1 时从 UID 队列中取出同一文件夹的多个 UID,
+                   通过一次 `UID FETCH <uid-set>` 请求下载, 减少请求往返次数; 为 1 时逐封请求.
 
         """
         super(UIDDownloader, self).__init__()
@@ -223,6 +466,9 @@ class UIDDownloader(threading.Thread):
         self.local = local
         self.source = source
         self.retry_interval = retry_interval
+        self.batch = max(int(batch), 1)
+        # 凑批时取出的其他文件夹 UID, 作为下一批的开始
+        self._stashed = None
         self.recorder = RecordsStorage(
             sqlite_path=sqlite_db,
             mysql_db=(
@@ -242,31 +488,45 @@ class UIDDownloader(threading.Thread):
         elif isinstance(mail_data, Attachment):
             self.recorder.insert_mail_file_info(mail_data, *args, **kwargs)
 
+    @staticmethod
+    def _raise_transport_error(conn_err):
+        exc = str(conn_err)
+        # 网络数据传输错误
+        if "socket error: EOF" in exc:
+            err_main = "Network transport error"
+        # 网络请求错误
+        elif "[Errno 104] Connection reset by peer" in exc:
+            err_main = "Mail request frequently much"
+        # server端错误
+        elif "unexpected tagged response" in exc:
+            err_main = "Unexpected mail response"
+        else:
+            error_msg = "Connection was broken with excepted error: \n" + (exc or "unknown")
+            raise UnexpectedCompatible(error_msg)
+        _logger.warning(f"{err_main}, request exception.")
+        raise RetryException
+
     def _request(self, box, uid):
         _logger.debug(f"Download mail by folder {box} & UID {uid}")
         try:
             mail = self.imap_box.get_mail_by_uid(box, uid)
         except (IMAP4.abort, ConnectionResetError) as conn_err:
-            exc = str(conn_err)
-            # 网络数据传输错误
-            if "socket error: EOF" in exc:
-                err_main = "Network transport error"
-            # 网络请求错误
-            elif "[Errno 104] Connection reset by peer" in str(conn_err):
-                err_main = "Mail request frequently much"
-            # server端错误
-            elif "unexpected tagged response" in exc:
-                err_main = "Unexpected mail response"
-            else:
-                error_msg = "Connection was broken with excepted error: \n" + (exc or "unknown")
-                raise UnexpectedCompatible(error_msg)
-            _logger.warning(f"{err_main}, request exception.")
-            raise RetryException
+            self._raise_transport_error(conn_err)
         except Exception as exc:
             raise UnexpectedCompatible(str(exc)) from exc
         return mail
 
-    def _run(self, box, uid):
+    def _request_batch(self, box, uids):
+        _logger.debug(f"Download {len(uids)} mails by folder {box} & UID {uids[0]} to {uids[-1]}")
+        try:
+            yield from self.imap_box.get_mails_by_uids(box, uids, batch=self.batch)
+        except (IMAP4.abort, ConnectionResetError) as conn_err:
+            self._raise_transport_error(conn_err)
+        except Exception as exc:
+            raise UnexpectedCompatible(str(exc)) from exc
+
+    def _run(self, box, uid) -> bool:
+        """ 下载并存储一封邮件, 返回是否存储成功 """
         max_retry = 5
         retry_times = 0
         while True:
@@ -284,13 +544,16 @@ class UIDDownloader(threading.Thread):
                     self.recorder.write_error_download(self.imap_box.username, box, uid, "retry much.")
                     # raise UnexpectedCompatible
                     # continue
-                    return
+                    return False
             except UnexpectedCompatible as unexp:
                 err_info = str(unexp)
                 self.recorder.write_error_download(self.imap_box.username, box, uid, err_info)
                 _logger.error(err_info)
-                return
+                return False
 
+        return self._store(box, uid, mail)
+
+    def _store(self, box, uid, mail) -> bool:
         # catch 主要是针对使用数据库错误
         try:
             if self.save_to_ceph:
@@ -304,16 +567,83 @@ class UIDDownloader(threading.Thread):
         except (ComponentFeatureError, SysSupport) as exc:
             self.recorder.write_error_download(self.imap_box.username, box, uid, "Storage error.")
             _logger.error(f"{self.name} exist with exception code {exc.code}")
+            return False
+        return True
+
+    def _run_batch(self, box, uids) -> t.Set[int]:
+        """ 下载并存储一批邮件, 返回存储成功的 UID """
+        max_retry = 5
+        retry_times = 0
+        remaining = sorted(set(map(int, uids)))
+        stored = set()
+        while remaining:
+            try:
+                # 邮件逐封解析, 解析完成即存储, 重试时只请求尚未下载的 UID
+                for mail in self._request_batch(box, remaining):
+                    if mail.attr.uid in remaining:
+                        remaining.remove(mail.attr.uid)
+                        if self._store(box, mail.attr.uid, mail):
+                            stored.add(mail.attr.uid)
+                break
+            except RetryException:
+                if retry_times < max_retry:
+                    retry_times += 1
+                    _logger.info(f"Restart connection and request [{box} - {remaining[0]}:{remaining[-1]}] again after {self.retry_interval} seconds. retry times: {retry_times}")
+                    restart_connection(self.imap_box, sleeptime=self.retry_interval)
+                    continue
+                else:
+                    _logger.error(f"Stop request {box} - {remaining[0]}:{remaining[-1]}, because request retry much.")
+                    for uid in remaining:
+                        self.recorder.write_error_download(self.imap_box.username, box, uid, "retry much.")
+                    return stored
+            except UnexpectedCompatible as unexp:
+                _logger.warning(f"Batch request of {box} failed, request one by one. [Detail] {unexp}")
+                break
+        # 批量请求失败或服务器未返回的 UID 逐个下载, 由 _run 记录错误
+        for uid in remaining:
+            if self._run(box, uid):
+                stored.add(uid)
+        return stored
+
+    def _take_batch(self):
+        """ 从 UID 队列中取出同一文件夹的至多 batch 个 UID, 队列为空时不等待凑满 """
+        if self._stashed is not None:
+            (box, uid), self._stashed = self._stashed, None
+        else:
+            box, uid = UidQueue.get(box=self.imap_box.selected)
+        uids = [uid]
+        while len(uids) < self.batch:
+            try:
+                next_box, next_uid = UidQueue.get_nowait(box=box)
+            except EmptyQueueError:
+                break
+            if next_box != box:
+                self._stashed = (next_box, next_uid)
+                break
+            uids.append(next_uid)
+        return box, uids
 
     def run(self):
         while True:
+            if self.batch > 1:
+                box, uids = self._take_batch()
+                _logger.debug(f"Get folder {box} UID {uids} from UID queue.")
+                stored = set()
+                try:
+                    stored = self._run_batch(box, uids)
+                finally:
+                    for uid in uids:
+                        UidQueue.done(box, uid, int(uid) in stored)
+                continue
             try:
-                box, uid = UidQueue.get()
+                box, uid = UidQueue.get(box=self.imap_box.selected)
                 _logger.debug(f"Get folder {box} UID {uid} from UID queue.")
             except EmptyQueueError:
                 _logger.error(traceback.format_exc())
                 break
 
-            self._run(box, uid)
-
-
+            stored = False
+            try:
+                stored = self._run(box, uid)
+            finally:
+                UidQueue.done(box, uid, stored)
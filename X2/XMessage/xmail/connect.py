@@ -1,6 +1,9 @@
 # coding=utf8
 
+import select
 import smtplib
+import socket
+import time
 import typing as t
 import ssl as pythonssllib
 from imaplib import IMAP4, IMAP4_SSL
@@ -10,10 +13,40 @@ from X2.XMessage.xmail.utils import _sort_attach
 
 from X2.XMessage.xmail import logger
 from X2.XMessage.xmail.container import MailEntity
-from X2.XMessage.xmail.utils import split_uid, status_is_ok, response_is_ok
+from X2.XMessage.xmail.utils import split_uid, status_is_ok, response_is_ok, uid_set, iter_fetched, parse_status
 from X2.XMessage.xmail.parse import built_entity
 
 
+def _readline(connection: IMAP4, timeout: float) -> t.Optional[bytes]:
+    """
+    通过 imaplib 的缓冲文件(connection.file)读取一行, 超时返回 None; 用于 IDLE 期间等待服务器推送
+
+    缓冲文件读取超时后不能再使用, 因此不设置套接字超时, 而是先以非阻塞方式查看缓冲区及套接字中是否
+    已有数据, 没有数据时通过 select 等待套接字可读.
+    """
+    sock = connection.sock
+    sock_timeout = sock.gettimeout()
+    deadline = time.monotonic() + timeout
+    readable = False
+    while True:
+        sock.settimeout(0.0)
+        try:
+            buffered = connection.file.peek(1)
+        except (BlockingIOError, pythonssllib.SSLWantReadError):
+            buffered = b""
+        finally:
+            sock.settimeout(sock_timeout)
+        if buffered:
+            return connection._get_line()
+        if readable:
+            # 套接字可读但没有数据, 连接已关闭
+            raise IMAP4.abort("socket error: EOF")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        readable = bool(select.select([sock], [], [], remaining)[0])
+
+
 class IMAPTransport:
 
     def __init__(self, hostname: str,
@@ -63,6 +96,12 @@ class IMAPBox(object):
         self.password = password
 
         self.connection = self.server.connect(username, password)
+        # 当前会话选中的文件夹及其 UIDVALIDITY, 文件夹未变化时不再重复 SELECT
+        self.selected = None
+        self.uidvalidity = None
+        # 各文件夹最近一次 SELECT 得到的 UIDVALIDITY
+        self.uidvalidities: t.Dict[str, int] = {}
+        self._remember_selected('INBOX')
 
         logger.info(f"Connected to IMAP Server with user {username} on {hostname}{' over SSL' if ssl or starttls else ''}")
 
@@ -76,8 +115,10 @@ class IMAPBox(object):
         self.server = IMAPTransport(hostname=self.server.hostname, port=self.server.port, ssl=self.server.ssl,
                                     ssl_context=self.server.ssl_context, starttls=self.server.starttls)
         self.connection = self.server.connect(self.username, self.password)
+        self._remember_selected('INBOX')
 
     def logout(self):
+        self.selected = self.uidvalidity = None
         self.connection.close()
         self.connection.logout()
         logger.info(f"Disconnected from IMAP Server {self.server.hostname}@{self.username}")
@@ -107,12 +148,95 @@ class IMAPBox(object):
         if self.copy(uid, destination_folder):
             self.delete(uid)
 
-    def _change_workfolder(self, folder):
+    def _remember_selected(self, folder):
+        """ 记录 SELECT 成功的文件夹及其 UIDVALIDITY, UIDVALIDITY 变化说明文件夹中原有 UID 已失效 """
+        _, data = self.connection.response('UIDVALIDITY')
+        uidvalidity = int(data[-1]) if data and data[-1] is not None else None
+        known = self.uidvalidities.get(folder)
+        if uidvalidity is not None:
+            if known is not None and known != uidvalidity:
+                logger.warning(f"UIDVALIDITY of folder {folder} changed from {known} to {uidvalidity}")
+            self.uidvalidities[folder] = uidvalidity
+        self.selected = folder
+        self.uidvalidity = uidvalidity
+
+    def _change_workfolder(self, folder, force: bool = False):
+        if folder == self.selected and not force:
+            return
+        # 选择失败时服务器已取消原文件夹的选中状态
+        self.selected = None
         status, content = self.connection.select(folder)
         if not status_is_ok(status):
             raise IMAP4.error(f"Failed to select folder `{folder}`" + '\n' + str(content[0]))
+        self._remember_selected(folder)
         logger.debug(f"Change work folder to {folder}")
 
+    @property
+    def idle_supported(self) -> bool:
+        return 'IDLE' in self.connection.capabilities
+
+    def idle(self, folder: str, timeout: float = 25 * 60, response_timeout: float = 30) -> t.List[bytes]:
+        """
+        在文件夹上 IDLE(RFC2177), 等待服务器推送文件夹变化, 收到 EXISTS 或超时后结束 IDLE
+
+        服务器可能在 30 分钟无活动后断开连接, timeout 应小于 29 分钟, 调用方循环调用以定期重新 IDLE.
+
+        Args:
+            folder: 邮箱文件夹
+            timeout: 最长 IDLE 秒数
+            response_timeout: 等待服务器响应 IDLE/DONE 的秒数
+
+        Returns: IDLE 期间收到的服务器推送, 如 [b'61 EXISTS', b'1 RECENT'], 超时无推送时为空列表
+        """
+        if not self.idle_supported:
+            raise IMAP4.error(f"Server {self.server.hostname} does not support IDLE")
+        self._change_workfolder(folder)
+        connection = self.connection
+        tag = connection._new_tag()
+        connection.tagged_commands.pop(tag, None)
+        updates = []
+        try:
+            connection.send(tag + b" IDLE\r\n")
+            line = _readline(connection, response_timeout)
+            # 之前命令之后的推送可能已在缓冲区中, 先于 IDLE 的继续响应读到
+            while line is not None and line.startswith(b"* ") and not line.startswith(b"* BYE"):
+                updates.append(line[2:])
+                line = _readline(connection, response_timeout)
+            if line is None or not line.startswith(b"+"):
+                raise IMAP4.abort(f"Unexpected response of IDLE: {line}")
+            logger.debug(f"IDLE on folder {folder}")
+            deadline = time.monotonic() + timeout
+            try:
+                while not any(update.endswith(b"EXISTS") for update in updates):
+                    line = _readline(connection, deadline - time.monotonic())
+                    if line is None:
+                        break
+                    if line.startswith(b"* BYE"):
+                        raise IMAP4.abort(line.decode(errors='replace'))
+                    if line.startswith(b"* "):
+                        updates.append(line[2:])
+            finally:
+                connection.send(b"DONE\r\n")
+            while True:
+                line = _readline(connection, response_timeout)
+                if line is None:
+                    raise IMAP4.abort("unexpected tagged response: no response to IDLE DONE")
+                if line.startswith(tag + b" "):
+                    if not line[len(tag) + 1:].startswith(b"OK"):
+                        raise IMAP4.error(f"IDLE failed: {line.decode(errors='replace')}")
+                    break
+                if line.startswith(b"* "):
+                    updates.append(line[2:])
+        except socket.error as exc:
+            raise IMAP4.abort(f"socket error: {exc}") from exc
+        return updates
+
+    def clone(self) -> "IMAPBox":
+        """ 使用相同参数建立新的连接 """
+        return IMAPBox(hostname=self.server.hostname, port=self.server.port,
+                       username=self.username, password=self.password,
+                       ssl=self.server.ssl, ssl_context=self.server.ssl_context, starttls=self.server.starttls)
+
     def get_folders(self, ffilter: t.Callable = None, transfer: t.Callable = None) -> t.List:
         """
         Args:
@@ -132,6 +256,21 @@ class IMAPBox(object):
             folders = [transfer(folder) for folder in folders if ffilter(folder)]
             return folders
 
+    def status(self, folder: str, items: t.Sequence[str] = ('UIDNEXT', 'UIDVALIDITY')) -> t.Dict[str, int]:
+        """
+        查询文件夹状态, 不切换当前文件夹(RFC3501 6.3.10 STATUS Command)
+
+        Args:
+            folder: 邮箱文件夹
+            items: 状态项, 如 MESSAGES/UIDNEXT/UIDVALIDITY/UNSEEN
+
+        Returns: 状态项名称为 key 的 dict, 服务器未返回的状态项不包含在内
+        """
+        status, content = self.connection.status(folder, f"({' '.join(items)})")
+        if not status_is_ok(status):
+            raise IMAP4.error(f"Failed to query status of folder {folder}")
+        return parse_status(content)
+
     def get_uid(self, folder: str, start: int = '1', end='*') -> t.List:
         logger.info(f"Query UID info from folder {folder} by indexes from {start} to {end}.")
         self._change_workfolder(folder)
@@ -159,6 +298,29 @@ class IMAPBox(object):
             raise IMAP4.error(f"UID {uid} is invalid in folder {folder}")
         raise IMAP4.error(f"Failed to query mail of UID {uid} content from folder {folder}")
 
+    def get_mails_by_uids(self, folder: str, uids: t.Iterable[t.Union[int, str]],
+                          batch: int = 50) -> t.Iterator[MailEntity]:
+        """
+        批量下载邮件, 每 batch 封邮件通过一次 `UID FETCH <uid-set> (RFC822)` 获取, 逐封解析返回
+
+        Args:
+            folder: 邮箱文件夹
+            uids: 邮件 UID 序列
+            batch: 每次请求的邮件数量
+
+        Returns: MailEntity 迭代器, 按服务器返回顺序; 已不存在的 UID 不会返回, 调用方可根据 entity.attr.uid 核对
+        """
+        uids = sorted(set(map(int, uids)))
+        self._change_workfolder(folder)
+        for start in range(0, len(uids), batch):
+            chunk = uids[start: start + batch]
+            logger.info(f"Query {len(chunk)} mails content from folder {folder} by UID {chunk[0]} to {chunk[-1]}")
+            status, response = self.connection.uid('FETCH', uid_set(chunk), '(RFC822)')
+            if not status_is_ok(status):
+                raise IMAP4.error(f"Failed to query mails of UID {chunk[0]} to {chunk[-1]} from folder {folder}")
+            for uid, item in iter_fetched(response):
+                yield built_entity(self.username, folder, uid, [item])
+
 
 class SMTPTransport(object):
 
@@ -16,6 +16,9 @@ from X2.utlis import create_dir
 from X2.XDB.xceph import get_default_boto3sev, join_ceph_location, format_prefix, ceph_upload
 from X4.date import TimeStdFmt
 
+# 邮件时间存储格式
+MailTimeFormat = TimeStdFmt
+
 
 class _MailBase(object):
     def __init__(self, account: str,
@@ -0,0 +1,462 @@
+# coding=utf8
+
+"""
+asyncio 邮件下载引擎
+
+ProduceUID/UIDDownloader 每个下载线程独占一个 IMAP 连接, 同时监控大量基金账户邮箱时需要成百上千个线程.
+AsyncMailEngine 在单个线程的事件循环中处理所有邮箱:
+
+  - 每个邮箱账户一个 IMAP 连接(asyncio streams, 支持 SSL), 检索和下载复用该连接, 各文件夹通过 SELECT 切换;
+  - 同一服务器上同时执行的检索/下载请求数有上限(max_connections_per_server);
+  - 待下载的 UID 按批放入有界队列, 下载跟不上时检索协程在 put 处等待(背压);
+  - 邮件解析和存储在线程池中执行, 等待存储完成后才继续下载, 存储速度同样限制下载速度;
+  - UID 检索与 ProduceUID 相同, 按 (用户, 文件夹) 的 UIDVALIDITY/UIDNEXT 检索位置只检索新邮件,
+    检索位置在检索到的邮件全部存储后才更新, 启动后首次检索为全量检索.
+
+    def store(mail: MailEntity):
+        mail.write_to_unix(directory="/data/mails")
+
+    engine = AsyncMailEngine([MailAccount("imap.exmail.qq.com", "fund01@xx.com", "***"), ...], store=store)
+    asyncio.run(engine.run())
+"""
+
+import asyncio
+import re
+import ssl as pythonssllib
+import time
+import typing as t
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from imaplib import IMAP4
+from X2.XMessage.xmail import logger
+from X2.XMessage.xmail.container import MailEntity
+from X2.XMessage.xmail.parse import built_entity
+from X2.XMessage.xmail.record import get_done_uids, get_uid_checkpoint, set_uid_checkpoint
+from X2.XMessage.xmail.utils import uid_set, iter_fetched, parse_status, split_uid
+
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+_UIDVALIDITY = re.compile(rb"\[UIDVALIDITY (\d+)\]")
+
+# UID SEARCH 每次检索的 UID 范围, 同 ProduceUID._query_box_uid_sbs
+SEARCH_SEGMENT = 100000
+
+
+def _quote(value: str) -> bytes:
+    return b'"' + value.replace('\\', '\\\\').replace('"', '\\"').encode('utf-8') + b'"'
+
+
+class AsyncIMAPConnection(object):
+
+    def __init__(self, hostname: str,
+                 port: int = None,
+                 ssl: bool = True,
+                 ssl_context: pythonssllib.SSLContext = None,
+                 timeout: float = 120):
+        """
+        基于 asyncio streams 的 IMAP4rev1 连接, 只实现下载邮件需要的命令, 同一连接上的命令依次执行
+
+        Args:
+            hostname: 服务器地址
+            port: 端口, 默认 SSL 为 993, 否则为 143
+            ssl: 是否使用 SSL
+            ssl_context: SSL 上下文, 默认为 ssl.create_default_context()
+            timeout: 连接及读取响应的超时秒数
+        """
+        self.hostname = hostname
+        self.ssl = ssl
+        self.port = port or (993 if ssl else 143)
+        self.ssl_context = (ssl_context or pythonssllib.create_default_context()) if ssl else None
+        self.timeout = timeout
+        self.selected = None
+        self.uidvalidity = None
+        self._reader: t.Optional[asyncio.StreamReader] = None
+        self._writer: t.Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._tagno = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None or self._writer.is_closing()
+
+    async def _readline(self) -> bytes:
+        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not line:
+            raise IMAP4.abort("socket error: EOF")
+        return line.rstrip(b"\r\n")
+
+    async def _read_response(self, line: bytes) -> t.List:
+        """ 读取一条响应, 包含字面量时与 imaplib 相同返回 [(前缀, 字面量), ..., 结尾] """
+        parts = []
+        found = _LITERAL.search(line)
+        while found is not None:
+            literal = await asyncio.wait_for(self._reader.readexactly(int(found.group(1))), self.timeout)
+            parts.append((line, literal))
+            line = await self._readline()
+            found = _LITERAL.search(line)
+        parts.append(line)
+        return parts
+
+    async def open(self, username: str, password: str):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.hostname, self.port, ssl=self.ssl_context), self.timeout)
+        greeting = await self._readline()
+        if not greeting.startswith((b"* OK", b"* PREAUTH")):
+            raise IMAP4.error(f"Unexpected greeting from {self.hostname}: {greeting}")
+        await self.command(b"LOGIN", _quote(username), _quote(password))
+        logger.info(f"Logged into server {self.hostname} with user {username}")
+
+    async def close(self):
+        if self.closed:
+            return
+        try:
+            await self.command(b"LOGOUT")
+        except (IMAP4.error, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._writer.close()
+            self._writer = self._reader = None
+            self.selected = self.uidvalidity = None
+
+    async def _command(self, *args: bytes) -> t.List[t.List]:
+        # 调用方需持有 self._lock
+        if self.closed:
+            raise IMAP4.abort("connection closed")
+        self._tagno += 1
+        tag = b"A%04d" % self._tagno
+        self._writer.write(tag + b" " + b" ".join(args) + b"\r\n")
+        await self._writer.drain()
+        responses = []
+        while True:
+            line = await self._readline()
+            if line.startswith(tag + b" "):
+                status, _, text = line[len(tag) + 1:].partition(b" ")
+                if status != b"OK":
+                    raise IMAP4.error(f"{args[0].decode()} failed: {text.decode(errors='replace')}")
+                return responses
+            if line.startswith(b"* BYE") and args[0] != b"LOGOUT":
+                raise IMAP4.abort(line.decode(errors='replace'))
+            response = await self._read_response(line)
+            if line.startswith(b"* "):
+                first = response[0]
+                response[0] = (first[0][2:], first[1]) if isinstance(first, tuple) else first[2:]
+                responses.append(response)
+
+    async def command(self, *args: bytes) -> t.List[t.List]:
+        """
+        执行命令, 返回未标记响应(去掉 `* `), 命令失败时抛出 IMAP4.error
+        """
+        async with self._lock:
+            return await self._command(*args)
+
+    async def _select(self, folder: str) -> t.Optional[int]:
+        # 调用方需持有 self._lock
+        if folder == self.selected:
+            return self.uidvalidity
+        self.selected = None
+        responses = await self._command(b"SELECT", _quote(folder))
+        self.uidvalidity = None
+        for response in responses:
+            found = _UIDVALIDITY.search(response[0] if isinstance(response[0], bytes) else response[0][0])
+            if found is not None:
+                self.uidvalidity = int(found.group(1))
+        self.selected = folder
+        return self.uidvalidity
+
+    async def select(self, folder: str) -> t.Optional[int]:
+        """ 文件夹已选中时不再重复 SELECT, 返回该文件夹的 UIDVALIDITY """
+        async with self._lock:
+            return await self._select(folder)
+
+    async def selected_command(self, folder: str, *args: bytes) -> t.List[t.List]:
+        """
+        在文件夹中执行命令, SELECT 与命令之间持有连接锁, 避免其他协程在中间切换文件夹
+        """
+        async with self._lock:
+            await self._select(folder)
+            return await self._command(*args)
+
+    async def status(self, folder: str) -> t.Dict[str, int]:
+        responses = await self.command(b"STATUS", _quote(folder), b"(UIDNEXT UIDVALIDITY)")
+        for response in responses:
+            if response[0].startswith(b"STATUS"):
+                return parse_status(response)
+        return {}
+
+    async def search(self, folder: str, start: int, end: t.Union[int, str] = '*') -> t.List[int]:
+        responses = await self.selected_command(folder, b"UID", b"SEARCH", f"{start}:{end}".encode())
+        uids = []
+        for response in responses:
+            if response[0].startswith(b"SEARCH"):
+                uids.extend(int(uid) for uid in split_uid([response[0][len(b"SEARCH"):]]))
+        return uids
+
+    async def fetch(self, folder: str, uids: t.Sequence[int]) -> t.List[t.Tuple[int, t.Tuple[bytes, bytes]]]:
+        """ 一次 `UID FETCH <uid-set> (RFC822)` 获取多封邮件, 返回 (UID, (响应头, 邮件内容)) """
+        responses = await self.selected_command(folder, b"UID", b"FETCH", uid_set(uids).encode(), b"(RFC822)")
+        return [item for response in responses for item in iter_fetched(response)]
+
+
+class MailAccount(t.NamedTuple):
+    """
+    hostname: IMAP 服务器地址
+    username: 邮箱账户
+    password: 邮箱密码
+    boxes: 需要下载的邮箱文件夹
+    port: 端口, 默认 SSL 为 993, 否则为 143
+    ssl: 是否使用 SSL
+    """
+    hostname: str
+    username: str
+    password: str
+    boxes: t.Sequence[str] = ('INBOX', 'Junk')
+    port: t.Optional[int] = None
+    ssl: bool = True
+
+    @property
+    def server(self) -> t.Tuple[str, t.Optional[int]]:
+        return self.hostname, self.port
+
+    @property
+    def user(self) -> str:
+        return self.username.split('@', 1)[0]
+
+
+class AsyncMailEngine(object):
+
+    def __init__(self, accounts: t.Iterable[MailAccount],
+                 store: t.Callable[[MailEntity], None],
+                 on_error: t.Callable[[str, str, int, str], None] = None,
+                 max_connections_per_server: int = 4,
+                 workers: int = 16,
+                 batch: int = 50,
+                 queue_size: int = 64,
+                 storage_workers: int = 4,
+                 lookup_interval: float = 60 * 2,
+                 retry_interval: float = 60,
+                 max_retry: int = 5,
+                 resync_on_start: bool = True,
+                 sqlite_db: str = None,
+                 ssl_context: pythonssllib.SSLContext = None):
+        """
+        Args:
+            accounts: 邮箱账户
+            store: 存储一封邮件, 在线程池中执行, 如 lambda mail: mail.write_to_unix(directory)
+            on_error: 下载失败时调用, 参数为 (邮箱账户, 文件夹, UID, 错误信息), 在线程池中执行,
+                      如 RecordsStorage().write_error_download
+            max_connections_per_server: 同一服务器上同时执行的检索/下载请求数
+            workers: 下载协程数
+            batch: 每次请求下载的邮件数量
+            queue_size: 待下载队列中的最大批次数, 队列满时检索等待
+            storage_workers: 解析/存储邮件的线程数
+            lookup_interval: 每个账户检索新邮件的时间间隔
+            retry_interval: 连接异常后重试的等待秒数
+            max_retry: 每批邮件下载的最大重试次数
+            resync_on_start: 启动后首次检索是否全量检索, 上次退出时未下载的 UID 以及下载失败的 UID 会重新下载.
+            sqlite_db: 记录已下载 UID 及检索位置的 SQLite 数据库位置, 默认采用 $HOME/.mail_metadata.db .
+            ssl_context: SSL 上下文
+        """
+        self.accounts = list(accounts)
+        self.store = store
+        self.on_error = on_error
+        self.max_connections_per_server = max_connections_per_server
+        self.workers = workers
+        self.batch = batch
+        self.queue_size = queue_size
+        self.storage_workers = storage_workers
+        self.lookup_interval = lookup_interval
+        self.retry_interval = retry_interval
+        self.max_retry = max_retry
+        self.resync_on_start = resync_on_start
+        self.sqlite_db = sqlite_db
+        self.ssl_context = ssl_context
+        self.stored = 0
+        self.failed = 0
+        # 已完成首次检索的 (邮箱账户, 文件夹)
+        self._synced: t.Set[t.Tuple[str, str]] = set()
+
+    def _init_runtime(self):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._limits: t.Dict[t.Tuple, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.max_connections_per_server))
+        self._connections: t.Dict[str, AsyncIMAPConnection] = {}
+        self._connecting: t.Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._executor = ThreadPoolExecutor(max_workers=self.storage_workers, thread_name_prefix="MailStorage")
+
+    async def _blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _connection(self, account: MailAccount) -> AsyncIMAPConnection:
+        async with self._connecting[account.username]:
+            connection = self._connections.get(account.username)
+            if connection is None or connection.closed:
+                connection = AsyncIMAPConnection(account.hostname, account.port, account.ssl, self.ssl_context)
+                await connection.open(account.username, account.password)
+                self._connections[account.username] = connection
+            return connection
+
+    async def _drop_connection(self, account: MailAccount):
+        connection = self._connections.pop(account.username, None)
+        if connection is not None:
+            await connection.close()
+
+    # ======================================
+    # UID 检索
+    # ======================================
+    async def _search(self, connection: AsyncIMAPConnection, box: str, start: int, uidnext: t.Optional[int]):
+        if uidnext is None:
+            return [uid for uid in await connection.search(box, start) if uid >= start]
+        uids = []
+        # 分段检索, 避免响应过长
+        for segment_start in range(start, uidnext, SEARCH_SEGMENT):
+            uids.extend(await connection.search(box, segment_start,
+                                                min(segment_start + SEARCH_SEGMENT, uidnext) - 1))
+        return uids
+
+    async def _discover(self, account: MailAccount, box: str) -> t.Tuple[t.List[int], t.Optional[t.Tuple]]:
+        """ 返回待下载的 UID 及新的检索位置, 同 ProduceUID._count_todo_uids """
+        async with self._limits[account.server]:
+            connection = await self._connection(account)
+            status = await connection.status(box)
+            if 'UIDVALIDITY' not in status:
+                status['UIDVALIDITY'] = await connection.select(box)
+            uidvalidity, uidnext = status['UIDVALIDITY'], status.get('UIDNEXT')
+            checkpoint = await self._blocking(get_uid_checkpoint, account.user, box, self.sqlite_db)
+            if checkpoint is not None and uidvalidity is not None and checkpoint.uidvalidity != uidvalidity:
+                logger.warning(f"UIDVALIDITY of {account.username}/{box} changed from {checkpoint.uidvalidity} "
+                               f"to {uidvalidity}, resync all UID.")
+            if checkpoint is None or uidvalidity is None or checkpoint.uidvalidity != uidvalidity or \
+                    (self.resync_on_start and (account.username, box) not in self._synced):
+                start = 1
+            elif uidnext is not None and uidnext <= checkpoint.uidnext:
+                return [], None
+            else:
+                start = checkpoint.uidnext
+            online_uids = await self._search(connection, box, start, uidnext)
+        local_uids = await self._blocking(get_done_uids, account.user, box, start, self.sqlite_db)
+        todo_uids = sorted(set(online_uids) - set(local_uids))
+        logger.info(f"{account.username}/{box}: search UID from {start}, {len(todo_uids)} new mails.")
+        if uidvalidity is None:
+            return todo_uids, None
+        return todo_uids, (uidvalidity, max(uidnext or 0, max(online_uids, default=0) + 1, start))
+
+    async def _watch(self, account: MailAccount, once: bool):
+        while True:
+            started = time.monotonic()
+            try:
+                pending = []
+                for box in account.boxes:
+                    todo_uids, checkpoint = await self._discover(account, box)
+                    batches = []
+                    for position in range(0, len(todo_uids), self.batch):
+                        batches.append(asyncio.get_running_loop().create_future())
+                        # 队列满时在此等待, 检索速度受下载速度限制
+                        await self._queue.put((account, box, todo_uids[position: position + self.batch], batches[-1]))
+                    pending.append((box, checkpoint, batches))
+                for box, checkpoint, batches in pending:
+                    # 全部存储后再记录检索位置, 有邮件未下载时下次从原位置重新检索
+                    if not all(await asyncio.gather(*batches)):
+                        logger.warning(f"Some mails of {account.username}/{box} are not stored, "
+                                       f"search them again next time.")
+                        continue
+                    if checkpoint is not None:
+                        await self._blocking(set_uid_checkpoint, account.user, box, *checkpoint, self.sqlite_db)
+                    self._synced.add((account.username, box))
+            except (IMAP4.error, OSError, asyncio.TimeoutError) as exc:
+                logger.warning(f"Failed to search new mails of {account.username}, retry later.\n[Detail] {exc}")
+                await self._drop_connection(account)
+                if once:
+                    return
+                await asyncio.sleep(self.retry_interval)
+                continue
+            if once:
+                return
+            await asyncio.sleep(max(self.lookup_interval - (time.monotonic() - started), 0))
+
+    # ======================================
+    # 下载
+    # ======================================
+    def _store(self, account: MailAccount, box: str, uid: int, item: t.Tuple[bytes, bytes]):
+        self.store(built_entity(account.username, box, uid, [item]))
+
+    async def _report_error(self, account: MailAccount, box: str, uids: t.Iterable[int], error_msg: str):
+        uids = list(uids)
+        self.failed += len(uids)
+        logger.error(f"Failed to download {account.username}/{box} UID {uids}: {error_msg}")
+        if self.on_error is not None:
+            for uid in uids:
+                await self._blocking(self.on_error, account.username, box, uid, error_msg)
+
+    async def _download(self, account: MailAccount, box: str, uids: t.List[int]) -> bool:
+        """ 下载并存储一批邮件, 返回是否全部存储成功 """
+        remaining = set(uids)
+        stored = True
+        retry_times = 0
+        while remaining:
+            try:
+                async with self._limits[account.server]:
+                    connection = await self._connection(account)
+                    fetched = await connection.fetch(box, sorted(remaining))
+            except (IMAP4.abort, OSError, asyncio.TimeoutError) as exc:
+                await self._drop_connection(account)
+                if retry_times >= self.max_retry:
+                    await self._report_error(account, box, remaining, "retry much.")
+                    return False
+                retry_times += 1
+                logger.info(f"Request {account.username}/{box} again after {self.retry_interval} seconds. "
+                            f"retry times: {retry_times}\n[Detail] {exc}")
+                await asyncio.sleep(self.retry_interval)
+                continue
+            except IMAP4.error as exc:
+                await self._report_error(account, box, remaining, str(exc))
+                return False
+            for uid, item in fetched:
+                if uid not in remaining:
+                    continue
+                remaining.discard(uid)
+                try:
+                    # 等待存储完成后再继续, 存储速度限制下载速度
+                    await self._blocking(self._store, account, box, uid, item)
+                    self.stored += 1
+                except Exception as exc:
+                    stored = False
+                    await self._report_error(account, box, [uid], f"Storage error. {exc}")
+            break
+        if remaining:
+            await self._report_error(account, box, sorted(remaining), "UID is invalid")
+            return False
+        return stored
+
+    async def _work(self):
+        while True:
+            account, box, uids, done = await self._queue.get()
+            stored = False
+            try:
+                stored = await self._download(account, box, uids)
+            except Exception as exc:
+                logger.exception(f"Unexpected error while downloading {account.username}/{box}: {exc}")
+            finally:
+                if not done.done():
+                    done.set_result(stored)
+                self._queue.task_done()
+
+    async def run(self, once: bool = False):
+        """
+        检索并下载所有账户的邮件
+
+        Args:
+            once: 为 True 时只检索一次, 下载完成后返回; 否则持续运行
+        """
+        self._init_runtime()
+        workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            watchers = [asyncio.create_task(self._watch(account, once)) for account in self.accounts]
+            await asyncio.gather(*watchers)
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for account in self.accounts:
+                await self._drop_connection(account)
+            self._executor.shutdown(wait=True)
+        logger.info(f"Stored {self.stored} mails, {self.failed} failed.")
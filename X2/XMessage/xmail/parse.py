@@ -9,7 +9,7 @@ from email import message_from_string
 from email.header import decode_header
 from email.utils import parseaddr, parsedate
 from X1.stand import ParamStandError
-from X2.XMessage.xmail.utils import decode_mail_string
+from X2.XMessage.xmail.utils import decode_mail_string, mail_source
 from X2.XMessage.xmail.container import MailContext, MailFile, Attachment, Attachments, MailEntity
 
 
@@ -114,11 +114,12 @@ def fetch_context(msg):
 
 
 def pull_attachments(msg):
+    source = mail_source(extract_sender(msg) or '')
     for subpart in msg.walk():
         encodename = subpart.get_filename()
         if encodename is not None:
             filename = decode_header(encodename)[0]
-            filename = decode_mail_string(*filename)
+            filename = decode_mail_string(*filename, source=source)
             fileflow = subpart.get_payload(decode=True)
             if fileflow:
                 attach = MailFile(filename, fileflow)
@@ -102,6 +102,29 @@ class ErrorDownloadTable(BaseTable):
     """
 
 
+class UidCheckpointTable(BaseTable):
+    """
+    本表用于记录邮箱文件夹 UID 检索位置, 小于 uidnext 的 UID 均已检索过
+    """
+
+    TableName = "uid_checkpoints"
+
+    ColumnUser = MailMetaTable.ColumnUser
+    ColumnBox = MailMetaTable.ColumnBox
+    ColumnUidValidity = "uidvalidity"
+    ColumnUidNext = "uidnext"
+
+    InitSQL = f"""
+    CREATE TABLE IF NOT EXISTS {TableName}(
+      {ColumnUser}          VARCHAR(100) NOT NULL,     -- 邮箱账户名称(不包含域名/邮箱厂商)
+      {ColumnBox}           VARCHAR(30) NOT NULL,      -- 邮箱文件夹
+      {ColumnUidValidity}   BIGINT NOT NULL,           -- 文件夹 UIDVALIDITY, 变化时原有 UID 失效
+      {ColumnUidNext}       BIGINT NOT NULL,           -- 下一次检索的起始 UID
+    PRIMARY KEY ({ColumnUser}, {ColumnBox})
+    );
+    """
+
+
 # ======================================
 # SQLite Thread Locker
 # ======================================
@@ -564,7 +587,7 @@ def publish_mailfileinfo(instance: t.Union[Attachment, MailContext], *args, **kw
                                         "fogname": instance.fogname})
 
 
-def get_done_uids(user: str, box: t.AnyStr) -> t.List:
+def get_done_uids(user: str, box: t.AnyStr, start: int = None, sqlite_path: str = None) -> t.List:
     """
     读取 UID 信息.
     由于 SQLite 必定(或者说必须)起作用, 将本地 SQLite 读取 UID 信息.
@@ -572,16 +595,74 @@ def get_done_uids(user: str, box: t.AnyStr) -> t.List:
     Args:
         user: 邮箱用户
         box: 邮箱文件夹名称
+        start: 只读取不小于该值的 UID, 按主键范围查询, 默认读取全部
+        sqlite_path: SQLite 数据库位置, Default: $HOME/.mail_metadata.db .
 
     Returns: UID列表
 
     """
-    local_storage = LocalStorage(dbpath=RecordsStorage.default_sqlite)
+    local_storage = LocalStorage(dbpath=sqlite_path or RecordsStorage.default_sqlite)
     sql = f"""
     SELECT {MailMetaTable.ColumnUid}
     FROM {MailMetaTable.TableName}
     WHERE {MailMetaTable.ColumnUser} == ?
-    AND {MailMetaTable.ColumnBox} == ?;
+    AND {MailMetaTable.ColumnBox} == ?
+    AND {MailMetaTable.ColumnUid} >= ?;
     """
-    result = local_storage.execute(sql, (user, box, ), fetchall=True, onecol=True)
+    result = local_storage.execute(sql, (user, box, start or 0, ), fetchall=True, onecol=True)
     return result
+
+
+class UidCheckpoint(t.NamedTuple):
+    uidvalidity: int
+    uidnext: int
+
+
+def _checkpoint_storage(sqlite_path: str = None) -> LocalStorage:
+    local_storage = LocalStorage(dbpath=sqlite_path or RecordsStorage.default_sqlite)
+    local_storage.execute(UidCheckpointTable.InitSQL, ())
+    return local_storage
+
+
+def get_uid_checkpoint(user: str, box: t.AnyStr, sqlite_path: str = None) -> t.Optional[UidCheckpoint]:
+    """
+    读取邮箱文件夹 UID 检索位置
+
+    Args:
+        user: 邮箱用户
+        box: 邮箱文件夹名称
+        sqlite_path: SQLite 数据库位置, Default: $HOME/.mail_metadata.db .
+
+    Returns: UidCheckpoint(uidvalidity, uidnext), 未检索过时为 None
+    """
+    sql = f"""
+    SELECT {UidCheckpointTable.ColumnUidValidity}, {UidCheckpointTable.ColumnUidNext}
+    FROM {UidCheckpointTable.TableName}
+    WHERE {UidCheckpointTable.ColumnUser} == ?
+    AND {UidCheckpointTable.ColumnBox} == ?;
+    """
+    result = _checkpoint_storage(sqlite_path).execute(sql, (user, box, ), fetchall=True)
+    return UidCheckpoint(*result[0]) if result else None
+
+
+def set_uid_checkpoint(user: str, box: t.AnyStr, uidvalidity: int, uidnext: int, sqlite_path: str = None) -> None:
+    """
+    记录邮箱文件夹 UID 检索位置, 小于 uidnext 的 UID 均已检索过
+
+    Args:
+        user: 邮箱用户
+        box: 邮箱文件夹名称
+        uidvalidity: 文件夹 UIDVALIDITY
+        uidnext: 下一次检索的起始 UID
+        sqlite_path: SQLite 数据库位置, Default: $HOME/.mail_metadata.db .
+    """
+    sql = f"""
+    REPLACE INTO {UidCheckpointTable.TableName}(
+      {UidCheckpointTable.ColumnUser},
+      {UidCheckpointTable.ColumnBox},
+      {UidCheckpointTable.ColumnUidValidity},
+      {UidCheckpointTable.ColumnUidNext}
+    )
+    VALUES(?, ?, ?, ?);
+    """
+    _checkpoint_storage(sqlite_path).execute(sql, (user, box, int(uidvalidity), int(uidnext), ))
@@ -1,12 +1,14 @@
 # coding=utf8
 
-import chardet
 import imghdr
 import os
+import re
 import time
+import typing as t
 from email.mime.application import MIMEApplication
 from email.mime.image import MIMEImage
 from X1.stand import ArgStandError
+from X2.XCoding.detect import encoding_service
 
 
 def uid_rules(start, end):
@@ -28,6 +30,53 @@ def split_uid(raw):
     return raw[0].decode('utf-8').split()
 
 
+def uid_set(uids: t.Iterable[t.Union[int, str]]) -> str:
+    """
+    将 UID 序列压缩为 IMAP sequence-set, 如 [101, 102, ..., 150, 153] => '101:150,153'
+    """
+    ranges = []
+    for uid in sorted(set(map(int, uids))):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+_FETCH_UID = re.compile(rb"UID (\d+)")
+
+
+def iter_fetched(response: t.List) -> t.Iterator[t.Tuple[int, t.Tuple[bytes, bytes]]]:
+    """
+    逐封拆分 UID FETCH 多封邮件的响应
+
+    imaplib 返回的响应中每封邮件为 (b'1 (UID 101 RFC822 {size}', 邮件内容) 元组, 之后跟随 b')' 结束;
+    部分服务器将 UID 放在邮件内容之后, 即结束部分为 b' UID 101)'
+
+    Returns: (UID, (响应头, 邮件内容)) 迭代器
+    """
+    for position, item in enumerate(response):
+        if not isinstance(item, tuple):
+            continue
+        found = _FETCH_UID.search(item[0])
+        if found is None and position + 1 < len(response) and isinstance(response[position + 1], bytes):
+            found = _FETCH_UID.search(response[position + 1])
+        if found is None:
+            continue
+        yield int(found.group(1)), item
+
+
+_STATUS_ITEM = re.compile(rb"([A-Z-]+) (\d+)")
+
+
+def parse_status(content: t.List) -> t.Dict[str, int]:
+    """
+    解析 STATUS 响应, 如 [b'"INBOX" (MESSAGES 231 UIDNEXT 44292 UIDVALIDITY 1)'] => {'MESSAGES': 231, ...}
+    """
+    raw = content[0] if content and content[0] is not None else b""
+    return {name.decode(): int(value) for name, value in _STATUS_ITEM.findall(raw.rpartition(b"(")[2])}
+
+
 def default_extract_folder(raw):
     raw = str(raw)
     return (raw.split('"/"')[-1]
@@ -44,7 +93,14 @@ def response_is_ok(content):
            (content[0] is not None)
 
 
-def decode_mail_string(string, encode=None, error=None):
+def mail_source(address):
+    u"""
+    邮件来源 key, 同一发件域名的邮件编码基本一致, 用于编码识别缓存
+    """
+    return "mail", address.rpartition('@')[-1].lower()
+
+
+def decode_mail_string(string, encode=None, error=None, source=None):
     try:
         if isinstance(string, str):
             string = string.encode("utf8")
@@ -58,19 +114,19 @@ def decode_mail_string(string, encode=None, error=None):
                 else:
                     string = str(string, encode, errors='replace')
         else:
-            chartype = chardet.detect(string)["encoding"]
-            if chartype is not None:
-                if error:
-                    string = string.decode(chartype, errors=error).encode("utf8")
-                else:
-                    string = string.decode(chartype).encode("utf8")
+            # 邮件头字符串很短, chardet 置信度低时会按 GB18030 解码, 合法 utf-8 直接按 utf-8 解码
+            try:
+                return string.decode("utf8").encode("utf8")
+            except UnicodeDecodeError:
+                pass
+            # 只对样本识别编码, 指定来源时复用该来源已识别的编码
+            chartype = encoding_service.detect(string, source)
+            if error:
+                string = string.decode(chartype, errors=error).encode("utf8")
             else:
-                if error:
-                    string = string.decode("GB18030", errors=error).encode("utf8")
-                else:
-                    string = string.decode("GB18030").encode("utf8")
+                string = string.decode(chartype).encode("utf8")
     except UnicodeDecodeError as e:
-        if 'gb2312' in e:
+        if 'gb2312' in str(e).lower():
             if error:
                 string = string.decode('GB18030', errors=error).encode("utf8")
             else:
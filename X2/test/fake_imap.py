@@ -0,0 +1,272 @@
+# coding=utf-8
+
+"""
+测试用本地 IMAP 服务
+
+实现 imaplib/IMAPBox 用到的 IMAP4rev1 命令子集, 邮件保存在内存中, 并记录收到的命令次数:
+
+    with FakeIMAPServer() as server:
+        uid = server.add_message("INBOX", raw_bytes)
+        box = IMAPBox(hostname=server.host, port=server.port, username="user", password="pw", ssl=False)
+        ...
+        assert server.commands["UID FETCH"] == 1
+
+IDLE 中的连接在 add_message 时收到 EXISTS 推送.
+命令处理方法为 FakeIMAPHandler.cmd_<命令名称>, 测试中可以继承后增加命令或修改 capabilities.
+"""
+
+import re
+import socketserver
+import threading
+import time
+from collections import Counter, OrderedDict
+
+_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\([^)]*\))|(\S+)')
+
+
+def _tokens(line: bytes):
+    # 引号中的参数去掉引号, 括号中的参数保持原样
+    return [match.group(0) if match.group(1) is None else match.group(1) for match in _TOKEN.finditer(line)]
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class Mailbox(object):
+
+    def __init__(self, uidvalidity: int):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = OrderedDict()
+
+    def add(self, raw: bytes) -> int:
+        uid = self.uidnext
+        self.messages[uid] = raw
+        self.uidnext += 1
+        return uid
+
+    def match(self, sequence_set: str, by_uid: bool):
+        """ sequence-set 匹配的 (序号, UID), `n:*` 中 n 大于最大值时按 RFC3501 匹配最后一封 """
+        items = list(enumerate(self.messages, start=1))
+        if not items:
+            return []
+        largest = items[-1][1] if by_uid else items[-1][0]
+        wanted = set()
+        for part in sequence_set.split(','):
+            start, _, end = part.partition(':')
+            start = largest if start == '*' else int(start)
+            end = start if not end else (largest if end == '*' else int(end))
+            start, end = min(start, end), max(start, end)
+            wanted.add((start, end))
+        return [(seq, uid) for seq, uid in items
+                if any(start <= (uid if by_uid else seq) <= end for start, end in wanted)]
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+
+    capabilities = "IMAP4rev1 LITERAL+ IDLE"
+
+    def setup(self):
+        super(FakeIMAPHandler, self).setup()
+        self.selected = None
+        # 推送与命令响应可能来自不同线程
+        self.write_lock = threading.Lock()
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        self.send("* OK fake IMAP4rev1 service ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            tokens = _tokens(rest)
+            if not tokens:
+                self.send(tag + b" BAD empty command\r\n")
+                continue
+            name = tokens[0].decode().upper()
+            args = [token.decode('utf-8') for token in tokens[1:]]
+            if name == 'UID' and args:
+                name, args = f"UID {args[0].upper()}", args[1:]
+            self.server.record(name, args)
+            handler = getattr(self, "cmd_" + name.lower().replace(' ', '_'), None)
+            tag = tag.decode()
+            if handler is None:
+                self.send(f"{tag} BAD unknown command {name}\r\n")
+                continue
+            if handler(tag, *args) is False:
+                return
+
+    def cmd_capability(self, tag):
+        self.send(f"* CAPABILITY {self.capabilities}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def cmd_login(self, tag, username, password):
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def cmd_noop(self, tag):
+        self.send(f"{tag} OK NOOP completed\r\n")
+
+    def cmd_list(self, tag, reference='""', pattern='*'):
+        for name in self.server.mailboxes:
+            self.send(f'* LIST (\\HasNoChildren) "/" {_quote(name)}\r\n')
+        self.send(f"{tag} OK LIST completed\r\n")
+
+    def cmd_select(self, tag, name='INBOX'):
+        mailbox = self.server.mailboxes.get(name)
+        if mailbox is None:
+            self.send(f"{tag} NO mailbox {name} does not exist\r\n")
+            return
+        self.selected = name
+        self.send(f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                  f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                  f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+                  f"{tag} OK [READ-WRITE] SELECT completed\r\n")
+
+    cmd_examine = cmd_select
+
+    def cmd_status(self, tag, name, items):
+        mailbox = self.server.mailboxes.get(name)
+        if mailbox is None:
+            self.send(f"{tag} NO mailbox {name} does not exist\r\n")
+            return
+        self.send(f"* STATUS {_quote(name)} (MESSAGES {len(mailbox.messages)} "
+                  f"UIDNEXT {mailbox.uidnext} UIDVALIDITY {mailbox.uidvalidity})\r\n"
+                  f"{tag} OK STATUS completed\r\n")
+
+    def cmd_close(self, tag):
+        self.selected = None
+        self.send(f"{tag} OK CLOSE completed\r\n")
+
+    def cmd_logout(self, tag):
+        self.send(f"* BYE fake IMAP4rev1 service closing\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def _mailbox(self, tag):
+        if self.selected is None:
+            self.send(f"{tag} BAD no mailbox selected\r\n")
+            return None
+        return self.server.mailboxes[self.selected]
+
+    def cmd_uid_search(self, tag, *criteria):
+        mailbox = self._mailbox(tag)
+        if mailbox is None:
+            return
+        # 仅支持 UID 范围条件
+        uids = [uid for _, uid in mailbox.match(criteria[-1], by_uid=True)] if criteria else list(mailbox.messages)
+        self.send(f"* SEARCH{''.join(f' {uid}' for uid in uids)}\r\n{tag} OK SEARCH completed\r\n")
+
+    def _fetch(self, tag, sequence_set, by_uid):
+        mailbox = self._mailbox(tag)
+        if mailbox is None:
+            return
+        for seq, uid in mailbox.match(sequence_set, by_uid):
+            raw = mailbox.messages[uid]
+            item = f"UID {uid} RFC822" if by_uid else "BODY[]"
+            self.send(f"* {seq} FETCH ({item} {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def cmd_idle(self, tag):
+        if 'IDLE' not in self.capabilities.split():
+            self.send(f"{tag} BAD unknown command IDLE\r\n")
+            return
+        if self._mailbox(tag) is None:
+            return
+        self.server.idling(self, True)
+        try:
+            self.send("+ idling\r\n")
+            # 新邮件由 FakeIMAPServer.add_message 推送, 直到客户端发送 DONE
+            line = self.rfile.readline()
+        finally:
+            self.server.idling(self, False)
+        if not line:
+            return False
+        if line.strip().upper() != b"DONE":
+            self.send(f"{tag} BAD expected DONE\r\n")
+            return
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def cmd_uid_fetch(self, tag, sequence_set, items='(RFC822)'):
+        self._fetch(tag, sequence_set, by_uid=True)
+
+    def cmd_fetch(self, tag, sequence_set, items='(BODY.PEEK[])'):
+        self._fetch(tag, sequence_set, by_uid=False)
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler=FakeIMAPHandler, host: str = '127.0.0.1', port: int = 0):
+        super(FakeIMAPServer, self).__init__((host, port), handler)
+        self.host, self.port = self.server_address[:2]
+        self.mailboxes = OrderedDict()
+        self.commands = Counter()
+        self.history = []
+        self.lock = threading.RLock()
+        self.idlers = set()
+        self._thread = None
+
+    def mailbox(self, name: str, uidvalidity: int = 1) -> Mailbox:
+        with self.lock:
+            if name not in self.mailboxes:
+                self.mailboxes[name] = Mailbox(uidvalidity)
+            return self.mailboxes[name]
+
+    def add_message(self, name: str, raw: bytes) -> int:
+        with self.lock:
+            mailbox = self.mailbox(name)
+            uid = mailbox.add(raw)
+            for handler in self.idlers:
+                if handler.selected == name:
+                    handler.send(f"* {len(mailbox.messages)} EXISTS\r\n")
+            return uid
+
+    def idling(self, handler, idle: bool):
+        with self.lock:
+            if idle:
+                self.idlers.add(handler)
+            else:
+                self.idlers.discard(handler)
+
+    def wait_idle(self, count: int = 1, timeout: float = 5) -> bool:
+        """ 等待至少 count 个连接进入 IDLE """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.idlers) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def record(self, name: str, args):
+        with self.lock:
+            self.commands[name] += 1
+            self.history.append((name, args))
+
+    def reset_counts(self):
+        with self.lock:
+            self.commands.clear()
+            self.history.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
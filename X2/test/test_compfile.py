@@ -0,0 +1,67 @@
+# coding=utf-8
+
+"""
+X2.utlis.CompFileMemFree 解压测试
+"""
+
+import os
+import zipfile
+from io import BytesIO
+from X2.utlis import CompFileMemFree
+
+STATEMENT = u"发生日期,证券代码\n20210105,600000\n".encode("GB18030")
+
+
+def _zip(members: dict) -> BytesIO:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as handler:
+        for name, data in members.items():
+            handler.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_filter_before_decompress():
+    archive = _zip({"report/statement.CSV": STATEMENT, "attach/big.bin": os.urandom(1024 * 1024)})
+    opened = []
+    zip_open = zipfile.ZipFile.open
+
+    def spy(self, name, *args, **kwargs):
+        opened.append(getattr(name, 'filename', name))
+        return zip_open(self, name, *args, **kwargs)
+
+    zipfile.ZipFile.open = spy
+    try:
+        members = list(CompFileMemFree.iter_members(archive, target_ext='.csv'))
+    finally:
+        zipfile.ZipFile.open = zip_open
+    assert [name for name, _ in members] == ["report/statement.CSV"]
+    assert members[0][1].read() == STATEMENT
+    assert opened == ["report/statement.CSV"]
+
+
+def test_nested_and_spool():
+    inner = _zip({"statement.csv": STATEMENT, "readme.txt": b"readme"}).getvalue()
+    archive = _zip({"inner.zip": inner, "outer.csv": STATEMENT * 100})
+    members = CompFileMemFree.on(archive, target_ext=('.csv',))
+    assert list(members) == ["inner.zip/statement.csv", "outer.csv"]
+    assert isinstance(members["inner.zip/statement.csv"], BytesIO)
+
+    archive.seek(0)
+    spooled = dict(CompFileMemFree.iter_members(archive, target_files=["outer.csv"], spool_size=10))
+    assert not isinstance(spooled["outer.csv"], BytesIO)
+    assert spooled["outer.csv"].read() == STATEMENT * 100
+
+
+def test_gbk_member_name():
+    # 国内压缩软件以 GBK 编码写入文件名且不设置 utf-8 标志位
+    name = u"对账单.csv".encode("GBK")
+    placeholder = b"x" * len(name)
+    raw = _zip({placeholder.decode(): STATEMENT}).getvalue().replace(placeholder, name)
+    assert list(CompFileMemFree.unzip(BytesIO(raw))) == [u"对账单.csv"]
+
+
+if __name__ == '__main__':
+    test_filter_before_decompress()
+    test_nested_and_spool()
+    test_gbk_member_name()
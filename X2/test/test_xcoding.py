@@ -0,0 +1,37 @@
+# coding=utf-8
+
+"""
+X2.XCoding 编码识别测试
+"""
+
+from X2.XCoding import convert_to_unicode
+from X2.XCoding.detect import EncodingService, detect_sample
+
+TEXT = u"发生日期,证券代码,证券名称,成交数量,成交金额\n20210105,600000,浦发银行,1000,10200.00\n"
+
+
+def test_detect_sample():
+    assert detect_sample(TEXT.encode("utf-8") * 2000).encoding == "utf-8"
+    assert detect_sample(TEXT.encode("GB18030") * 2000).encoding == "GB18030"
+    # 开头为 ASCII, 中文出现在样本之后
+    content = b"date,code,amount\n" * 10000 + TEXT.encode("utf-8")
+    assert detect_sample(content, sample_size=4096).encoding == "utf-8"
+    # 无法识别时按 GB18030 处理
+    assert not detect_sample(b"\x81\x30").reliable
+
+
+def test_source_memoization():
+    service = EncodingService()
+    source = ("mail", "broker.com")
+    for _ in range(3):
+        assert service.detect(TEXT.encode("GB18030") * 50, source) == "GB18030"
+    assert (service.hits, service.misses) == (2, 1)
+    # 来源编码变化时重新识别
+    assert service.detect(TEXT.encode("utf-8") * 50, source) == "utf-8"
+    assert service.source_encoding(source).encoding == "utf-8"
+    assert convert_to_unicode(TEXT.encode("GB18030"), source=source) == TEXT
+
+
+if __name__ == '__main__':
+    test_detect_sample()
+    test_source_memoization()
@@ -0,0 +1,217 @@
+# coding=utf-8
+
+"""
+X2.XExcel.read 读取测试
+"""
+
+import functools
+import mmap
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from io import BytesIO
+import numpy
+import pandas
+import pytest
+from X1.stand import ArgStandError
+from X2.XExcel.cache import WorkbookCache
+from X2.XExcel.read import LazyWorkbook, read_excel_by_fileflow, read_excel_by_filepath
+from X2.XExcel.sniff import sniff_format, stream_encoding, text_encoding
+from X2.XExcel.write import Sheet, StreamingWorkbook, write_workbooks
+
+
+def _workbook(sheets=3, rows=50):
+    handler, filepath = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handler)
+    with pandas.ExcelWriter(filepath) as writer:
+        for no in range(sheets):
+            frame = pandas.DataFrame(numpy.arange(rows * 4).reshape(rows, 4) + no)
+            frame.to_excel(writer, sheet_name=f"sheet{no}", header=False, index=False)
+    return filepath
+
+
+def test_lazy_workbook():
+    filepath = _workbook()
+    try:
+        eager = read_excel_by_filepath(filepath)
+        with open(filepath, mode='rb') as handler:
+            lazy = read_excel_by_fileflow(handler.read(), lazy=True)
+        assert isinstance(lazy, LazyWorkbook) and lazy.error is False
+        assert list(lazy) == list(eager) and lazy.loaded == []
+
+        peeked = lazy.peek("sheet1", 5)
+        pandas.testing.assert_frame_equal(peeked, eager["sheet1"].iloc[:5])
+        assert lazy.loaded == []
+
+        pandas.testing.assert_frame_equal(lazy["sheet2"], eager["sheet2"])
+        assert lazy.loaded == ["sheet2"] and lazy["sheet2"] is lazy["sheet2"]
+        pandas.testing.assert_frame_equal(lazy.peek(2, 3), eager["sheet2"].iloc[:3])
+
+        loaded = lazy.load()
+        assert list(loaded) == list(eager)
+        assert all(loaded[name].equals(eager[name]) for name in eager)
+        lazy.close()
+    finally:
+        os.remove(filepath)
+
+
+def test_sniff_format():
+    filepath = _workbook(sheets=1, rows=2)
+    try:
+        with open(filepath, mode='rb') as handler:
+            assert sniff_format(handler.read(64)) == 'xlsx'
+    finally:
+        os.remove(filepath)
+    assert sniff_format(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 8) == 'xls'
+    assert sniff_format(u"\ufeff<html><table><tr><td>1</td></tr></table>".encode('utf-8')) == 'html'
+    assert sniff_format(u"证券代码,证券名称\n600000,浦发银行".encode('GB18030')) == 'text'
+    assert sniff_format(b" \r\n") == 'empty'
+    assert sniff_format(b"\x00\x01\x02\xff\xfe\x80") == 'unknown'
+    # 截断在多字节字符中间
+    assert text_encoding(u"证券代码".encode('utf-8')[:-1]) == 'utf-8'
+    assert text_encoding(u"证券代码".encode('GB18030')) == 'GB18030'
+    # 开头为纯 ASCII 时按之后第一段含非 ASCII 的内容识别
+    ascii_head = b"600000,1.00\n" * 3000
+    assert stream_encoding(BytesIO(ascii_head + u"浦发银行".encode('GB18030'))) == 'GB18030'
+    assert stream_encoding(BytesIO(ascii_head + u"浦发银行".encode('utf-8'))) == 'utf-8'
+    assert stream_encoding(BytesIO(ascii_head)) == 'utf-8'
+    assert stream_encoding(BytesIO(ascii_head + b"\x00\x01")) is None
+
+
+def test_read_sniffed():
+    for content, encoding in ((u"证券代码,证券名称\n600000,浦发银行\n", 'GB18030'),
+                              (u"证券代码,证券名称\n600000,浦发银行\n", 'utf-8')):
+        data = read_excel_by_fileflow(content.encode(encoding))
+        assert data.sniffed == 'text' and data.tried == [f"csv-{encoding}"]
+        assert data['default'].iloc[1].tolist() == [u"600000", u"浦发银行"]
+
+    # 中文内容在识别编码的文件开头之后
+    content = u"证券代码,证券名称\n" + u"600000,PF\n" * 3000 + u"600036,招商银行\n"
+    data = read_excel_by_fileflow(content.encode('GB18030'))
+    assert data.tried == ['csv-GB18030'] and data['default'].iloc[-1].tolist() == [u"600036", u"招商银行"]
+    # 识别样本之后出现不能按 utf-8 解码的内容时按 GB18030 重新读取
+    data = read_excel_by_fileflow(content.encode('utf-8') + u"600016,民生银行\n".encode('GB18030'))
+    assert data.tried == ['csv-utf-8', 'csv-GB18030'] and data['default'].iloc[-1].tolist() == [u"600016", u"民生银行"]
+
+    data = read_excel_by_fileflow(b"\x00\x01\x02\xff\xfe\x80")
+    assert data.error is True and data.tried == []
+
+    filepath = _workbook(sheets=2, rows=3)
+    try:
+        data = read_excel_by_filepath(filepath)
+        assert data.sniffed == 'xlsx' and data.tried == ['xlsx'] and list(data) == ['sheet0', 'sheet1']
+    finally:
+        os.remove(filepath)
+
+
+def test_workbook_cache():
+    filepath = _workbook(sheets=2, rows=20)
+    directory = tempfile.mkdtemp()
+    try:
+        with open(filepath, mode='rb') as handler:
+            fileflow = handler.read()
+        cache = WorkbookCache(directory)
+        first, second = cache.read(fileflow), cache.read(fileflow)
+        assert (cache.misses, cache.hits, len(cache)) == (1, 1, 1)
+        assert list(first) == list(second) and all(first[name].equals(second[name]) for name in first)
+        assert second.sniffed == 'xlsx' and second.tried == ['xlsx']
+
+        # 不可读的数据不缓存
+        cache.read(b"\x00\x01\x02\xff")
+        assert len(cache) == 1
+
+        # 读取逻辑版本变更后旧缓存失效
+        cache = WorkbookCache(directory, version='next')
+        assert len(cache) == 0 and os.listdir(directory) == ['reader-vnext']
+
+        # 超过大小上限时淘汰最久未访问的缓存
+        cache = WorkbookCache(directory, max_bytes=1)
+        cache.read(fileflow)
+        cache.read(fileflow + b"\x00")
+        assert len(cache) == 1 and cache.read(fileflow + b"\x00") is not None and cache.hits == 1
+    finally:
+        os.remove(filepath)
+        shutil.rmtree(directory)
+
+
+
+def test_workbook_cache_mapping():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = WorkbookCache(directory)
+        frame = pandas.DataFrame({u"成交金额": numpy.arange(1000.0), u"摘要": [u"证券买入"] * 1000})
+        cache.put("key", OrderedDict(sheet0=frame))
+        cached = cache.get("key")["sheet0"]
+        assert cached.equals(frame)
+        # 数值列引用映射的缓存文件
+        base = cached[u"成交金额"].to_numpy()
+        while not isinstance(base, memoryview):
+            base = base.base
+        assert isinstance(base.obj, mmap.mmap)
+        # 写时复制, 修改不影响缓存文件
+        cached.iloc[0, 0] = -1.0
+        assert cache.get("key")["sheet0"].iloc[0, 0] == 0.0
+
+        # 损坏的缓存文件丢弃
+        with open(cache._path("key"), mode="wb") as handler:
+            handler.write(b"\x80\x05broken")
+        assert cache.get("key") is None and len(cache) == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_workbook_cache_directory():
+    directory = tempfile.mkdtemp()
+    try:
+        WorkbookCache(os.path.join(directory, "cache"))
+        assert os.stat(os.path.join(directory, "cache")).st_mode & 0o777 == 0o700
+        # 其他用户可以访问的目录中的缓存可能被篡改
+        os.chmod(directory, 0o755)
+        with pytest.raises(PermissionError):
+            WorkbookCache(directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+def _report(account: int) -> dict:
+    flow = pandas.DataFrame({u"发生日期": pandas.date_range("2021-01-04", periods=5),
+                             u"成交金额": [1.5, numpy.nan, 3.0, 4.25, account]})
+    return {u"交易流水": Sheet(flow, styles={u"发生日期": "date", u"成交金额": "amount"})}
+
+
+def test_streaming_workbook():
+    import openpyxl
+
+    directory = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(directory, "stream.xlsx")
+        with StreamingWorkbook(filepath) as workbook:
+            assert workbook.add_sheet("rows", ((no, numpy.float64(no) / 2) for no in range(1000)),
+                                      columns=["no", "half"], styles={"half": "amount"}) == 1000
+        sheet = openpyxl.load_workbook(filepath)["rows"]
+        assert sheet["A1"].style == "header" and sheet.freeze_panes == "A2"
+        assert (sheet["B3"].value, sheet["B3"].number_format) == (0.5, "#,##0.00")
+        # 样式及列宽只能指定已有的列, 没有表头时不能指定
+        workbook = StreamingWorkbook(BytesIO())
+        with pytest.raises(ArgStandError):
+            workbook.add_sheet("widths", [(1, 2)], columns=["no", "half"], widths={"nohalf": 10})
+        with pytest.raises(ArgStandError):
+            workbook.add_sheet("styles", [(1, 2)], styles={"half": "amount"})
+        assert workbook._workbook.sheetnames == []
+
+        paths = write_workbooks([(os.path.join(directory, f"{no}.xlsx"), functools.partial(_report, no))
+                                 for no in range(4)], workers=2)
+        assert [os.path.basename(path) for path in paths] == ["0.xlsx", "1.xlsx", "2.xlsx", "3.xlsx"]
+        flow = read_excel_by_filepath(paths[3])[u"交易流水"]
+        assert flow.shape == (6, 2) and pandas.isna(flow.iloc[2, 1]) and flow.iloc[5, 1] == 3
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_lazy_workbook()
+    test_sniff_format()
+    test_read_sniffed()
+    test_workbook_cache()
+    test_streaming_workbook()
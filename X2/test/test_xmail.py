@@ -0,0 +1,396 @@
+# coding=utf-8
+
+"""
+X2.XMessage.xmail 邮件下载测试, 使用本地 IMAP 服务(X2/test/fake_imap.py)
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from X2.XMessage.xmail.utils import uid_set, iter_fetched, decode_mail_string
+from X2.test.fake_imap import FakeIMAPServer
+
+
+def _message(no: int) -> bytes:
+    mail = MIMEMultipart()
+    mail['Subject'] = f"对账单 {no}"
+    mail['From'] = "ops@broker.com"
+    mail['To'] = "user@fund.com"
+    mail['Date'] = "Tue, 05 Jan 2021 18:00:00 +0800"
+    mail.attach(MIMEText(f"第 {no} 封对账单", 'plain', 'utf-8'))
+    attachment = MIMEApplication(b"date,code,amount\n20210105,600000,10200.00\n")
+    attachment.add_header('Content-Disposition', 'attachment', filename=f"statement_{no}.csv")
+    mail.attach(attachment)
+    return mail.as_bytes()
+
+
+def test_uid_set():
+    assert uid_set([153, 7] + list(range(101, 151))) == "7,101:150,153"
+    assert uid_set(["3", 3, 4]) == "3:4"
+    assert uid_set([]) == ""
+
+
+def test_iter_fetched():
+    response = [(b'1 (UID 101 RFC822 {3}', b'abc'), b')',
+                (b'2 (RFC822 {3}', b'def'), b' UID 102)']
+    assert [(uid, item[1]) for uid, item in iter_fetched(response)] == [(101, b'abc'), (102, b'def')]
+
+
+
+def test_decode_mail_string():
+    for name in ["中文.xls", "交割单.xlsx", "估值表_20210105.xls", "对账单"]:
+        assert decode_mail_string(name.encode("utf-8")).decode("utf8") == name
+        assert decode_mail_string(name.encode("gbk")).decode("utf8") == name
+        assert decode_mail_string(name.encode("utf-8"), source=("mail", "broker.com")).decode("utf8") == name
+    assert decode_mail_string("中文.xls".encode("gbk"), "gb2312") == "中文.xls"
+
+
+@pytest.fixture
+def server():
+    with FakeIMAPServer() as fake:
+        for no in range(1, 61):
+            fake.add_message("INBOX", _message(no))
+        yield fake
+
+
+def _imap_box(server):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail.connect import IMAPBox
+    return IMAPBox(hostname=server.host, port=server.port, username="user@fund.com", password="pw", ssl=False)
+
+
+def test_get_mails_by_uids(server):
+    box = _imap_box(server)
+    uids = list(range(1, 51)) + [53, 60, 99]
+
+    server.reset_counts()
+    single = [box.get_mail_by_uid("INBOX", uid) for uid in uids[:-1]]
+    assert server.commands["UID FETCH"] == len(uids) - 1
+
+    server.reset_counts()
+    batched = list(box.get_mails_by_uids("INBOX", uids, batch=25))
+    # 3 次请求: 1:25 / 26:50 / 53,60,99, 不存在的 UID 99 不返回
+    assert server.commands["UID FETCH"] == 3
+    assert [history[1][0] for history in server.history if history[0] == "UID FETCH"] == \
+           ["1:25", "26:50", "53,60,99"]
+
+    assert [mail.attr.uid for mail in batched] == [mail.attr.uid for mail in single]
+    for one, other in zip(single, batched):
+        assert one.attr.subject == other.attr.subject
+        assert sorted(one.attachments) == sorted(other.attachments)
+    box.logout()
+
+
+def test_sticky_folder(server):
+    box = _imap_box(server)
+    server.add_message("Junk", _message(99))
+    server.reset_counts()
+    for uid in range(1, 11):
+        box.get_mail_by_uid("INBOX", uid)
+    box.get_uid("INBOX")
+    # 连接时已选中 INBOX
+    assert server.commands["SELECT"] == 0
+    box.get_mail_by_uid("Junk", 1)
+    box.get_mail_by_uid("INBOX", 1)
+    assert server.commands["SELECT"] == 2
+    assert box.selected == "INBOX" and box.uidvalidities == {"INBOX": 1, "Junk": 1}
+
+    server.mailboxes["INBOX"].uidvalidity = 7
+    box._change_workfolder("INBOX", force=True)
+    assert box.uidvalidity == 7
+    box.logout()
+
+
+def test_folder_queue():
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail.auto import FolderQueue
+    queue = FolderQueue()
+    for item in [("INBOX", 1), ("Junk", 1), ("INBOX", 2), ("Junk", 2), ("INBOX", 3)]:
+        queue.put(item)
+    assert queue.get(box="Junk") == ("Junk", 1)
+    assert queue.get(box="Junk") == ("Junk", 2)
+    # 指定文件夹没有 UID 时取最早放入的文件夹
+    assert queue.get(box="Junk") == ("INBOX", 1)
+    assert queue.get() == ("INBOX", 2)
+    assert queue.qsize() == 1
+
+
+def _in_thread(func, *args):
+    # SQLite 连接按线程缓存, 在新线程中使用测试数据库
+    errors = []
+
+    def target():
+        try:
+            func(*args)
+        except BaseException as exc:
+            errors.append(exc)
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _done_db(tmp_path, uids, user="user") -> str:
+    """ 已下载 UID 记录 """
+    return _record_done(str(tmp_path / "mails.db"), uids, user)
+
+
+def _record_done(sqlite_db, uids, user="user") -> str:
+    from X2.XMessage.xmail.record import MailMetaTable
+    with sqlite3.connect(sqlite_db) as conn:
+        conn.execute(MailMetaTable.InitSQL)
+        conn.executemany(f"INSERT INTO {MailMetaTable.TableName} VALUES (?, ?, ?, '', '', '', '', '', '')",
+                         [(user, "INBOX", uid) for uid in uids])
+    return sqlite_db
+
+
+def test_incremental_uids(server, tmp_path, monkeypatch):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail import auto
+    sqlite_db = _done_db(tmp_path, range(1, 11))
+    monkeypatch.setattr(auto, "UidQueue", auto.FolderQueue())
+    producer = auto.ProduceUID(_imap_box(server), boxes=["INBOX"], sqlite_db=sqlite_db)
+
+    def discover():
+        server.reset_counts()
+        producer._count_todo_uids()
+        producer._pop_todo_uids()
+        return producer.todo_uids_map["INBOX"], [args[-1] for name, args in server.history if name == "UID SEARCH"]
+
+    def download(failed=()):
+        # 模拟下载线程: 取出队列中的 UID, 存储成功的记录为已下载
+        stored = []
+        while auto.UidQueue.qsize():
+            box, uid = auto.UidQueue.get()
+            if uid not in failed:
+                stored.append(uid)
+            auto.UidQueue.done(box, uid, uid not in failed)
+        _record_done(sqlite_db, stored)
+
+    def check():
+        # 首次全量检索
+        todo, searches = discover()
+        assert todo == list(range(11, 61)) and searches[0].startswith("1:")
+        # UID 尚未下载完成时不记录检索位置, 也不重复放入队列
+        todo, searches = discover()
+        assert todo == [] and searches[0].startswith("1:") and auto.UidQueue.qsize() == 50
+        download()
+        # 没有新邮件时只有 STATUS 请求
+        assert discover() == ([], [])
+        assert server.commands["STATUS"] == 1
+        for no in range(3):
+            server.add_message("INBOX", _message(no))
+        todo, searches = discover()
+        assert todo == [61, 62, 63] and searches[0].startswith("61:")
+        # 下载失败的 UID 下次重新检索
+        download(failed=[62])
+        todo, searches = discover()
+        assert todo == [62] and searches[0].startswith("1:")
+        download()
+        assert discover() == ([], [])
+        # UIDVALIDITY 变化时全量检索
+        server.mailboxes["INBOX"].uidvalidity = 2
+        todo, searches = discover()
+        assert todo == [] and searches[0].startswith("1:")
+
+    _in_thread(check)
+
+
+def test_idle(server):
+    box = _imap_box(server)
+    assert box.idle_supported
+    assert box.idle("INBOX", timeout=0.2) == []
+
+    timer = threading.Timer(0.1, lambda: server.wait_idle() and server.add_message("INBOX", _message(61)))
+    timer.start()
+    assert box.idle("INBOX", timeout=5) == [b"61 EXISTS"]
+    timer.join()
+    # IDLE 结束后连接可以继续使用
+    assert box.get_mail_by_uid("INBOX", 61).attr.uid == 61
+    box.logout()
+
+
+def test_idle_buffered():
+    from X2.test.fake_imap import FakeIMAPHandler
+
+    class PushAfterNoopHandler(FakeIMAPHandler):
+        def cmd_noop(self, tag):
+            # 推送与命令响应在同一次写入中, 客户端读取响应时推送进入 imaplib 的缓冲区
+            self.send(f"{tag} OK NOOP completed\r\n* 61 EXISTS\r\n")
+
+    with FakeIMAPServer(PushAfterNoopHandler) as server:
+        server.add_message("INBOX", _message(1))
+        box = _imap_box(server)
+        box.connection.noop()
+        started = time.monotonic()
+        assert box.idle("INBOX", timeout=5) == [b"61 EXISTS"]
+        assert time.monotonic() - started < 1
+        assert box.get_mail_by_uid("INBOX", 1).attr.uid == 1
+        box.logout()
+
+
+def _wait_queue(queue, size, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while queue.qsize() < size and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return queue.qsize()
+
+
+def test_idle_producer(server, tmp_path, monkeypatch):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail import auto
+    monkeypatch.setattr(auto, "UidQueue", auto.FolderQueue())
+    producer = auto.ProduceUID(_imap_box(server), boxes=["INBOX"], lookup_interval=3600,
+                               sqlite_db=_done_db(tmp_path, range(1, 11)), idle=True)
+    producer.daemon = True
+    producer.start()
+    assert _wait_queue(auto.UidQueue, 50) == 50
+    assert server.wait_idle()
+
+    started = time.monotonic()
+    server.add_message("INBOX", _message(61))
+    assert _wait_queue(auto.UidQueue, 51) == 51
+    # 新邮件在一秒内放入队列, 不必等待定时检索
+    assert time.monotonic() - started < 1, time.monotonic() - started
+    assert len(producer.watchers) == 1
+
+
+def test_idle_fallback(tmp_path, monkeypatch):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail import auto
+    from X2.test.fake_imap import FakeIMAPHandler
+
+    class NoIdleHandler(FakeIMAPHandler):
+        capabilities = "IMAP4rev1"
+
+    monkeypatch.setattr(auto, "UidQueue", auto.FolderQueue())
+    with FakeIMAPServer(NoIdleHandler) as server:
+        server.add_message("INBOX", _message(1))
+        producer = auto.ProduceUID(_imap_box(server), boxes=["INBOX"], lookup_interval=0.2,
+                                   sqlite_db=_done_db(tmp_path, []), idle=True)
+        producer.daemon = True
+        producer.start()
+        assert _wait_queue(auto.UidQueue, 1) == 1
+        server.add_message("INBOX", _message(2))
+        # 不支持 IDLE 时定时检索
+        assert _wait_queue(auto.UidQueue, 2) == 2
+        assert producer.watchers == []
+
+
+def test_async_engine(server, tmp_path):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail.engine import AsyncMailEngine, MailAccount
+
+    with FakeIMAPServer() as other:
+        for no in range(1, 31):
+            other.add_message("INBOX", _message(no))
+        accounts = [MailAccount(server.host, "a@fund.com", "pw", boxes=["INBOX"], port=server.port, ssl=False),
+                    MailAccount(other.host, "b@fund.com", "pw", boxes=["INBOX"], port=other.port, ssl=False)]
+        stored, errors = [], []
+        engine = AsyncMailEngine(accounts, store=lambda mail: stored.append((mail.attr.user, mail.attr.uid)),
+                                 on_error=lambda *args: errors.append(args), batch=25, queue_size=1, workers=4,
+                                 sqlite_db=_done_db(tmp_path, range(1, 11), user="a"))
+        asyncio.run(engine.run(once=True))
+        assert sorted(stored) == [("a", uid) for uid in range(11, 61)] + [("b", uid) for uid in range(1, 31)]
+        assert errors == []
+        assert server.commands["UID FETCH"] == 2 and other.commands["UID FETCH"] == 2
+
+        # 没有新邮件时只有 STATUS 请求
+        server.reset_counts()
+        server.add_message("INBOX", _message(61))
+        stored.clear()
+        asyncio.run(engine.run(once=True))
+        assert stored == [("a", 61)]
+        assert [args for name, args in server.history if name == "UID SEARCH"] == [["61:61"]]
+
+
+def test_async_engine_boxes(server, tmp_path):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail.engine import AsyncIMAPConnection, AsyncMailEngine, MailAccount
+
+    for no in range(1, 41):
+        server.add_message("Junk", _message(100 + no))
+
+    async def fetch_boxes():
+        connection = AsyncIMAPConnection(server.host, server.port, ssl=False)
+        await connection.open("a@fund.com", "pw")
+        # 同一连接上不同文件夹的请求交替执行, 每个请求在自己的文件夹中获取邮件
+        boxes = ["INBOX", "Junk"] * 3
+        fetched = await asyncio.gather(*[connection.fetch(box, [1, 2]) for box in boxes])
+        await connection.close()
+        return [[item[1] == server.mailboxes[box].messages[uid] for uid, item in items]
+                for box, items in zip(boxes, fetched)]
+
+    assert asyncio.run(fetch_boxes()) == [[True, True]] * 6
+
+    account = MailAccount(server.host, "a@fund.com", "pw", boxes=["INBOX", "Junk"], port=server.port, ssl=False)
+    stored, errors = [], []
+    # 两个文件夹的批次由多个协程在同一连接上并发下载
+    engine = AsyncMailEngine([account], store=lambda mail: stored.append((mail.attr.box, mail.attr.uid, mail.attr.subject)),
+                             on_error=lambda *args: errors.append(args), batch=5, queue_size=1, workers=8,
+                             max_connections_per_server=8, sqlite_db=_done_db(tmp_path, []))
+    asyncio.run(engine.run(once=True))
+    assert errors == []
+    assert sorted(stored) == sorted([("INBOX", uid, f"对账单 {uid}") for uid in range(1, 61)] +
+                                    [("Junk", uid, f"对账单 {100 + uid}") for uid in range(1, 41)])
+
+
+
+def test_async_engine_checkpoint(server, tmp_path):
+    pytest.importorskip("boto3")
+    from X2.XMessage.xmail.engine import AsyncMailEngine, MailAccount
+    from X2.XMessage.xmail.record import UidCheckpointTable
+
+    account = MailAccount(server.host, "a@fund.com", "pw", boxes=["INBOX"], port=server.port, ssl=False)
+    sqlite_db = _done_db(tmp_path, [])
+    stored = []
+
+    def store(mail):
+        if mail.attr.uid == 30:
+            raise IOError("disk full")
+        stored.append(mail.attr.uid)
+
+    def searches():
+        return [args[-1] for name, args in server.history if name == "UID SEARCH"]
+
+    def checkpoint():
+        with sqlite3.connect(sqlite_db) as conn:
+            return conn.execute(f"SELECT uidvalidity, uidnext FROM {UidCheckpointTable.TableName}").fetchone()
+
+    engine = AsyncMailEngine([account], store=store, batch=25, sqlite_db=sqlite_db)
+    asyncio.run(engine.run(once=True))
+    assert len(stored) == 59 and engine.failed == 1
+    # 有邮件存储失败, 不记录检索位置
+    assert checkpoint() is None
+
+    engine.store = lambda mail: stored.append(mail.attr.uid)
+    stored.clear()
+    server.reset_counts()
+    asyncio.run(engine.run(once=True))
+    assert searches() == ["1:60"] and len(stored) == 60
+    assert checkpoint() == (1, 61)
+
+    server.add_message("INBOX", _message(61))
+    server.reset_counts()
+    stored.clear()
+    asyncio.run(engine.run(once=True))
+    assert searches() == ["61:61"] and stored == [61]
+
+    # 重新启动后首次检索为全量检索
+    server.reset_counts()
+    stored.clear()
+    asyncio.run(AsyncMailEngine([account], store=store, sqlite_db=sqlite_db).run(once=True))
+    assert searches() == ["1:61"]
+
+
+if __name__ == '__main__':
+    test_uid_set()
+    test_iter_fetched()
@@ -8,6 +8,7 @@ __all__ = [
     'create_dir',
     'union_date_tuple',
     'gen_date_regex',
+    'compile_regex',
     'get_file_ext',
     'CompFileMemFree',
     'get_cur_second',
@@ -28,10 +29,12 @@ import re
 import shutil
 import signal
 import tempfile
+import threading
 import time
 import typing as t
 import zipfile
 from collections import OrderedDict
+from functools import lru_cache
 from inspect import getfullargspec
 from io import BytesIO
 from six import text_type
@@ -193,13 +196,31 @@ def gen_date_regex(start_year: int = 2015):
     return REG_DATE
 
 
+@lru_cache(maxsize=2048)
+def compile_regex(pattern: str, flags: int = 0) -> t.Pattern:
+    u"""
+    进程内共享的正则编译缓存, 按最近最少使用淘汰; re 模块自带的缓存容量仅 512 且按先进先出淘汰,
+    券商规则较多时会被其他模块的正则挤出而反复编译
+    """
+    return re.compile(pattern, flags)
+
+
 class CompFileMemFree(object):
     """
-    解压文件
+    解压文件, 子文件不落地
+
+    iter_members 按压缩包内顺序逐个返回匹配的子文件 (名称, 文件对象), 只有迭代到该子文件时才解压;
+    名称/扩展名过滤在解压前完成, 大压缩包中只取少量子文件时只需解压这些子文件.
+    子文件不超过 spool_size 时保存在内存(BytesIO)中, 否则使用 SpooledTemporaryFile(超出部分写入磁盘);
+    嵌套的压缩包会递归解压, 子文件名称以 `/` 拼接外层压缩包名称
     """
 
     # 解压支持文件类型
     _EXTTAG = ('.zip', '.ZIP', '.rar', '.RAR')
+    # 子文件保存在内存中的大小上限
+    SPOOL_SIZE = 32 * 1024 * 1024
+    # 嵌套压缩包最大解压层数
+    MAX_DEPTH = 3
 
     @staticmethod
     def set_rar_executable(path):
@@ -207,88 +228,187 @@ class CompFileMemFree(object):
         # 默认情况下会根据环境命令使用 unrar 命令
         rarfile.UNRAR_TOOL = path
 
+    @staticmethod
+    def matcher(target_ext: t.Union[t.Tuple, str] = None,
+                 target_files: t.Union[t.List, t.Tuple] = None) -> t.Callable[[str], bool]:
+        if target_ext is None and target_files is None:
+            return lambda name: True
+        exts = {target_ext} if isinstance(target_ext, str) else set(target_ext or ())
+        exts = {ext.lower() for ext in exts}
+        files = set(target_files or ())
+
+        def match(name: str) -> bool:
+            return os.path.split(name)[-1] in files or get_file_ext(name, keepraw=False) in exts
+        return match
+
+    @staticmethod
+    def _zip_name(fileinfo: zipfile.ZipInfo) -> str:
+        # 未设置 utf-8 标志位的文件名按 cp437 解码, 国内压缩软件实际多为 GBK 编码
+        if fileinfo.flag_bits & 0x800:
+            return fileinfo.filename
+        try:
+            return fileinfo.filename.encode('cp437').decode('GB18030')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            return fileinfo.filename
+
+    @staticmethod
+    def _archive_opener(filelike) -> t.Optional[t.Callable]:
+        if zipfile.is_zipfile(filelike):
+            return CompFileMemFree._zip_members
+        filelike.seek(0)
+        if rarfile.is_rarfile(filelike):
+            return CompFileMemFree._rar_members
+        return None
+
+    @staticmethod
+    def _spool(source: t.BinaryIO, size: int, spool_size: int) -> t.BinaryIO:
+        if size <= spool_size:
+            target = BytesIO(source.read())
+        else:
+            target = tempfile.SpooledTemporaryFile(max_size=spool_size, mode='wb+')
+            shutil.copyfileobj(source, target)
+            target.seek(0, 0)
+        return target
+
+    @staticmethod
+    @contextmanager
+    def _zip_members(filelike, password: t.ByteString = None) -> t.Iterator[t.List[t.Tuple[str, int, t.Callable]]]:
+        with zipfile.ZipFile(filelike) as zip_handler:
+            members = []
+            for fileinfo in zip_handler.infolist():
+                if fileinfo.is_dir():
+                    continue
+                if fileinfo.flag_bits & 0x1 and password is None:
+                    _logger.warning(f"Member `{fileinfo.filename}` is encrypted, CompFileMemFree skips it.")
+                    continue
+                members.append((CompFileMemFree._zip_name(fileinfo), fileinfo.file_size,
+                                lambda _info=fileinfo: zip_handler.open(_info, pwd=password)))
+            yield members
+
+    @staticmethod
+    @contextmanager
+    def _rar_members(filelike, password: t.ByteString = None) -> t.Iterator[t.List[t.Tuple[str, int, t.Callable]]]:
+        filelike.seek(0)
+        with rarfile.RarFile(filelike) as rar_handler:
+            if password is not None:
+                rar_handler.setpassword(password)
+            # rarfile 直接读取(未压缩)子文件时在共享的文件对象上 seek/read, 没有加锁;
+            # 子文件从打开到关闭期间持有锁, 多个线程同时打开时依次读取
+            lock = threading.Lock()
+
+            @contextmanager
+            def open_member(fileinfo):
+                with lock, rar_handler.open(fileinfo) as source:
+                    yield source
+
+            members = []
+            for fileinfo in rar_handler.infolist():
+                if fileinfo.isdir():
+                    continue
+                if fileinfo.needs_password() and password is None:
+                    _logger.warning(f"Member `{fileinfo.filename}` is encrypted, CompFileMemFree skips it.")
+                    continue
+                members.append((fileinfo.filename, fileinfo.file_size,
+                                lambda _info=fileinfo: open_member(_info)))
+            yield members
+
+    @staticmethod
+    def iter_members(filelike: t.Union[t.BinaryIO, BytesIO],
+                     target_ext: t.Union[t.Tuple, str] = None,
+                     target_files: t.Union[t.List, t.Tuple] = None,
+                     password: t.ByteString = None,
+                     spool_size: int = None,
+                     depth: int = None) -> t.Iterator[t.Tuple[str, t.BinaryIO]]:
+        """
+        逐个解压压缩包(zip/rar)中匹配的子文件
+
+        Args:
+            filelike: 压缩包二进制文件对象
+            target_ext: 需要的子文件扩展名, 不区分大小写
+            target_files: 需要的子文件名称(不含路径); 与 target_ext 都为空时返回所有子文件
+            password: 解压密码, 为空时跳过加密的子文件
+            spool_size: 子文件保存在内存中的大小上限, 默认 SPOOL_SIZE
+            depth: 嵌套压缩包最大解压层数, 默认 MAX_DEPTH
+
+        Returns: (子文件名称, 文件对象) 迭代器, 文件对象已定位到开头
+        """
+        spool_size = CompFileMemFree.SPOOL_SIZE if spool_size is None else spool_size
+        depth = CompFileMemFree.MAX_DEPTH if depth is None else depth
+        match = CompFileMemFree.matcher(target_ext, target_files)
+        with CompFileMemFree.open_archive(filelike, password) as members:
+            for name, size, open_member in members:
+                nested = depth > 0 and CompFileMemFree.is_archive_name(name)
+                if not nested and not match(name):
+                    continue
+                with open_member() as source:
+                    member = CompFileMemFree._spool(source, size, spool_size)
+                if nested and CompFileMemFree._archive_opener(member) is not None:
+                    member.seek(0, 0)
+                    for subname, subfile in CompFileMemFree.iter_members(member, target_ext, target_files, password,
+                                                                         spool_size, depth - 1):
+                        yield f"{name}/{subname}", subfile
+                    member.close()
+                    continue
+                # 扩展名为压缩包但内容不是时按普通文件处理
+                member.seek(0, 0)
+                if not match(name):
+                    member.close()
+                    continue
+                yield name, member
+
+    @staticmethod
+    def is_archive_name(name: str) -> bool:
+        return name.endswith(CompFileMemFree._EXTTAG)
+
+    @staticmethod
+    @contextmanager
+    def open_archive(filelike: t.Union[t.BinaryIO, BytesIO],
+                     password: t.ByteString = None) -> t.Iterator[t.List[t.Tuple[str, int, t.Callable]]]:
+        """
+        打开压缩包(zip/rar), 只读取目录不解压
+
+        Args:
+            filelike: 压缩包二进制文件对象
+            password: 解压密码, 为空时跳过加密的子文件
+
+        Returns: 子文件列表 [(名称, 解压后大小, 打开子文件的函数)], 压缩包关闭前有效;
+                 打开子文件的函数返回上下文管理器, 需在 with 语句中使用; zip 子文件可以在多个线程中
+                 同时打开解压, rar 子文件在多个线程中打开时依次读取
+        """
+        opener = CompFileMemFree._archive_opener(filelike)
+        if opener is None:
+            raise UnexpectedCompatible("File is not be compressed.")
+        with opener(filelike, password) as members:
+            yield members
+
     @staticmethod
     def on(filelike: t.Union[t.TextIO, t.BinaryIO, BytesIO],
            target_ext: t.Union[t.Tuple, str] = None,
            target_files: t.Union[t.List, t.Tuple] = None,
-           password: t.ByteString = None) -> t.OrderedDict[str, tempfile.TemporaryFile]:
+           password: t.ByteString = None) -> t.OrderedDict[str, t.BinaryIO]:
         """
         通过文件句柄对文件进行解压, 当不希望文件落地时建议采用这种方式
         """
-        try:
-            return CompFileMemFree.unzip(filelike)
-        except zipfile.BadZipfile:
-            try:
-                return CompFileMemFree.unrar(filelike)
-            except rarfile.Error:
-                raise UnexpectedCompatible("File is not be compressed.")
+        return OrderedDict(CompFileMemFree.iter_members(filelike, target_ext, target_files, password))
 
     @staticmethod
     def unzip(filelike: t.Union[t.TextIO, t.BinaryIO, BytesIO],
               target_ext: t.Union[t.Tuple, str] = None,
               target_files: t.Union[t.List, t.Tuple] = None,
-              password: t.ByteString = None) -> t.OrderedDict[str, tempfile.TemporaryFile]:
-
-        target_fileinfo = set()
-        with zipfile.ZipFile(filelike) as zip_handler:
-            if any([f.flag_bits & 0x1 for f in zip_handler.filelist]):
-                _logger.warning("This file is a encrypted file, CompFileMemFee does not deal with it.")
-                return OrderedDict()
-            for fileinfo in zip_handler.NameToInfo.keys():
-                filename = os.path.split(fileinfo)[-1]
-                ext = get_file_ext(fileinfo)
-                if target_ext is None and target_files is None:
-                    target_fileinfo.add(fileinfo)
-                    continue
-                if target_files is not None and filename in target_files:
-                    target_fileinfo.add(fileinfo)
-                if target_ext is not None and ext == target_ext:
-                    target_fileinfo.add(fileinfo)
-
-            subfiles_map = OrderedDict()
-            for fileinfo in target_fileinfo:
-                file_data = zip_handler.getinfo(fileinfo)
-                with zip_handler.open(file_data, pwd=password) as source:
-                    target = tempfile.TemporaryFile('wb+')
-                    shutil.copyfileobj(source, target)
-                    target.seek(0, 0)
-                subfiles_map[fileinfo] = target
-            return subfiles_map
+              password: t.ByteString = None) -> t.OrderedDict[str, t.BinaryIO]:
+        if not zipfile.is_zipfile(filelike):
+            raise zipfile.BadZipfile("File is not a zip file")
+        return CompFileMemFree.on(filelike, target_ext, target_files, password)
 
     @staticmethod
-    def unrar(filelike: t.TextIO, des_dir: str = '', allow_ext: t.List = None):
-        pass
-        # subs = []
-        #
-        # fh = filelike
-        # fh.seek(0)
-        #
-        # with rarfile.RarFile(fh) as rf:
-        #     for subfile_info in rf.infolist():
-        #         if not subfile_info.isdir():
-        #             if subfile_info.needs_password():
-        #                 _logger.warning(
-        #                     "This is a encrypted compressed file, but FreeCompFile does not support sort of this.")
-        #                 return []  # encrypted file
-        #             subfile_filename = os.path.split(subfile_info.filename)[-1]
-        #             readable_filename = convert_to_unicode(subfile_filename)
-        #             subfile_path = os.path.join(des_dir, readable_filename)
-        #
-        #             if (allow_ext is not None) and (get_file_ext(readable_filename) not in allow_ext):
-        #                 continue
-        #             with open(subfile_path, 'wb') as subFileHandler:
-        #                 shutil.copyfileobj(rf.open(subfile_info), subFileHandler)
-        #
-        #             subs.append(subfile_path)
-        #
-        # fh.close()
-        #
-        # for filepath in subs:
-        #     if filepath.endswith(CompFileMemFree._EXTTAG):
-        #         subs.remove(filepath)
-        #         subfile_obj = open(filepath, 'rb')
-        #         subs += CompFileMemFree.on(filelike=subfile_obj)
-        # return subs
+    def unrar(filelike: t.Union[t.BinaryIO, BytesIO],
+              target_ext: t.Union[t.Tuple, str] = None,
+              target_files: t.Union[t.List, t.Tuple] = None,
+              password: t.ByteString = None) -> t.OrderedDict[str, t.BinaryIO]:
+        filelike.seek(0)
+        if not rarfile.is_rarfile(filelike):
+            raise rarfile.NotRarFile("File is not a rar file")
+        return CompFileMemFree.on(filelike, target_ext, target_files, password)
 
 
 def get_cur_second(power=0):